@@ -13,6 +13,7 @@ if NOT EXIST %1\ mkdir %1
 
 copy %~p0\..\Support\Python\PyRobotRemote.py %1
 copy %~p0\..\Support\Python\UefiVariablesSupportLib.py %1
+copy %~p0\..\Support\Python\DutTransportLib.py %1
 copy %~p0\PyRobotServer.xml %1
 copy %~p0\SetupDUT.* %1
 
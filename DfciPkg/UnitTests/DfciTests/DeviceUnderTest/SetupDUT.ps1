@@ -79,9 +79,10 @@ Import-Module NetSecurity
 # enable ping response
 New-NetFirewallRule -Name Allow_Ping -DisplayName “Allow Ping”  -Description “Packet Internet Groper ICMPv4” -Protocol ICMPv4 -IcmpType 8 -Enabled True -Profile Any -Action Allow
 
-# allow robotserver port 8270 and 8271
+# allow robotserver port 8270, 8271 and 8272
 New-NetFirewallRule -Name Allow_robotserver -DisplayName “Allow Python Robot server 8270” -Protocol TCP -LocalPort 8270 -Description “PyRobot server” -Enabled True -Profile Any -Action Allow
 New-NetFirewallRule -Name Allow_robotserver2 -DisplayName “Allow Python Robot server 8271” -Protocol TCP -LocalPort 8271 -Description “PyRobot server” -Enabled True -Profile Any -Action Allow
+New-NetFirewallRule -Name Allow_robotserver3 -DisplayName “Allow Python Robot server 8272” -Protocol TCP -LocalPort 8272 -Description “PyRobot framed transport” -Enabled True -Profile Any -Action Allow
 
 ##set up task scheduler to run robot server
 Register-ScheduledTask -Xml (get-content 'PyRobotServer.xml' | out-string) -TaskName "PyRobot Server" –Force
@@ -106,5 +107,6 @@ if ( -not (Test-Path -path C:\Test\Lib -PathType Container )) {
 
 Copy-Item $PSScriptRoot\PyRobotRemote.py -Destination "C:\Test"
 Copy-Item $PSScriptRoot\UefiVariablesSupportLib.py -Destination "C:\Test\Lib"
+Copy-Item $PSScriptRoot\DutTransportLib.py -Destination "C:\Test\Lib"
 
 Write-Host "Please restart your system and verify that the PyRobotRemote server starts automatically."
\ No newline at end of file
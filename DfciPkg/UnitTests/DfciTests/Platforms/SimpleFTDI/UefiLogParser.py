@@ -0,0 +1,314 @@
+# @file
+#
+# UefiLogParser - Match trigger patterns in a UEFI serial log as it is captured
+#
+# Copyright (c), Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+##
+## UefiLogStreamParser is fed the serial log in arbitrary chunks (UefiSerialLogger feeds it from
+## the writer thread) and raises an event for every line that matches a registered trigger:
+##
+##   Trigger        - one line, ie an ASSERT or "ApplySettings - Set <Id> = <Value>. Result = <Status>"
+##   SectionTrigger - the lines between a start and an end marker, ie the setting provider dump
+##                    printed between START and END PRINTING ALL REGISTERED SETTING PROVIDERS
+##
+## All trigger patterns are compiled into one alternation, and only the complete lines of each
+## chunk are scanned with it, so the log is searched in C one chunk at a time.  A literal
+## trigger (Literal=True) is escaped into the same alternation.  Only the lines it finds are
+## matched against the individual triggers.
+##
+## An event is a dictionary:
+##
+##   {"Name": trigger name, "Offset": byte offset of the line, "Timestamp": host time,
+##    "Boot": boots seen so far, "Line": text, "Fields": {field: value}}
+##
+## A section event has "Items" (the field dictionary of each item line) and "Complete" instead
+## of "Line" and "Fields".
+##
+## UefiSerialLogger writes the events to <SerialLogOutput>.events, one JSON event per line.
+## This module is also a Robot Framework library (Library  ${CURDIR}${/}UefiLogParser.py) with
+## keywords that wait for those events, so a test can react while the DUT is still booting.
+##
+
+import json
+import logging
+import os
+import re
+import time
+
+EVENTS_SUFFIX = ".events"
+
+# A longer line without a newline is matched as if it ended here
+MAX_LINE_LENGTH = 64 * 1024
+
+# Name of the trigger that counts boots
+BOOT_TRIGGER = "BootStart"
+
+
+#
+# One line trigger.  Fields names the numbered groups of Pattern.
+#
+class Trigger(object):
+
+    def __init__(self, Name, Pattern, Fields=None, Literal=False):
+        self.Name = Name
+        self.Pattern = re.escape(Pattern) if Literal else Pattern
+        self.Fields = Fields or []
+        self.Regex = re.compile(self.Pattern.encode("utf-8"))
+
+    def Patterns(self):
+        return [self.Pattern]
+
+    #
+    # Return the field dictionary if line matches, else None
+    #
+    def Match(self, line):
+        m = self.Regex.search(line)
+        if m is None:
+            return None
+        return {name: Decode(value) for (name, value) in zip(self.Fields, m.groups())}
+
+
+#
+# Multi line trigger.  Lines matching Item between Start and End are collected.
+#
+class SectionTrigger(object):
+
+    def __init__(self, Name, Start, End, Item, Fields=None):
+        self.Name = Name
+        self.Start = Trigger(Name, Start, Literal=True)
+        self.End = Trigger(Name, End, Literal=True)
+        self.Item = Trigger(Name, Item, Fields)
+
+    def Patterns(self):
+        return [self.Start.Pattern, self.End.Pattern, self.Item.Pattern]
+
+
+DEFAULT_TRIGGERS = [
+    SectionTrigger("SettingProviders",
+                   "START PRINTING ALL REGISTERED SETTING PROVIDERS",
+                   "END PRINTING ALL REGISTERED SETTING PROVIDERS",
+                   r"Id: +(\S+)", ["Id"]),
+    SectionTrigger("SettingGroups",
+                   "START PRINTING ALL REGISTERED GROUPS",
+                   "END PRINTING ALL REGISTERED GROUPS",
+                   r"Group (\S+) members:", ["Group"]),
+    Trigger("ApplyPacket", r"Dfci Manager - Processing Apply Packet for (\S+)\.", ["Mailbox"]),
+    Trigger("SettingResult", r"ApplySettings - Set (\S+) = (.*)\. Result = (.+?)\r?$", ["Id", "Value", "Status"]),
+    Trigger("ApplyError", r"Error applying results for variable (\S+) - (.+?)\r?$", ["Variable", "Status"]),
+    Trigger("Assert", r"ASSERT (?:\[(\S+)\] )?(.+?)\((\d+)\): (.+?)\r?$", ["Module", "File", "Line", "Expression"]),
+    Trigger("ResetSystem", r"ResetSystem2?: ResetType (\S+)", ["ResetType"]),
+    Trigger(BOOT_TRIGGER, "Loading DXE CORE at", Literal=True),
+]
+
+
+def Decode(value):
+    if value is None:
+        return None
+    return value.decode("utf-8", errors="replace")
+
+
+#
+# Load extra triggers from a JSON file:
+#
+#   [ {"Name": "Oops", "Pattern": "Oops: (\\S+)", "Fields": ["Reason"]},
+#     {"Name": "Done", "Pattern": "All done", "Literal": true},
+#     {"Name": "Dump", "Start": "DUMP START", "End": "DUMP END", "Item": "^(\\w+)=", "Fields": ["Key"]} ]
+#
+def LoadTriggers(filepath):
+    with open(filepath, "r") as f:
+        entries = json.load(f)
+    triggers = []
+    for entry in entries:
+        if "Start" in entry:
+            triggers.append(SectionTrigger(entry["Name"], entry["Start"], entry["End"], entry["Item"], entry.get("Fields")))
+        else:
+            triggers.append(Trigger(entry["Name"], entry["Pattern"], entry.get("Fields"), entry.get("Literal", False)))
+    return triggers
+
+
+class UefiLogStreamParser(object):
+
+    def __init__(self, triggers=None):
+        self.Triggers = list(DEFAULT_TRIGGERS if triggers is None else triggers)
+        self.Listeners = []
+        self.Offset = 0
+        self.Boot = 0
+        self.EventCount = 0
+        self._Partial = b''
+        self._PartialTimestamp = None
+        self._Sections = {}
+
+        patterns = []
+        for t in self.Triggers:
+            patterns.extend(t.Patterns())
+        self._Scan = re.compile(b"|".join(b"(?:" + p.encode("utf-8") + b")" for p in patterns), re.MULTILINE)
+
+    #
+    # Call listener(event) for every event
+    #
+    def AddListener(self, listener):
+        self.Listeners.append(listener)
+
+    def _Raise(self, event):
+        self.EventCount += 1
+        for listener in self.Listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logging.error("UEFI log event listener failed: %s" % str(e))
+
+    #
+    # Add the next chunk of the log.  timestamp is the host time the chunk arrived.
+    #
+    def Feed(self, data, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        # Lines that started in an earlier chunk keep the time of that chunk
+        boundary = len(self._Partial)
+        if self._Partial:
+            start = self.Offset - boundary
+            data = self._Partial + data
+        else:
+            start = self.Offset
+        self.Offset = start + len(data)
+        timestamps = (self._PartialTimestamp, boundary, timestamp)
+
+        end = data.rfind(b'\n') + 1
+        if (end == 0) and (len(data) >= MAX_LINE_LENGTH):
+            end = len(data)
+        if end < len(data):
+            self._Partial = data[end:]
+            self._PartialTimestamp = timestamps[0] if (end == 0) and boundary else timestamp
+        else:
+            self._Partial = b''
+        if end:
+            self._ScanLines(data, end, start, timestamps)
+
+    #
+    # Scan the partial last line as if it was complete, ie at the end of the log
+    #
+    def Flush(self):
+        if self._Partial:
+            data = self._Partial
+            self._Partial = b''
+            self._ScanLines(data, len(data), self.Offset - len(data), (self._PartialTimestamp, len(data), None))
+        for (trigger, event) in list(self._Sections.values()):
+            event["Complete"] = False
+            self._Raise(event)
+        self._Sections.clear()
+
+    def _ScanLines(self, data, end, start, timestamps):
+        (partialtimestamp, boundary, timestamp) = timestamps
+        lastline = -1
+        for m in self._Scan.finditer(data, 0, end):
+            linestart = data.rfind(b'\n', 0, m.start()) + 1
+            if linestart == lastline:
+                continue
+            lastline = linestart
+            lineend = data.find(b'\n', m.start(), end)
+            if lineend == -1:
+                lineend = end
+            self._MatchLine(data[linestart:lineend], start + linestart,
+                            partialtimestamp if linestart < boundary else timestamp)
+
+    def _MatchLine(self, line, offset, timestamp):
+        for trigger in self.Triggers:
+            if isinstance(trigger, SectionTrigger):
+                self._MatchSection(trigger, line, offset, timestamp)
+                continue
+            fields = trigger.Match(line)
+            if fields is None:
+                continue
+            if trigger.Name == BOOT_TRIGGER:
+                self.Boot += 1
+            self._Raise({"Name": trigger.Name, "Offset": offset, "Timestamp": timestamp, "Boot": self.Boot,
+                         "Line": Decode(line).rstrip("\r"), "Fields": fields})
+
+    def _MatchSection(self, trigger, line, offset, timestamp):
+        open_event = self._Sections.get(trigger.Name)
+        if open_event is None:
+            if trigger.Start.Match(line) is not None:
+                self._Sections[trigger.Name] = (trigger, {"Name": trigger.Name, "Offset": offset, "Timestamp": timestamp,
+                                                          "Boot": self.Boot, "Items": [], "Complete": True})
+            return
+
+        event = open_event[1]
+        if trigger.End.Match(line) is not None:
+            del self._Sections[trigger.Name]
+            self._Raise(event)
+        elif trigger.Start.Match(line) is not None:
+            # Restarted without an end, ie the DUT reset during the dump
+            event["Complete"] = False
+            self._Raise(event)
+            self._Sections[trigger.Name] = (trigger, {"Name": trigger.Name, "Offset": offset, "Timestamp": timestamp,
+                                                      "Boot": self.Boot, "Items": [], "Complete": True})
+        else:
+            fields = trigger.Item.Match(line)
+            if fields is not None:
+                event["Items"].append(fields)
+
+
+#
+# Listener that appends each event to a JSON lines file
+#
+class EventFileWriter(object):
+
+    def __init__(self, filepath):
+        self.File = open(filepath, "w")
+
+    def __call__(self, event):
+        self.File.write(json.dumps(event) + "\n")
+        self.File.flush()
+
+    def Close(self):
+        self.File.close()
+
+
+#
+# Robot Framework keywords for the events file written by UefiSerialLogger
+#
+class UefiLogParser(object):
+    ROBOT_LIBRARY_SCOPE = 'GLOBAL'
+
+    def __init__(self):
+        self._Readers = {}
+
+    #
+    # Return the events added to the events file since the last call for this log
+    #
+    def _read_new_events(self, logfile):
+        filepath = logfile + EVENTS_SUFFIX
+        (position, pending, events) = self._Readers.get(filepath, (0, '', []))
+        if os.path.isfile(filepath):
+            with open(filepath, "r") as f:
+                if os.fstat(f.fileno()).st_size < position:
+                    # A new capture replaced the file
+                    (position, pending, events) = (0, '', [])
+                f.seek(position)
+                text = pending + f.read()
+                position = f.tell()
+            lines = text.split("\n")
+            pending = lines.pop()
+            events.extend(json.loads(line) for line in lines if line)
+        self._Readers[filepath] = (position, pending, events)
+        return events
+
+    def get_serial_log_events(self, logfile, name=None):
+        events = self._read_new_events(logfile)
+        return [e for e in events if (name is None) or (e["Name"] == name)]
+
+    #
+    # Wait for the event that follows the first 'skip' events of this name.  Returns the event.
+    #
+    def wait_for_serial_log_event(self, logfile, name, timeout=60, skip=0):
+        deadline = time.monotonic() + float(timeout)
+        while True:
+            events = self.get_serial_log_events(logfile, name)
+            if len(events) > int(skip):
+                return events[int(skip)]
+            if time.monotonic() >= deadline:
+                raise Exception("Timeout waiting for serial log event %s in %s" % (name, logfile))
+            time.sleep(0.1)
@@ -0,0 +1,430 @@
+# @file
+#
+# UefiLogStore - Rotating, compressed and indexed storage for UEFI serial logs
+#
+# Copyright (c), Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+##
+## UefiLogStore writes the serial log captured by UefiSerialLogger.  With no rotation and no
+## compression it writes the single plain log file, exactly as before.  Otherwise:
+##
+##   --MaxSize/--MaxAge  start a new segment file once the current one is this large or old.
+##                       Segments are named <root>.0000<ext>, <root>.0001<ext>, ... and are
+##                       only split at the end of a line.
+##   --Compress          gzip or zstd (zstd needs the zstandard package).  Each segment gets
+##                       the matching .gz or .zst suffix and is compressed as it is written.
+##
+## Offsets are always offsets in the whole, uncompressed log.  The sidecar <SerialLogOutput>.index
+## has one JSON entry per line:
+##
+##   {"Type": "Segment", "Segment": n, "Path": file name, "Offset": o, "Timestamp": t}
+##   {"Type": "Checkpoint", "Segment": n, "Offset": o, "Position": p, "Timestamp": t}
+##   {"Type": "Boot", "Boot": b, "Offset": o, "Timestamp": t, "Segment": n, "Position": p, "Base": c}
+##
+## A checkpoint is written every CHECKPOINT_INTERVAL bytes of log, at the start of every
+## segment and after every boot.  A compressed segment starts a new gzip member (or zstd
+## frame) at each checkpoint, so decompression can start at Position of the segment file,
+## which holds the log from offset Offset (Base for a boot entry) on.  Opening the log at a
+## boot or a time only decompresses from the checkpoint before it, not from the start.
+##
+## Boots come from the BootStart event of UefiLogParser.  UefiLogIndex reads the index, and
+## this script extracts a boot, a time or an offset range of a stored log:
+##
+##   python UefiLogStore.py --Log UefiSerialLog.log --Boot 3 --Output Boot3.log
+##
+
+import os, sys
+import argparse
+import bisect
+import gzip
+import json
+import logging
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_SUFFIX = ".index"
+
+COMPRESSION_SUFFIX = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+# Log bytes between index checkpoints.  Bounds the decompression needed to open the log at any offset
+CHECKPOINT_INTERVAL = 1024 * 1024
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Segment file write buffer size
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+# Recent checkpoints kept to find the checkpoint before a boot line
+RECENT_CHECKPOINTS = 64
+
+
+#
+# Name of segment 'segment' of LogFile.  None is the unrotated log.
+#
+def SegmentPath(LogFile, segment, compress):
+    if segment is None:
+        return LogFile + COMPRESSION_SUFFIX[compress]
+    (root, ext) = os.path.splitext(LogFile)
+    return "%s.%04d%s%s" % (root, segment, ext, COMPRESSION_SUFFIX[compress])
+
+
+#
+# Compression type from the name of a segment file
+#
+def CompressionOf(path):
+    for (compress, suffix) in COMPRESSION_SUFFIX.items():
+        if suffix and path.endswith(suffix):
+            return compress
+    return None
+
+
+class UefiLogStore(object):
+
+    def __init__(self, LogFile, MaxBytes=0, MaxSeconds=0, Compress=None):
+        if Compress not in COMPRESSION_SUFFIX:
+            raise Exception("Unsupported log compression %s" % Compress)
+        if (Compress == "zstd") and (zstandard is None):
+            raise Exception("The zstandard package is required for zstd log compression")
+
+        self.LogFile = LogFile
+        self.MaxBytes = MaxBytes
+        self.MaxSeconds = MaxSeconds
+        self.Compress = Compress
+        self.Rotate = bool(MaxBytes or MaxSeconds)
+        self.Offset = 0
+        self.Segment = -1
+        self.Boot = 0
+        self._Raw = None
+        self._Writer = None
+        self._SegmentStart = 0
+        self._SegmentOpened = 0
+        self._Checkpoints = []
+        self._Index = open(LogFile + INDEX_SUFFIX, "w")
+        self._OpenSegment(time.time())
+
+    def _IndexEntry(self, entry):
+        self._Index.write(json.dumps(entry) + "\n")
+
+    def _OpenSegment(self, timestamp):
+        self.Segment += 1
+        path = SegmentPath(self.LogFile, self.Segment if self.Rotate else None, self.Compress)
+        self._Raw = open(path, "wb", buffering=WRITE_BUFFER_SIZE)
+        self._SegmentStart = self.Offset
+        self._SegmentOpened = time.monotonic()
+        self._IndexEntry({"Type": "Segment", "Segment": self.Segment, "Path": os.path.basename(path),
+                          "Offset": self.Offset, "Timestamp": timestamp})
+        self._StartCheckpoint(timestamp)
+
+    def _CloseWriter(self):
+        if self._Writer is not None:
+            self._Writer.close()
+            self._Writer = None
+
+    #
+    # Start a new gzip member or zstd frame, and index where it is
+    #
+    def _StartCheckpoint(self, timestamp):
+        self._CloseWriter()
+        position = self._Raw.tell()
+        if self.Compress == "gzip":
+            self._Writer = gzip.GzipFile(fileobj=self._Raw, mode="wb", compresslevel=GZIP_LEVEL, mtime=0)
+        elif self.Compress == "zstd":
+            self._Writer = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(self._Raw, closefd=False)
+        checkpoint = {"Type": "Checkpoint", "Segment": self.Segment, "Offset": self.Offset,
+                      "Position": position, "Timestamp": timestamp}
+        self._Checkpoints.append(checkpoint)
+        del self._Checkpoints[:-RECENT_CHECKPOINTS]
+        self._IndexEntry(checkpoint)
+
+    def _CloseSegment(self):
+        self._CloseWriter()
+        self._Raw.close()
+        self._Raw = None
+
+    def _RotateDue(self):
+        if not self.Rotate:
+            return False
+        if self.MaxBytes and ((self.Offset - self._SegmentStart) >= self.MaxBytes):
+            return True
+        if self.MaxSeconds and ((time.monotonic() - self._SegmentOpened) >= self.MaxSeconds):
+            return True
+        return False
+
+    def _Write(self, data):
+        if self._Writer is not None:
+            self._Writer.write(data)
+        else:
+            self._Raw.write(data)
+        self.Offset += len(data)
+
+    #
+    # Append data that arrived at host time timestamp
+    #
+    def write(self, data, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        view = memoryview(data)
+        pos = 0
+        lineend = 0  # end of the line to finish before rotating, past len(data) if it ends in a later write
+        while pos < len(data):
+            if (self.Offset - self._Checkpoints[-1]["Offset"]) >= CHECKPOINT_INTERVAL:
+                self._StartCheckpoint(timestamp)
+            end = min(len(data), pos + CHECKPOINT_INTERVAL - (self.Offset - self._Checkpoints[-1]["Offset"]))
+            if self._RotateDue():
+                # Finish the current line in this segment.  Search for its end once, not per slice.
+                if lineend <= pos:
+                    lineend = (data.find(b'\n', pos) + 1) or (len(data) + 1)
+                if lineend <= end:
+                    self._Write(view[pos:lineend])
+                    pos = lineend
+                    self._CloseSegment()
+                    self._OpenSegment(timestamp)
+                    continue
+            elif self.MaxBytes:
+                # Stop at the size limit so the rotation starts at the end of this line
+                end = min(end, pos + self.MaxBytes - (self.Offset - self._SegmentStart))
+            self._Write(view[pos:end])
+            pos = end
+
+    #
+    # Index a boot that starts at log offset 'offset' (already written)
+    #
+    def MarkBoot(self, offset, timestamp):
+        self.Boot += 1
+        base = self._Checkpoints[0]
+        for checkpoint in reversed(self._Checkpoints):
+            if checkpoint["Offset"] <= offset:
+                base = checkpoint
+                break
+        self._IndexEntry({"Type": "Boot", "Boot": self.Boot, "Offset": offset, "Timestamp": timestamp,
+                          "Segment": base["Segment"], "Position": base["Position"], "Base": base["Offset"]})
+        # The log after the boot line is reachable without decompressing the boot line's checkpoint
+        self._StartCheckpoint(timestamp)
+
+    def flush(self):
+        if self._Writer is not None:
+            self._Writer.flush()
+        self._Raw.flush()
+        self._Index.flush()
+
+    def close(self):
+        if self._Raw is not None:
+            self._CloseSegment()
+        self._Index.close()
+
+
+#
+# Read the index of a stored log, and open the log at an offset, boot or time
+#
+class UefiLogIndex(object):
+
+    def __init__(self, LogFile):
+        self.LogFile = LogFile
+        self.Folder = os.path.dirname(os.path.abspath(LogFile))
+        self.Segments = []
+        self.Checkpoints = []
+        self.Boots = []
+        with open(LogFile + INDEX_SUFFIX, "r") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    # Partly written last entry of a log that is still being captured
+                    break
+                entry = json.loads(line)
+                if entry["Type"] == "Segment":
+                    self.Segments.append(entry)
+                elif entry["Type"] == "Checkpoint":
+                    self.Checkpoints.append(entry)
+                elif entry["Type"] == "Boot":
+                    self.Boots.append(entry)
+        self._CheckpointOffsets = [c["Offset"] for c in self.Checkpoints]
+        self._CheckpointTimes = [c["Timestamp"] for c in self.Checkpoints]
+
+    #
+    # Return a readable binary file of the whole log from offset on
+    #
+    def OpenAt(self, offset):
+        i = bisect.bisect_right(self._CheckpointOffsets, offset) - 1
+        if i < 0:
+            raise Exception("Offset %d is not in %s" % (offset, self.LogFile))
+        checkpoint = self.Checkpoints[i]
+        return self._Open(checkpoint["Segment"], checkpoint["Position"], offset - checkpoint["Offset"])
+
+    #
+    # Open the log at boot number boot (1 is the first boot seen)
+    #
+    def OpenBoot(self, boot):
+        for entry in self.Boots:
+            if entry["Boot"] == boot:
+                return self._Open(entry["Segment"], entry["Position"], entry["Offset"] - entry["Base"])
+        raise Exception("Boot %d is not in %s" % (boot, self.LogFile))
+
+    #
+    # Return (start, end) offsets of boot number boot.  end is None for the last boot.
+    #
+    def BootRange(self, boot):
+        for (i, entry) in enumerate(self.Boots):
+            if entry["Boot"] == boot:
+                end = self.Boots[i + 1]["Offset"] if (i + 1) < len(self.Boots) else None
+                return (entry["Offset"], end)
+        raise Exception("Boot %d is not in %s" % (boot, self.LogFile))
+
+    #
+    # Offset of the last checkpoint at or before host time timestamp.  Use the
+    # .timestamps file of UefiSerialLogger for the exact line.
+    #
+    def OffsetForTime(self, timestamp):
+        i = bisect.bisect_right(self._CheckpointTimes, timestamp) - 1
+        return self.Checkpoints[max(i, 0)]["Offset"]
+
+    def _Open(self, segment, position, skip):
+        stream = LogStream(self, segment, position)
+        while skip > 0:
+            data = stream.read(min(skip, READ_BLOCK_SIZE))
+            if not data:
+                break
+            skip -= len(data)
+        return stream
+
+
+#
+# Read only binary stream over the segments of a stored log
+#
+class LogStream(object):
+
+    def __init__(self, index, segment, position):
+        self.Index = index
+        self.Segment = segment
+        self._Raw = None
+        self._Reader = None
+        self._OpenSegment(position)
+
+    def _OpenSegment(self, position):
+        path = os.path.join(self.Index.Folder, self.Index.Segments[self.Segment]["Path"])
+        self._Raw = open(path, "rb")
+        self._Raw.seek(position)
+        compress = CompressionOf(path)
+        if compress == "gzip":
+            self._Reader = gzip.GzipFile(fileobj=self._Raw, mode="rb")
+        elif compress == "zstd":
+            if zstandard is None:
+                raise Exception("The zstandard package is required to read %s" % path)
+            self._Reader = zstandard.ZstdDecompressor().stream_reader(self._Raw, read_across_frames=True)
+        else:
+            self._Reader = self._Raw
+
+    def read(self, size=-1):
+        chunks = []
+        while (size < 0) or (size > 0):
+            try:
+                data = self._Reader.read(size if size > 0 else READ_BLOCK_SIZE)
+            except EOFError:
+                # Compressed segment that is still being written
+                data = b''
+            if data:
+                chunks.append(data)
+                if size > 0:
+                    size -= len(data)
+                continue
+            if (self.Segment + 1) >= len(self.Index.Segments):
+                break
+            self.close()
+            self.Segment += 1
+            self._OpenSegment(0)
+        return b''.join(chunks)
+
+    def __iter__(self):
+        while True:
+            data = self.read(READ_BLOCK_SIZE)
+            if not data:
+                break
+            yield data
+
+    def close(self):
+        if self._Reader is not self._Raw:
+            self._Reader.close()
+        self._Raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+#
+#main script function
+#
+def main():
+    parser = argparse.ArgumentParser(description='Extract part of a stored UEFI serial log')
+
+    parser.add_argument("--Log", dest="Log", help="SerialLogOutput name the log was captured with", required=True)
+    parser.add_argument("--Boot", dest="Boot", type=int, help="Extract this boot (1 is the first)", default=None)
+    parser.add_argument("--Time", dest="Time", type=float, help="Extract from this host time (seconds since the epoch)", default=None)
+    parser.add_argument("--Offset", dest="Offset", type=int, help="Extract from this log offset", default=0)
+    parser.add_argument("--Length", dest="Length", type=int, help="Bytes to extract.  Default is to the next boot, or the end", default=None)
+    parser.add_argument("--ListBoots", action="store_true", dest="ListBoots", help="List the boots in the log", default=False)
+    parser.add_argument("--Output", dest="Output", help="Output file.  Default is stdout", default=None)
+    options = parser.parse_args()
+
+    index = UefiLogIndex(options.Log)
+
+    if options.ListBoots:
+        for entry in index.Boots:
+            print("Boot %d  Offset %d  Time %s" % (entry["Boot"], entry["Offset"],
+                  time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["Timestamp"]))))
+        return 0
+
+    length = options.Length
+    if options.Boot is not None:
+        stream = index.OpenBoot(options.Boot)
+        (start, end) = index.BootRange(options.Boot)
+        if (length is None) and (end is not None):
+            length = end - start
+    elif options.Time is not None:
+        stream = index.OpenAt(index.OffsetForTime(options.Time))
+    else:
+        stream = index.OpenAt(options.Offset)
+
+    out = open(options.Output, "wb") if options.Output else sys.stdout.buffer
+    try:
+        with stream:
+            while (length is None) or (length > 0):
+                data = stream.read(READ_BLOCK_SIZE if length is None else min(length, READ_BLOCK_SIZE))
+                if not data:
+                    break
+                out.write(data)
+                if length is not None:
+                    length -= len(data)
+    finally:
+        if options.Output:
+            out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    #setup main console as logger
+    logger = logging.getLogger('')
+    logger.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(levelname)s - %(message)s")
+    console = logging.StreamHandler()
+    console.setLevel(logging.CRITICAL)
+    console.setFormatter(formatter)
+    logger.addHandler(console)
+
+    #call main worker function
+    retcode = main()
+
+    if retcode != 0:
+        logging.critical("Failed.  Return Code: %i" % retcode)
+    #end logging
+    logging.shutdown()
+    sys.exit(retcode)
@@ -6,13 +6,108 @@
 # SPDX-License-Identifier: BSD-2-Clause-Patent
 ##
 
+##
+## Each port is captured by two threads:
+##
+##   Reader - reads everything the driver has buffered (in_waiting) in one call, and hands the
+##            chunk, with its host arrival time, to a bounded ring buffer.  It never waits on
+##            the disk, so the FTDI receive buffer is drained at line rate.
+##   Writer - takes every chunk in the ring at once and writes them as one batch to a buffered
+##            log file, flushing every FLUSH_INTERVAL seconds.
+##
+## If the writer falls behind by more than RING_BUFFER_SIZE bytes, new chunks are dropped and
+## counted (DroppedBytes, Overruns) instead of stalling the reader.  The serial log file is
+## written unchanged.  The host time of each line is written to a sidecar file,
+## <SerialLogOutput>.timestamps, as "<byte offset of the line> <seconds since the epoch>".
+##
+## The writer also feeds each chunk to a UefiLogStreamParser (UefiLogParser.py), which writes an
+## event for every trigger match to <SerialLogOutput>.events as soon as the line arrives.
+##
+## The log is written through a UefiLogStore (UefiLogStore.py).  --MaxSize, --MaxAge and
+## --Compress rotate and compress it, and <SerialLogOutput>.index maps times and boots to log
+## offsets.
+##
+
 import os, sys
 import argparse
 import logging
 import datetime
 import time
+import threading
+import collections
 import serial
 import serial.tools.list_ports
+import UefiLogParser
+import UefiLogStore
+
+# Bytes the reader may get ahead of the writer before chunks are dropped
+RING_BUFFER_SIZE = 16 * 1024 * 1024
+
+# Largest single read from the serial port
+MAX_READ_SIZE = 1024 * 1024
+
+# Serial read timeout.  Bounds how long the reader takes to notice Stop()
+READ_TIMEOUT = 0.1
+
+# Seconds between log file flushes
+FLUSH_INTERVAL = 0.5
+
+TIMESTAMP_SUFFIX = ".timestamps"
+
+
+#
+# Bounded FIFO of (timestamp, bytes) chunks between the reader and the writer
+#
+class ChunkRingBuffer(object):
+
+    def __init__(self, capacity=RING_BUFFER_SIZE):
+        self.Capacity = capacity
+        self.Size = 0
+        self.DroppedBytes = 0
+        self.Overruns = 0
+        self.HighWater = 0
+        self._Chunks = collections.deque()
+        self._Closed = False
+        self._Cond = threading.Condition()
+
+    #
+    # Add a chunk.  Returns False if the chunk did not fit and was dropped.
+    #
+    def Put(self, data, timestamp):
+        with self._Cond:
+            if (self.Size + len(data)) > self.Capacity:
+                self.DroppedBytes += len(data)
+                self.Overruns += 1
+                return False
+            self._Chunks.append((timestamp, data))
+            self.Size += len(data)
+            if self.Size > self.HighWater:
+                self.HighWater = self.Size
+            self._Cond.notify()
+            return True
+
+    #
+    # Remove and return every buffered chunk.  Waits up to timeout seconds for the first one.
+    # Returns an empty list on timeout, or once closed and empty.
+    #
+    def GetAll(self, timeout=None):
+        with self._Cond:
+            if (not self._Chunks) and (not self._Closed):
+                self._Cond.wait(timeout)
+            chunks = list(self._Chunks)
+            self._Chunks.clear()
+            self.Size = 0
+            return chunks
+
+    def Close(self):
+        with self._Cond:
+            self._Closed = True
+            self._Cond.notify_all()
+
+    def IsClosed(self):
+        with self._Cond:
+            return self._Closed and (not self._Chunks)
+
 
 class UefiSerialLogging(object):
 
@@ -44,36 +139,211 @@ class UefiSerialLogging(object):
         else:
             return None
 
-    def __init__(self, skip=0, baud=6000000):  #buad rate default is 6mbps
+    def __init__(self, skip=0, baud=6000000, port=None, ringsize=RING_BUFFER_SIZE, timestamps=True, events=True, triggers=None,
+                 maxbytes=0, maxseconds=0, compress=None):  #buad rate default is 6mbps
         self.s = serial.Serial()
-        portname = UefiSerialLogging.FindUefiSerialPort(skip)
+        portname = port if port is not None else UefiSerialLogging.FindUefiSerialPort(skip)
+        if portname is None:
+            raise Exception("Unable to locate the UEFI serial port (skip %d)" % skip)
         self.s.port = portname
         self.s.baudrate = baud
         self.s.bytesize = serial.EIGHTBITS #8
         self.s.parity = serial.PARITY_NONE #N
         self.s.stopbits = serial.STOPBITS_ONE #1
-        self.s.timeout = 5  #5 second timeout
+        self.s.timeout = READ_TIMEOUT
+
+        self.Ring = ChunkRingBuffer(ringsize)
+        self.Timestamps = timestamps
+        self.MaxBytes = maxbytes
+        self.MaxSeconds = maxseconds
+        self.Compress = compress
+        self.LogFile = None
+        self.TimestampFile = None
+        self.Parser = UefiLogParser.UefiLogStreamParser(triggers) if events else None
+        self.EventFile = None
+        self.BytesRead = 0
+        self.BytesWritten = 0
+        self.Reads = 0
+        self.Writes = 0
+        self.ReadErrors = 0
+        self.WriteErrors = 0
+        self._AtLineStart = True
+        self._Stop = threading.Event()
+        self._Reader = None
+        self._Writer = None
 
         if(int(serial.VERSION.partition(".")[0]) < 3):
             logging.critical("Old pyserial (%s).  Please update as this only supports the newer 3.0 pyserial syntax." % serial.VERSION)
 
+    #
+    # Reader thread.  One bulk read of whatever is waiting, or block up to READ_TIMEOUT for one byte.
+    #
+    def _ReadLoop(self):
+        while not self._Stop.is_set():
+            try:
+                waiting = self.s.in_waiting
+                data = self.s.read(min(max(waiting, 1), MAX_READ_SIZE))
+            except (serial.SerialException, OSError) as e:
+                self.ReadErrors += 1
+                logging.error("Serial read failed on %s: %s" % (self.s.port, str(e)))
+                time.sleep(READ_TIMEOUT)
+                continue
+            if data:
+                self.Reads += 1
+                self.BytesRead += len(data)
+                if not self.Ring.Put(data, time.time()):
+                    logging.debug("Ring buffer full on %s, dropped %d bytes" % (self.s.port, len(data)))
 
-    def Start_Logging(self, LogFile):
-        self.LogFile = open(LogFile, "wb")  #do as binary because serial read function returns byte string
+        # Get what is left in the driver buffer after the stop request
+        try:
+            waiting = self.s.in_waiting
+            if waiting:
+                data = self.s.read(waiting)
+                self.BytesRead += len(data)
+                self.Ring.Put(data, time.time())
+        except (serial.SerialException, OSError):
+            self.ReadErrors += 1
+        self.Ring.Close()
+
+    #
+    # Record the byte offset and arrival time of every line that starts in this chunk
+    #
+    def _WriteTimestamps(self, offset, data, timestamp):
+        entries = []
+        stamp = "%.6f\n" % timestamp
+        if self._AtLineStart:
+            entries.append("%d %s" % (offset, stamp))
+        end = len(data) - 1
+        index = data.find(b'\n')
+        while (index != -1) and (index < end):
+            entries.append("%d %s" % (offset + index + 1, stamp))
+            index = data.find(b'\n', index + 1)
+        self._AtLineStart = data.endswith(b'\n')
+        if entries:
+            self.TimestampFile.write("".join(entries))
+
+    #
+    # Writer thread.  Writes every buffered chunk as one batch.
+    #
+    def _WriteLoop(self):
+        lastflush = time.monotonic()
+        while True:
+            chunks = self.Ring.GetAll(FLUSH_INTERVAL)
+            if chunks:
+                try:
+                    if self.TimestampFile is not None:
+                        offset = self.BytesWritten
+                        for (timestamp, data) in chunks:
+                            self._WriteTimestamps(offset, data, timestamp)
+                            offset += len(data)
+                    batch = b''.join(data for (timestamp, data) in chunks)
+                    self.LogFile.write(batch, chunks[0][0])
+                    self.BytesWritten += len(batch)
+                    self.Writes += 1
+                except OSError as e:
+                    self.WriteErrors += 1
+                    logging.error("Serial log write failed: %s" % str(e))
+                if self.Parser is not None:
+                    for (timestamp, data) in chunks:
+                        self.Parser.Feed(data, timestamp)
+            elif self.Ring.IsClosed():
+                break
+
+            if (time.monotonic() - lastflush) >= FLUSH_INTERVAL:
+                self._Flush()
+                lastflush = time.monotonic()
+        if self.Parser is not None:
+            self.Parser.Flush()
+        self._Flush()
+
+    def _Flush(self):
+        try:
+            self.LogFile.flush()
+            if self.TimestampFile is not None:
+                self.TimestampFile.flush()
+        except OSError as e:
+            self.WriteErrors += 1
+            logging.error("Serial log flush failed: %s" % str(e))
+
+    #
+    # Index boots in the log store.  Runs on the writer thread.
+    #
+    def _OnEvent(self, event):
+        if event["Name"] == UefiLogParser.BOOT_TRIGGER:
+            self.LogFile.MarkBoot(event["Offset"], event["Timestamp"])
+
+    #
+    # Open the port and start the reader and writer threads.  Returns immediately.
+    #
+    def Start(self, LogFile):
+        self.LogFile = UefiLogStore.UefiLogStore(LogFile, self.MaxBytes, self.MaxSeconds, self.Compress)
+        if self.Timestamps:
+            self.TimestampFile = open(LogFile + TIMESTAMP_SUFFIX, "w")
+        if self.Parser is not None:
+            self.EventFile = UefiLogParser.EventFileWriter(LogFile + UefiLogParser.EVENTS_SUFFIX)
+            self.Parser.AddListener(self.EventFile)
+            self.Parser.AddListener(self._OnEvent)
         self.s.open()
+        self._Stop.clear()
+        self._Reader = threading.Thread(target=self._ReadLoop, name="SerialReader-%s" % self.s.port, daemon=True)
+        self._Writer = threading.Thread(target=self._WriteLoop, name="SerialWriter-%s" % self.s.port, daemon=True)
+        self._Writer.start()
+        self._Reader.start()
+
+    #
+    # Stop reading, write everything that was buffered and close the port and files
+    #
+    def Stop(self):
+        self._Stop.set()
+        if self._Reader is not None:
+            self._Reader.join()
+        if self._Writer is not None:
+            self._Writer.join()
+        self.s.close()
+        if self.LogFile is not None:
+            self.LogFile.close()
+        if self.TimestampFile is not None:
+            self.TimestampFile.close()
+        if self.EventFile is not None:
+            self.EventFile.Close()
+
+    def GetStats(self):
+        return {"Port": self.s.port,
+                "BytesRead": self.BytesRead,
+                "BytesWritten": self.BytesWritten,
+                "Reads": self.Reads,
+                "Writes": self.Writes,
+                "DroppedBytes": self.Ring.DroppedBytes,
+                "Overruns": self.Ring.Overruns,
+                "RingHighWater": self.Ring.HighWater,
+                "ReadErrors": self.ReadErrors,
+                "WriteErrors": self.WriteErrors,
+                "Events": self.Parser.EventCount if self.Parser is not None else 0}
+
+    def LogStats(self, level=logging.INFO):
+        logging.log(level, " ".join("%s=%s" % (k, v) for (k, v) in self.GetStats().items()))
+
+    def Start_Logging(self, LogFile):
+        self.Start(LogFile)
         try:
-            while( True):
-                self.LogFile.write(self.s.read(1000))
+            while(True):
+                time.sleep(1)
         except (KeyboardInterrupt, SystemExit):
-            self.LogFile.write(self.s.read())  #do one more read to make sure we got everything
-            self.s.close()
-            self.LogFile.close()
             pass
 
         finally:
-            self.LogFile.write(self.s.read())  #do one more read to make sure we got everything
-            self.s.close()
-            self.LogFile.close()
+            self.Stop()
+            self.LogStats(logging.CRITICAL)
+
+
+#
+# Name of the log file for one of several ports, ie UefiSerialLog_COM7.log
+#
+def LogFileForPort(LogFile, port, count):
+    if count == 1:
+        return LogFile
+    (root, ext) = os.path.splitext(LogFile)
+    return "%s_%s%s" % (root, os.path.basename(port), ext)
 
 
 #
@@ -88,6 +358,17 @@ def main():
     #Turn on debug level logging
     parser.add_argument("--debug", action="store_true", dest="debug", help="turn on debug logging level for file log",  default=False)
     parser.add_argument("--SerialLogOutput", dest="SerialLogOutput", help="Output file to Log all Serial Output to", default="UefiSerialLog.log")
+    parser.add_argument("--Skip", dest="Skip", type=int, nargs="+", help="FTDI device(s) to capture, by index: ie --Skip 0 1", default=None)
+    parser.add_argument("--Port", dest="Port", nargs="+", help="Serial port(s) to capture, by name: ie --Port COM7 COM11", default=None)
+    parser.add_argument("--Baud", dest="Baud", type=int, help="Baud rate", default=6000000)
+    parser.add_argument("--RingSize", dest="RingSize", type=int, help="Bytes buffered per port before data is dropped", default=RING_BUFFER_SIZE)
+    parser.add_argument("--NoTimestamps", action="store_true", dest="NoTimestamps", help="Do not write the line timestamp file", default=False)
+    parser.add_argument("--StatsInterval", dest="StatsInterval", type=int, help="Seconds between counter reports, 0 for only at exit", default=0)
+    parser.add_argument("--NoEvents", action="store_true", dest="NoEvents", help="Do not parse the log or write the events file", default=False)
+    parser.add_argument("--Triggers", dest="Triggers", help="JSON file of extra triggers to match in the log", default=None)
+    parser.add_argument("--MaxSize", dest="MaxSize", type=int, help="Start a new log segment after this many MB, 0 for no limit", default=0)
+    parser.add_argument("--MaxAge", dest="MaxAge", type=int, help="Start a new log segment after this many seconds, 0 for no limit", default=0)
+    parser.add_argument("--Compress", dest="Compress", choices=["gzip", "zstd"], help="Compress the log segments", default=None)
     options = parser.parse_args()
 
     #setup file based logging if outputReport specified
@@ -108,10 +389,41 @@ def main():
 
     logging.info("Log Started: " + datetime.datetime.strftime(datetime.datetime.now(), "%A, %B %d, %Y %I:%M%p" ))
 
-    logging.critical("Logging all Serial output to: %s" % options.SerialLogOutput)
+    if options.Port:
+        ports = [(p, 0) for p in options.Port]
+    else:
+        ports = [(None, s) for s in (options.Skip or [0])]
+
+    triggers = None
+    if options.Triggers:
+        triggers = UefiLogParser.DEFAULT_TRIGGERS + UefiLogParser.LoadTriggers(options.Triggers)
+
+    loggers = []
+    try:
+        for (port, skip) in ports:
+            a = UefiSerialLogging(skip=skip, baud=options.Baud, port=port, ringsize=options.RingSize,
+                                  timestamps=not options.NoTimestamps, events=not options.NoEvents, triggers=triggers,
+                                  maxbytes=options.MaxSize * 1024 * 1024, maxseconds=options.MaxAge, compress=options.Compress)
+            logfile = LogFileForPort(options.SerialLogOutput, a.s.port, len(ports))
+            logging.critical("Logging all Serial output from %s to: %s" % (a.s.port, logfile))
+            a.Start(logfile)
+            loggers.append(a)
+
+        lastreport = time.monotonic()
+        while(True):
+            time.sleep(1)
+            if options.StatsInterval and ((time.monotonic() - lastreport) >= options.StatsInterval):
+                for a in loggers:
+                    a.LogStats(logging.CRITICAL)
+                lastreport = time.monotonic()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+    finally:
+        for a in loggers:
+            a.Stop()
+            a.LogStats(logging.CRITICAL)
 
-    a = UefiSerialLogging()
-    a.Start_Logging(options.SerialLogOutput)
     logging.critical("Finished")
     return 0
 
@@ -0,0 +1,267 @@
+# Load generator and latency benchmark for the DFCI refresh server.
+#
+# Replays the device flows against the server at a configurable concurrency:
+#
+#   bootstrap - POST /ztd/unauthenticated/dfci/recovery-bootstrap, follow the 202 Location,
+#               GET the bootstrap status
+#   recovery  - POST /ztd/unauthenticated/dfci/recovery-packets (https), follow the 202 Location,
+#               GET the recovery packets status
+#
+# and reports requests per second and p50/p95/p99 latency per request type.
+#
+# By default the dfci_refresh_server app from ../Src/main.py is started in this process on
+# ephemeral ports (HTTP, and HTTPS with a throw away certificate), using a temporary request,
+# response and config folder.  Use --http-base/--https-base to measure a running server
+# (server.py or server_async.py) instead.
+#
+# Usage:
+#   python3 benchmark.py --concurrency 32 --flows 2000
+#   python3 benchmark.py --http-base http://myserver --https-base https://myserver --body Expected_Request.json
+
+
+import argparse
+import http.client
+import json
+import logging
+import math
+import os
+import ssl
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Src'))
+
+BOOTSTRAP_PATH = '/ztd/unauthenticated/dfci/recovery-bootstrap'
+RECOVERY_PATH = '/ztd/unauthenticated/dfci/recovery-packets'
+
+REQUEST_TYPES = ['bootstrap POST', 'bootstrap GET', 'recovery POST', 'recovery GET']
+
+
+#
+# Start the Flask app on ephemeral local ports.  Returns (http_base, https_base, servers).
+#
+def start_local_server(request_body):
+    import main
+    from werkzeug.serving import make_server
+
+    folder = tempfile.mkdtemp(prefix='dfci_bench_')
+    request_folder = os.path.join(folder, 'Requests')
+    response_folder = os.path.join(folder, 'Responses')
+    os.makedirs(request_folder)
+    os.makedirs(response_folder)
+
+    with open(os.path.join(request_folder, 'Expected_Request.json'), 'wb') as f:
+        f.write(request_body)
+    for name in ('Bootstrap_NULLResponse.json', 'Bootstrap_Response.json', 'Recovery_Response.json'):
+        with open(os.path.join(response_folder, name), 'w') as f:
+            json.dump({'ResultCode': '0', 'ResultMessage': name}, f)
+
+    main.dfci_refresh_server.config['REQUEST_FOLDER'] = request_folder
+    main.dfci_refresh_server.config['RESPONSE_FOLDER'] = response_folder
+    main.DfciTest_Config = os.path.join(folder, 'DfciTests.ini')
+    # Per request logging would dominate the measurement
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    with open(main.DfciTest_Config, 'w') as f:
+        f.write('[DfciTest]\nserver_host_name = 127.0.0.1\n')
+
+    http_server = make_server('127.0.0.1', 0, main.dfci_refresh_server, threaded=True)
+    https_server = make_server('127.0.0.1', 0, main.dfci_refresh_server, threaded=True, ssl_context='adhoc')
+
+    for server in (http_server, https_server):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return ('http://127.0.0.1:%d' % http_server.server_port,
+            'https://127.0.0.1:%d' % https_server.server_port,
+            [http_server, https_server])
+
+
+#
+# One simulated device.  Keeps one connection per scheme open across flows.
+#
+class Device(object):
+
+    def __init__(self, http_base, https_base, body):
+        self.bases = {'http': urllib.parse.urlsplit(http_base), 'https': urllib.parse.urlsplit(https_base)}
+        self.body = body
+        self.connections = {}
+        self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+        self.ssl_context.maximum_version = ssl.TLSVersion.TLSv1_2
+
+    def connection(self, scheme):
+        if scheme not in self.connections:
+            netloc = self.bases[scheme].netloc
+            if scheme == 'https':
+                self.connections[scheme] = http.client.HTTPSConnection(netloc, context=self.ssl_context, timeout=30)
+            else:
+                self.connections[scheme] = http.client.HTTPConnection(netloc, timeout=30)
+        return self.connections[scheme]
+
+    def request(self, scheme, method, path, body=None):
+        headers = {'User-Agent': 'DFCI-Agent', 'Accept': '*/*'}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        start = time.perf_counter()
+        try:
+            conn = self.connection(scheme)
+            conn.request(method, self.bases[scheme].path.rstrip('/') + path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            # Drop the connection so the next request reconnects
+            conn = self.connections.pop(scheme, None)
+            if conn is not None:
+                conn.close()
+            raise
+        return (time.perf_counter() - start, response)
+
+    #
+    # POST the body, then GET the status from the path of the returned Location
+    #
+    def flow(self, scheme, path, name, results):
+        (elapsed, response) = self.request(scheme, 'POST', path, self.body)
+        results.add(name + ' POST', elapsed, response.status)
+        location = response.getheader('Location')
+        if response.status != 202 or not location:
+            return
+
+        status_path = urllib.parse.urlsplit(location).path
+        (elapsed, response) = self.request(scheme, 'GET', status_path)
+        results.add(name + ' GET', elapsed, response.status)
+
+    def close(self):
+        for conn in self.connections.values():
+            conn.close()
+
+
+class Results(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {name: [] for name in REQUEST_TYPES}
+        self.status_counts = {}
+        self.errors = 0
+
+    def add(self, name, elapsed, status):
+        with self._lock:
+            self.latencies[name].append(elapsed)
+            key = (name, status)
+            self.status_counts[key] = self.status_counts.get(key, 0) + 1
+
+    def add_error(self):
+        with self._lock:
+            self.errors += 1
+
+
+#
+# Nearest rank percentile of an already sorted list
+#
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(pct / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def run_worker(device, flows, counter, lock, results, do_bootstrap, do_recovery):
+    while True:
+        with lock:
+            if counter[0] >= flows:
+                break
+            counter[0] += 1
+        try:
+            if do_bootstrap:
+                device.flow('http', BOOTSTRAP_PATH, 'bootstrap', results)
+            if do_recovery:
+                device.flow('https', RECOVERY_PATH, 'recovery', results)
+        except (OSError, http.client.HTTPException):
+            results.add_error()
+    device.close()
+
+
+def report(results, elapsed, concurrency, flows):
+    total = sum(len(v) for v in results.latencies.values())
+    print('Flows: %d  Concurrency: %d  Requests: %d  Errors: %d  Time: %.2fs  Requests/sec: %.1f'
+          % (flows, concurrency, total, results.errors, elapsed, total / elapsed if elapsed else 0.0))
+    print('%-16s %8s %10s %10s %10s %10s' % ('Request', 'Count', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+    for name in REQUEST_TYPES:
+        values = sorted(results.latencies[name])
+        if not values:
+            continue
+        print('%-16s %8d %10.2f %10.2f %10.2f %10.2f' % (name, len(values),
+              percentile(values, 50) * 1000, percentile(values, 95) * 1000,
+              percentile(values, 99) * 1000, values[-1] * 1000))
+    for ((name, status), count) in sorted(results.status_counts.items()):
+        print('  %-16s status %d: %d' % (name, status, count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DFCI refresh server load generator')
+    parser.add_argument('--concurrency', dest='concurrency', type=int, default=16, help='Number of simulated devices')
+    parser.add_argument('--flows', dest='flows', type=int, default=1000, help='Total number of device flows to run')
+    parser.add_argument('--flow', dest='flow', choices=['bootstrap', 'recovery', 'both'], default='both', help='Flows each device runs')
+    parser.add_argument('--body', dest='body', default=None, help='JSON request body file.  Default is a small generated body')
+    parser.add_argument('--http-base', dest='http_base', default=None, help='Base URL of a running server (http)')
+    parser.add_argument('--https-base', dest='https_base', default=None, help='Base URL of a running server (https)')
+    parser.add_argument('--json', dest='json_file', default=None, help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.body:
+        with open(args.body, 'rb') as f:
+            body = f.read()
+    else:
+        body = json.dumps({'DeviceId': 'DfciBenchmark'}).encode('utf-8')
+
+    servers = []
+    if args.http_base is None and args.https_base is None:
+        (http_base, https_base, servers) = start_local_server(body)
+    elif args.http_base is None or args.https_base is None:
+        raise Exception('Both --http-base and --https-base are required to use a running server')
+    else:
+        (http_base, https_base) = (args.http_base, args.https_base)
+
+    results = Results()
+    counter = [0]
+    lock = threading.Lock()
+    do_bootstrap = args.flow in ('bootstrap', 'both')
+    do_recovery = args.flow in ('recovery', 'both')
+
+    workers = [threading.Thread(target=run_worker,
+                                args=(Device(http_base, https_base, body), args.flows, counter, lock,
+                                      results, do_bootstrap, do_recovery))
+               for _ in range(args.concurrency)]
+
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    for server in servers:
+        server.shutdown()
+
+    report(results, elapsed, args.concurrency, args.flows)
+
+    if args.json_file:
+        summary = {'flows': args.flows, 'concurrency': args.concurrency, 'seconds': elapsed, 'errors': results.errors,
+                   'requests_per_second': sum(len(v) for v in results.latencies.values()) / elapsed if elapsed else 0.0,
+                   'requests': {}}
+        for name in REQUEST_TYPES:
+            values = sorted(results.latencies[name])
+            summary['requests'][name] = {'count': len(values),
+                                         'p50_ms': percentile(values, 50) * 1000,
+                                         'p95_ms': percentile(values, 95) * 1000,
+                                         'p99_ms': percentile(values, 99) * 1000}
+        with open(args.json_file, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    return 1 if results.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,11 @@
 import sys
 import argparse
-import base64
 sys.path.append(r'..\..\Support\Python')
 from CertSupportLib import CertSupportLib
+from Base64StreamLib import write_base64_stream, hash_section_name, HASH_ALGORITHMS
 
 delimiter = ''
+section_hash = None
 
 
 def set_delimiter(new_delimiter):
@@ -12,33 +13,35 @@ def set_delimiter(new_delimiter):
     delimiter = new_delimiter
 
 
+def set_section_hash(hash_algorithm):
+    global section_hash
+    section_hash = hash_algorithm
+
+
 def add_section(outfile, section_name, section_file_name):
     if (not section_file_name):
         return
 
     try:
-        with open(section_file_name, "rb") as binfile:
-            bindata = binfile.read()
+        binfile = open(section_file_name, "rb")
 
     except FileNotFoundError:
         print("File %s not found" % section_file_name)
         return
 
-    if bindata is None:
-        raise Exception(f"Invalid binary data from {section_name}")
-
-    b64data = base64.b64encode(bindata)
-    if b64data is None:
-        raise Exception(f"Unable to convert bindata to b64data data from {section_name}")
-
-    outfile.write(delimiter)
-    outfile.write('"')
-    outfile.write(section_name)
-    outfile.write('":"')
-    outfile.write(b64data.decode("utf-8"))
-    outfile.write('"')
+    # Stream the file as base64 so only one block of it is in memory at a time
+    with binfile:
+        outfile.write(delimiter)
+        outfile.write('"')
+        outfile.write(section_name)
+        outfile.write('":"')
+        digest = write_base64_stream(outfile, binfile, section_hash)
+        outfile.write('"')
     set_delimiter(',\n')
 
+    if digest is not None:
+        add_section_text(outfile, hash_section_name(section_name, section_hash), digest)
+
 
 def add_section_hash(outfile, section_name, section_file_name):
     if (not section_file_name):
@@ -95,8 +98,10 @@ def main():
     parser.add_argument("-w",  "--OwnerPfxPath", dest="OwnerPfxFilePath", help="Path to Owner.pfx", default=None)
 
     parser.add_argument("-null", action="store_true", dest="null", help="Build Null Response", default=False)
+    parser.add_argument("--SectionHash", dest="SectionHash", choices=HASH_ALGORITHMS, help="Add a {Section}{Hash} element with the hash of each packet", default=None)
 
     options = parser.parse_args()
+    set_section_hash(options.SectionHash)
 
     if options.null:
         if ((options.IdFilePath is not None) or
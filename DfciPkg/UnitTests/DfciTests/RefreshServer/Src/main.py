@@ -1,24 +1,538 @@
+import collections
 import configparser
+import functools
+import hashlib
 import json
+import math
 import os
+import threading
+import time
 import traceback
+import uuid
 
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, request, jsonify, g
 
 dfci_refresh_server = Flask(__name__)
 
 dfci_refresh_server.config['REQUEST_FOLDER'] = '/srv/dfci_refresh_server/src/Requests'
 dfci_refresh_server.config['RESPONSE_FOLDER'] = '/srv/dfci_refresh_server/src/Responses'
+# Each sub folder of SCENARIO_FOLDER with Requests and Responses folders is a named scenario
+# that can be made active with /admin/scenario.  Files are checked for changes at most every
+# RELOAD_INTERVAL seconds.
+dfci_refresh_server.config['SCENARIO_FOLDER'] = '/srv/dfci_refresh_server/src/Scenarios'
+dfci_refresh_server.config['RELOAD_INTERVAL'] = 1.0
+# Per device request sessions.  The oldest are dropped past the limit or after the TTL (seconds).
+dfci_refresh_server.config['SESSION_LIMIT'] = 4096
+dfci_refresh_server.config['SESSION_TTL'] = 600
+# Throttling of the recovery routes.  Each client gets a token bucket of THROTTLE_BURST requests
+# refilled at THROTTLE_RATE requests per second.  A rate of 0 disables throttling.  THROTTLE_KEY
+# selects the client: 'ip' (remote address) or 'request-id' (POSTs, which have no request-id yet,
+# use the remote address).  Can be changed at runtime with /admin/throttle.
+dfci_refresh_server.config['THROTTLE_RATE'] = 0
+dfci_refresh_server.config['THROTTLE_BURST'] = 10
+dfci_refresh_server.config['THROTTLE_KEY'] = 'ip'
+dfci_refresh_server.config['THROTTLE_BUCKET_LIMIT'] = 4096
+# Remote addresses allowed to use /admin/* and /metrics?reset.  '*' allows any address.  A
+# container managed from its docker host needs the docker gateway address added.
+dfci_refresh_server.config['ADMIN_ADDRESSES'] = ['127.0.0.1', '::1']
 DfciTest_Config = '/srv/dfci_refresh_server/src/DfciTests.ini'
 
 
-def compare_json_files(request_name, expected_name):
+#
+# In memory copy of a file used by the server.  The ETag is the hash of the contents, and
+# the parsed forms (json, config) are built on first use.
+#
+class CachedFile(object):
+
+    def __init__(self, pathname, version, data):
+        self.pathname = pathname
+        self.version = version
+        self.data = data
+        self.etag = hashlib.sha256(data).hexdigest()
+        self.parsed = {}
+
+    @staticmethod
+    def load(pathname):
+        with open(pathname, 'rb') as file:
+            st = os.fstat(file.fileno())
+            return CachedFile(pathname, (st.st_mtime_ns, st.st_size), file.read())
+
+    def get_json(self):
+        if 'json' not in self.parsed:
+            self.parsed['json'] = json.loads(self.data)
+        return self.parsed['json']
+
+    def get_config(self):
+        if 'config' not in self.parsed:
+            config = configparser.ConfigParser()
+            config.read_string(self.data.decode('utf-8'))
+            self.parsed['config'] = config
+        return self.parsed['config']
+
+
+#
+# One loaded set of request and response files, plus the test configuration.  A Scenario is
+# never changed after it is built; a reload builds a new one, so a request that holds a
+# Scenario sees one consistent set of files.
+#
+class Scenario(object):
+
+    REQUEST_FILES = ['Expected_Request.json']
+    RESPONSE_FILES = ['Bootstrap_NULLResponse.json', 'Bootstrap_Response.json', 'Recovery_Response.json']
+
+    def __init__(self, name, request_folder, response_folder, config_path, files):
+        self.name = name
+        self.request_folder = request_folder
+        self.response_folder = response_folder
+        self.config_path = config_path
+        self.files = files  # pathname -> CachedFile, or None when the file does not exist
+        self.loaded = time.time()
+
+    @staticmethod
+    def pathnames(request_folder, response_folder, config_path):
+        return ([os.path.join(request_folder, f) for f in Scenario.REQUEST_FILES] +
+                [os.path.join(response_folder, f) for f in Scenario.RESPONSE_FILES] +
+                [config_path])
+
+    def versions(self):
+        return {pathname: (cached.version if cached is not None else None) for pathname, cached in self.files.items()}
+
+    def get(self, pathname):
+        cached = self.files.get(pathname)
+        if cached is None:
+            raise Exception(f'Unable to locate {pathname} in scenario {self.name}')
+        return cached
+
+    def get_request(self, filename):
+        return self.get(os.path.join(self.request_folder, filename))
+
+    def get_response(self, filename):
+        return self.get(os.path.join(self.response_folder, filename))
+
+    def get_config(self):
+        if self.files.get(self.config_path) is None:
+            raise Exception("Unable to locate test configuration template.")
+        return self.get(self.config_path).get_config()
+
+
+#
+# The named scenarios and the active one.  'default' is REQUEST_FOLDER/RESPONSE_FOLDER, and each
+# sub folder of SCENARIO_FOLDER with a Requests and a Responses folder is a scenario of that name.
+#
+# The active scenario is loaded once.  At most every RELOAD_INTERVAL seconds one request checks
+# the mtime and size of its files, and if any changed a new Scenario is loaded and swapped in.
+# Unchanged files are shared with the previous Scenario, so their parsed forms are kept.
+#
+class ScenarioRegistry(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = None
+        self._active_name = 'default'
+        self._next_check = 0
+
+    def folders(self):
+        folders = {'default': (dfci_refresh_server.config['REQUEST_FOLDER'], dfci_refresh_server.config['RESPONSE_FOLDER'])}
+        root = dfci_refresh_server.config['SCENARIO_FOLDER']
+        if os.path.isdir(root):
+            for name in sorted(os.listdir(root)):
+                request_folder = os.path.join(root, name, 'Requests')
+                response_folder = os.path.join(root, name, 'Responses')
+                if os.path.isdir(request_folder) and os.path.isdir(response_folder):
+                    folders[name] = (request_folder, response_folder)
+        return folders
+
+    def _pathnames(self, name):
+        folders = self.folders()
+        if name not in folders:
+            raise Exception(f'Unknown scenario {name}')
+        request_folder, response_folder = folders[name]
+        return (request_folder, response_folder, Scenario.pathnames(request_folder, response_folder, DfciTest_Config))
+
+    def _load(self, name, previous=None):
+        request_folder, response_folder, pathnames = self._pathnames(name)
+        files = {}
+        for pathname in pathnames:
+            try:
+                st = os.stat(pathname)
+            except OSError:
+                files[pathname] = None
+                continue
+            cached = previous.files.get(pathname) if previous is not None else None
+            if cached is None or cached.version != (st.st_mtime_ns, st.st_size):
+                cached = CachedFile.load(pathname)
+            files[pathname] = cached
+        return Scenario(name, request_folder, response_folder, DfciTest_Config, files)
+
+    def _changed(self, scenario):
+        _, _, pathnames = self._pathnames(scenario.name)
+        versions = scenario.versions()
+        if set(pathnames) != set(versions):
+            return True
+        for pathname in pathnames:
+            try:
+                st = os.stat(pathname)
+                version = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                version = None
+            if version != versions[pathname]:
+                return True
+        return False
+
+    #
+    # Return the active Scenario, reloading it first if its files changed
+    #
+    def current(self):
+        scenario = self._active
+        if scenario is not None and time.monotonic() < self._next_check:
+            return scenario
+
+        with self._lock:
+            now = time.monotonic()
+            if self._active is None or now >= self._next_check:
+                self._next_check = now + dfci_refresh_server.config['RELOAD_INTERVAL']
+                if self._active is None or self._changed(self._active):
+                    self._active = self._load(self._active_name, self._active)
+            return self._active
+
+    #
+    # Load scenario name and make it the active one.  On error the active scenario is kept.
+    #
+    def switch(self, name):
+        scenario = self._load(name)
+        with self._lock:
+            self._active_name = name
+            self._active = scenario
+            self._next_check = time.monotonic() + dfci_refresh_server.config['RELOAD_INTERVAL']
+        return scenario
+
+    def reload(self):
+        return self.switch(self._active_name)
+
+    def status(self):
+        scenario = self.current()
+        return {'active': scenario.name,
+                'scenarios': list(self.folders()),
+                'request_folder': scenario.request_folder,
+                'response_folder': scenario.response_folder,
+                'loaded': scenario.loaded,
+                'files': {pathname: (cached.etag if cached is not None else None) for pathname, cached in scenario.files.items()}}
+
+
+scenarios = ScenarioRegistry()
+
+
+#
+# The body of one device's POST.  The status GET for its request-id is answered from here,
+# so concurrent devices do not see each other's requests.
+#
+class RequestSession(object):
+
+    def __init__(self, data, created):
+        self.data = data
+        self.created = created
+        self.compare_results = {}  # expected file etag -> result
+        self._json = None
+
+    def get_json(self):
+        if self._json is None:
+            self._json = json.loads(self.data)
+        return self._json
+
+
+#
+# Bounded store of RequestSessions keyed by a generated request-id.  Sessions are kept
+# in creation order and dropped when older than the TTL or when the store is over its limit.
+# The limit and TTL are read from the app config when used, so the server startup can
+# change them after this module is imported.
+#
+class SessionStore(object):
+
+    def __init__(self, config):
+        self._lock = threading.Lock()
+        self._sessions = collections.OrderedDict()
+        self.config = config
+
+    @property
+    def limit(self):
+        return self.config['SESSION_LIMIT']
+
+    @property
+    def ttl(self):
+        return self.config['SESSION_TTL']
+
+    def _expire(self, now):
+        limit = self.limit
+        ttl = self.ttl
+        while self._sessions:
+            request_id, session = next(iter(self._sessions.items()))
+            if (len(self._sessions) <= limit) and ((now - session.created) < ttl):
+                break
+            del self._sessions[request_id]
+
+    def add(self, data):
+        request_id = uuid.uuid4().hex
+        now = time.monotonic()
+        with self._lock:
+            self._sessions[request_id] = RequestSession(data, now)
+            self._expire(now)
+        return request_id
+
+    def get(self, request_id):
+        with self._lock:
+            self._expire(time.monotonic())
+            return self._sessions.get(request_id)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+bootstrap_sessions = SessionStore(dfci_refresh_server.config)
+recovery_sessions = SessionStore(dfci_refresh_server.config)
+
+
+#
+# Token bucket for one client.  Holds up to burst tokens, refilled at rate tokens per second.
+#
+class TokenBucket(object):
+
+    def __init__(self, burst, now):
+        self.tokens = float(burst)
+        self.updated = now
+
+    #
+    # Take one token.  Returns 0 if the request may be served, else the seconds until a token is available.
+    #
+    def take(self, rate, burst, now):
+        self.tokens = min(float(burst), self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0
+        return (1.0 - self.tokens) / rate
+
+
+#
+# Per client token buckets and the served/throttled counters of each route.  The least
+# recently used buckets are dropped past the bucket limit (a dropped client starts full).
+#
+class Throttle(object):
+
+    KEYS = ('ip', 'request-id')
+
+    def __init__(self, rate, burst, key, bucket_limit):
+        self._lock = threading.Lock()
+        self._buckets = collections.OrderedDict()
+        self.counters = {}  # route -> {'served': n, 'throttled': n}
+        self.bucket_limit = bucket_limit
+        self.configure(rate, burst, key)
+
+    def configure(self, rate, burst, key):
+        rate = float(rate)
+        burst = int(burst)
+        if rate < 0:
+            raise Exception(f'Invalid throttle rate {rate}')
+        if burst < 1:
+            raise Exception(f'Invalid throttle burst {burst}')
+        if key not in Throttle.KEYS:
+            raise Exception(f'Invalid throttle key {key}, must be one of {Throttle.KEYS}')
+        with self._lock:
+            self.rate = rate
+            self.burst = burst
+            self.key = key
+            self._buckets.clear()
+
+    def reset_counters(self):
+        with self._lock:
+            self.counters = {}
+
+    #
+    # Count a request to route from client.  Returns 0 to serve it, else the Retry-After seconds.
+    #
+    def check(self, route, client):
+        with self._lock:
+            counter = self.counters.setdefault(route, {'served': 0, 'throttled': 0})
+            retry_after = 0
+            if self.rate > 0:
+                now = time.monotonic()
+                bucket = self._buckets.get(client)
+                if bucket is None:
+                    bucket = TokenBucket(self.burst, now)
+                    self._buckets[client] = bucket
+                    while len(self._buckets) > self.bucket_limit:
+                        self._buckets.popitem(last=False)
+                else:
+                    self._buckets.move_to_end(client)
+                retry_after = bucket.take(self.rate, self.burst, now)
+
+            counter['throttled' if retry_after else 'served'] += 1
+            return retry_after
+
+    def status(self):
+        with self._lock:
+            return {'rate': self.rate,
+                    'burst': self.burst,
+                    'key': self.key,
+                    'clients': len(self._buckets),
+                    'counters': {route: dict(c) for route, c in self.counters.items()}}
+
+
+throttle = Throttle(dfci_refresh_server.config['THROTTLE_RATE'],
+                    dfci_refresh_server.config['THROTTLE_BURST'],
+                    dfci_refresh_server.config['THROTTLE_KEY'],
+                    dfci_refresh_server.config['THROTTLE_BUCKET_LIMIT'])
+
+
+#
+# Apply the throttle to a route.  A throttled request gets a 429 with a Retry-After header,
+# the same response Intune sends when it is busy.
+#
+def throttled(route_function):
 
-    with open(request_name, "r") as request_file:
-        requested_data = json.load(request_file)
+    @functools.wraps(route_function)
+    def wrapper(*args, **kwargs):
+        client = request.remote_addr
+        if (throttle.key == 'request-id') and ('request_id' in kwargs):
+            client = kwargs['request_id']
 
-    with open(expected_name, "r") as expected_file:
-        expected_data = json.load(expected_file)
+        retry_after = throttle.check(route_function.__name__, client)
+        if retry_after:
+            r = dfci_refresh_server.make_response('Too many requests ')
+            r.mimetype = 'text/plain'
+            r.status_code = 429
+            r.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+            return r
+
+        return route_function(*args, **kwargs)
+
+    return wrapper
+
+
+def is_admin_client():
+    allowed = dfci_refresh_server.config['ADMIN_ADDRESSES']
+    return ('*' in allowed) or (request.remote_addr in allowed)
+
+
+def make_forbidden_response():
+    r = dfci_refresh_server.make_response('Forbidden ')
+    r.mimetype = 'text/plain'
+    r.status_code = 403
+    return r
+
+
+#
+# Limit a route to the ADMIN_ADDRESSES clients.  Other clients get a 403.
+#
+def admin_only(route_function):
+
+    @functools.wraps(route_function)
+    def wrapper(*args, **kwargs):
+        if not is_admin_client():
+            return make_forbidden_response()
+
+        return route_function(*args, **kwargs)
+
+    return wrapper
+
+
+#
+# Request counters, latency histograms and bytes served, reported by /metrics in the
+# Prometheus text format.  Routes are labeled by their rule, so request-ids do not add labels.
+#
+class Metrics(object):
+
+    # Latency histogram bucket upper bounds, in seconds
+    LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.requests = {}      # (route, method, status) -> count
+            self.latency = {}       # route -> [bucket counts..., +Inf count, sum]
+            self.bytes_served = {}  # file name -> [bytes, responses]
+
+    def observe_request(self, route, method, status, seconds):
+        with self._lock:
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+            histogram = self.latency.get(route)
+            if histogram is None:
+                histogram = [0] * (len(Metrics.LATENCY_BUCKETS) + 1) + [0.0]
+                self.latency[route] = histogram
+            for i, bound in enumerate(Metrics.LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    def observe_file(self, name, size):
+        with self._lock:
+            served = self.bytes_served.setdefault(name, [0, 0])
+            served[0] += size
+            served[1] += 1
+
+    def render(self, throttle_status):
+        lines = []
+        with self._lock:
+            lines.append('# HELP dfci_uptime_seconds Seconds since the metrics were started or reset.')
+            lines.append('# TYPE dfci_uptime_seconds gauge')
+            lines.append('dfci_uptime_seconds %.3f' % (time.time() - self.started))
+
+            lines.append('# HELP dfci_requests_total Requests by route, method and status code.')
+            lines.append('# TYPE dfci_requests_total counter')
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append('dfci_requests_total{route="%s",method="%s",status="%d"} %d' % (route, method, status, count))
+
+            lines.append('# HELP dfci_request_duration_seconds Request latency by route.')
+            lines.append('# TYPE dfci_request_duration_seconds histogram')
+            for route, histogram in sorted(self.latency.items()):
+                for i, bound in enumerate(Metrics.LATENCY_BUCKETS):
+                    lines.append('dfci_request_duration_seconds_bucket{route="%s",le="%g"} %d' % (route, bound, histogram[i]))
+                lines.append('dfci_request_duration_seconds_bucket{route="%s",le="+Inf"} %d' % (route, histogram[-2]))
+                lines.append('dfci_request_duration_seconds_sum{route="%s"} %.6f' % (route, histogram[-1]))
+                lines.append('dfci_request_duration_seconds_count{route="%s"} %d' % (route, histogram[-2]))
+
+            lines.append('# HELP dfci_file_bytes_served_total Response body bytes sent from each response file.')
+            lines.append('# TYPE dfci_file_bytes_served_total counter')
+            for name, (size, _) in sorted(self.bytes_served.items()):
+                lines.append('dfci_file_bytes_served_total{file="%s"} %d' % (name, size))
+            lines.append('# HELP dfci_file_responses_total Full (not 304) responses sent from each response file.')
+            lines.append('# TYPE dfci_file_responses_total counter')
+            for name, (_, count) in sorted(self.bytes_served.items()):
+                lines.append('dfci_file_responses_total{file="%s"} %d' % (name, count))
+
+        lines.append('# HELP dfci_throttle_requests_total Throttled route requests by result.')
+        lines.append('# TYPE dfci_throttle_requests_total counter')
+        for route, counter in sorted(throttle_status['counters'].items()):
+            for result in ('served', 'throttled'):
+                lines.append('dfci_throttle_requests_total{route="%s",result="%s"} %d' % (route, result, counter[result]))
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+@dfci_refresh_server.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@dfci_refresh_server.after_request
+def record_request_metrics(response):
+    start = getattr(g, 'request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe_request(route, request.method, response.status_code, time.perf_counter() - start)
+    return response
+
+
+def compare_json_data(requested_data, expected_data):
 
     is_equal = all((requested_data.get(k) == v for k, v in expected_data.items()))
     if is_equal:
@@ -26,16 +540,52 @@ def compare_json_files(request_name, expected_name):
     return is_equal
 
 
-def get_host_name():
-    if not os.path.exists(DfciTest_Config):
-        raise Exception("Unable to locate test configuration template.")
+#
+# Compare a device's bootstrap request with the expected request.  The result is kept
+# in the session until the expected request (Expected_Request.json of the scenario) changes.
+#
+def compare_session_to_expected(session, expected):
+    if expected.etag not in session.compare_results:
+        session.compare_results = {expected.etag: compare_json_data(session.get_json(), expected.get_json())}
+    return session.compare_results[expected.etag]
+
 
-    config = configparser.ConfigParser()
-    config.read(DfciTest_Config)
+#
+# Response for a request-id that was never issued or has expired
+#
+def make_unknown_session_response(request_id):
+    r = dfci_refresh_server.make_response(f'Unknown or expired request-id {request_id}')
+    r.mimetype = 'text/plain'
+    r.status_code = 404
+    return r
+
+
+def get_host_name(scenario=None):
+    if scenario is None:
+        scenario = scenarios.current()
+
+    config = scenario.get_config()
 
     return config["DfciTest"]["server_host_name"]
 
 
+#
+# Build a response from a cached file.  The ETag lets a client that already has this version
+# send If-None-Match and get a 304 Not Modified without the body.
+#
+def make_file_response(cached, mimetype):
+    r = dfci_refresh_server.make_response(cached.data)
+    r.headers["Cache-Control"] = "must-revalidate"
+    r.headers["Pragma"] = "must-revalidate"
+    r.mimetype = mimetype
+    r.status_code = 200
+    r.set_etag(cached.etag)
+    r = r.make_conditional(request)
+    if r.status_code == 200:
+        metrics.observe_file(os.path.basename(cached.pathname), len(cached.data))
+    return r
+
+
 #
 #  Default web page for this server to verify that the test DFCI server is functional.
 #
@@ -111,6 +661,7 @@ def gethostname():
 # telling Dfci where to go to get the payload/
 #
 @dfci_refresh_server.route('/ztd/unauthenticated/dfci/recovery-bootstrap', methods=['POST'])
+@throttled
 def recovery_bootstrap_request():
     #
     # A Ztd bootstrap request comes with a JSON Body:
@@ -121,20 +672,16 @@ def recovery_bootstrap_request():
             raise Exception(f'Unsupported format URL {request.url}')
 
         #
-        # Expect a body, and store the body for later verification
+        # Expect a body, and store the body in a new session for later verification
         #
         if request.mimetype == 'application/json':
-            filename = 'Bootstrap_Request.json'
-            pathname = os.path.join(dfci_refresh_server.config['REQUEST_FOLDER'], filename)
-            file = open(pathname, 'wb')
-            file.write(request.data)
-            file.close()
+            request_id = bootstrap_sessions.add(request.data)
 
             response = jsonify()
             response.status_code = 202
             #
 
-            location = 'http://' + get_host_name() + '/ztd/unauthenticated/dfci/recovery-bootstrap-status/request-id'
+            location = 'http://' + get_host_name() + '/ztd/unauthenticated/dfci/recovery-bootstrap-status/' + request_id
             response.headers['Location'] = location
             return response
         else:
@@ -154,30 +701,28 @@ def recovery_bootstrap_request():
 # Test recovery bootstrap response server.  This test the client to see if the certs
 # need updating.  If so, cert update packets are returned If not, returns a "NULL" response.
 #
-@dfci_refresh_server.route('/ztd/unauthenticated/dfci/recovery-bootstrap-status/request-id', methods=['GET'])
-def recovery_bootstrap_status():
+@dfci_refresh_server.route('/ztd/unauthenticated/dfci/recovery-bootstrap-status/<request_id>', methods=['GET'])
+@throttled
+def recovery_bootstrap_status(request_id):
 
     try:
         if not request.url.startswith('http://'):
             raise Exception(f'Unsupported format URL {request.url}')
 
-        request_name = os.path.join(dfci_refresh_server.config['REQUEST_FOLDER'], 'Bootstrap_Request.json')
-        expected_name = os.path.join(dfci_refresh_server.config['REQUEST_FOLDER'], 'Expected_Request.json')
+        session = bootstrap_sessions.get(request_id)
+        if session is None:
+            return make_unknown_session_response(request_id)
+
+        scenario = scenarios.current()
 
-        is_equal = compare_json_files(request_name, expected_name)
+        is_equal = compare_session_to_expected(session, scenario.get_request('Expected_Request.json'))
 
         if is_equal:
             filename = 'Bootstrap_NULLResponse.json'
         else:
             filename = 'Bootstrap_Response.json'
 
-        pathname = os.path.join(dfci_refresh_server.config['RESPONSE_FOLDER'], filename)
-        r = dfci_refresh_server.make_response(send_file(pathname))
-        r.headers["Cache-Control"] = "must-revalidate"
-        r.headers["Pragma"] = "must-revalidate"
-        r.mimetype = 'application/json'
-        r.status_code = 200
-        return r
+        return make_file_response(scenario.get_response(filename), 'application/json')
 
     except Exception:
         msg = ''.join(traceback.format_exc())
@@ -193,6 +738,7 @@ def recovery_bootstrap_status():
 # retrieve the update packets.
 #
 @dfci_refresh_server.route('/ztd/unauthenticated/dfci/recovery-packets', methods=['POST'])
+@throttled
 def recovery_packets():
     #
     # A Recovery request comes with a JSON Body:
@@ -204,21 +750,17 @@ def recovery_packets():
             raise Exception(f'Unsupported format URL {request.url}')
 
         #
-        # Expect a body, and store the body for later verification, if necessary
+        # Expect a body, and store the body in a new session for later verification, if necessary
         #
         if request.mimetype == 'application/json':
-            filename = 'Recovery_Request.json'
-            pathname = os.path.join(dfci_refresh_server.config['REQUEST_FOLDER'], filename)
-            file = open(pathname, 'wb')
-            file.write(request.data)
-            file.close()
+            request_id = recovery_sessions.add(request.data)
 
             response = jsonify()
             response.status_code = 202
             #
             # return a full URL with https instead of http
             response.autocorrect_location_header = False
-            location = 'https://' + get_host_name() + '/ztd/unauthenticated/dfci/recovery-packets-status/request-id'
+            location = 'https://' + get_host_name() + '/ztd/unauthenticated/dfci/recovery-packets-status/' + request_id
             response.headers['Location'] = location
             return response
         else:
@@ -237,21 +779,19 @@ def recovery_packets():
 #
 # Recovery packet response location.  Return updated settings.
 #
-@dfci_refresh_server.route('/ztd/unauthenticated/dfci/recovery-packets-status/request-id', methods=['GET'])
-def recovery_packets_status():
+@dfci_refresh_server.route('/ztd/unauthenticated/dfci/recovery-packets-status/<request_id>', methods=['GET'])
+@throttled
+def recovery_packets_status(request_id):
 
     try:
         if not request.url.startswith('https://'):
             raise Exception(f'Unsupported format URL {request.url}')
 
+        if recovery_sessions.get(request_id) is None:
+            return make_unknown_session_response(request_id)
+
         filename = 'Recovery_Response.json'
-        pathname = os.path.join(dfci_refresh_server.config['RESPONSE_FOLDER'], filename)
-        r = dfci_refresh_server.make_response(send_file(pathname))
-        r.headers["Cache-Control"] = "must-revalidate"
-        r.headers["Pragma"] = "must-revalidate"
-        r.mimetype = 'dfci_refresh_serverlication/json'
-        r.status_code = 200
-        return r
+        return make_file_response(scenarios.current().get_response(filename), 'dfci_refresh_serverlication/json')
 
     except Exception:
         msg = ''.join(traceback.format_exc())
@@ -261,6 +801,86 @@ def recovery_packets_status():
         return r
 
 
+#
+# Get or change the throttle of the recovery routes.  GET returns the limits and the served/throttled
+# counters.  POST a JSON body with any of rate, burst and key to change the limits (all clients
+# start with a full bucket), and "reset": true to zero the counters.
+#
+@dfci_refresh_server.route('/admin/throttle', methods=['GET', 'POST'])
+@admin_only
+def admin_throttle():
+
+    try:
+        if request.method == 'POST':
+            settings = request.get_json(force=True, silent=True)
+            if not isinstance(settings, dict):
+                raise ValueError('Expected a JSON object body')
+
+            if ('rate' in settings) or ('burst' in settings) or ('key' in settings):
+                throttle.configure(settings.get('rate', throttle.rate),
+                                   settings.get('burst', throttle.burst),
+                                   settings.get('key', throttle.key))
+            if settings.get('reset', False):
+                throttle.reset_counters()
+
+        return jsonify(throttle.status())
+
+    except Exception:
+        msg = ''.join(traceback.format_exc())
+        r = dfci_refresh_server.make_response(msg)
+        r.mimetype = 'text/plain'
+        r.status_code = 400
+        return r
+
+
+#
+# Get or change the active scenario.  GET returns the active scenario, its files and the
+# scenario names.  POST a JSON body with "scenario": name to switch to another scenario,
+# or "reload": true to re-read the active scenario now.
+#
+@dfci_refresh_server.route('/admin/scenario', methods=['GET', 'POST'])
+@admin_only
+def admin_scenario():
+
+    try:
+        if request.method == 'POST':
+            settings = request.get_json(force=True, silent=True)
+            if not isinstance(settings, dict):
+                raise ValueError('Expected a JSON object body')
+
+            if 'scenario' in settings:
+                scenarios.switch(settings['scenario'])
+            elif settings.get('reload', False):
+                scenarios.reload()
+
+        return jsonify(scenarios.status())
+
+    except Exception:
+        msg = ''.join(traceback.format_exc())
+        r = dfci_refresh_server.make_response(msg)
+        r.mimetype = 'text/plain'
+        r.status_code = 400
+        return r
+
+
+#
+# Request counters, latency histograms and bytes served in the Prometheus text format.
+# GET /metrics?reset=1 returns the metrics and then zeroes them (ADMIN_ADDRESSES clients only).
+#
+@dfci_refresh_server.route('/metrics')
+def get_metrics():
+    if request.args.get('reset') and not is_admin_client():
+        return make_forbidden_response()
+
+    r = dfci_refresh_server.make_response(metrics.render(throttle.status()))
+    r.mimetype = 'text/plain'
+    r.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    r.status_code = 200
+    if request.args.get('reset'):
+        metrics.reset()
+    return r
+
+
 if __name__ == '__main__':
 
     dfci_refresh_server.debug = True
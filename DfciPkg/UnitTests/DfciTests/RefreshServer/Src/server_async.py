@@ -0,0 +1,103 @@
+# Asyncio Web Server for load testing the Refresh from Network function in DFCI.
+#
+# Serves the same dfci_refresh_server routes as server.py, on the same HTTP and HTTPS ports
+# with the same TLS 1.2 only cipher list, but with uvicorn's asyncio event loop instead of
+# CherryPy's fixed thread pools.  Idle and slow connections cost a socket, not a thread, so
+# thousands of simulated devices can hold connections to one server at once.
+#
+# The Flask app is wrapped with a2wsgi's WSGIMiddleware, so route code is shared with server.py.
+# The routes run on a pool of --workers threads (30, like server.py's thread_pool).  asgiref's
+# WsgiToAsgi is not used as it runs every request on one thread.
+#
+# Usage:
+#   python3 server_async.py [--http-port 80] [--https-port 443] [--workers 30] [--admin-address ADDRESS ...]
+
+
+import argparse
+import asyncio
+import ssl
+
+import uvicorn
+from a2wsgi import WSGIMiddleware
+
+from main import dfci_refresh_server
+
+# Same ciphers as server.py, in OpenSSL notation for the Python ssl module:
+#   TLS_ECDHE_RSA_WITH_AES_256_GCM_SHA384, TLS_ECDHE_RSA_WITH_AES_128_GCM_SHA256,
+#   TLS_ECDHE_RSA_WITH_AES_256_CBC_SHA384, TLS_ECDHE_RSA_WITH_AES_128_CBC_SHA256
+cipher_list = ['ECDHE-RSA-AES256-GCM-SHA384',
+               'ECDHE-RSA-AES128-GCM-SHA256',
+               'ECDHE-RSA-AES256-SHA384',
+               'ECDHE-RSA-AES128-SHA256']
+
+
+def create_ssl_context(keyfile, certfile):
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(certfile, keyfile)
+
+    # Only TLS 1.2, the version supported by Intune
+    ctx.minimum_version = ssl.TLSVersion.TLSv1_2
+    ctx.maximum_version = ssl.TLSVersion.TLSv1_2
+
+    # The server will use the cipher list in the order of the server's preference
+    ctx.options |= ssl.OP_CIPHER_SERVER_PREFERENCE
+    ctx.set_ciphers(':'.join(cipher_list))
+    return ctx
+
+
+def create_server(app, host, port, ssl_context=None):
+    config = uvicorn.Config(app, host=host, port=port, log_level='info', lifespan='off')
+    config.load()
+    # uvicorn's own ssl options can not limit the maximum TLS version, so install our context
+    config.ssl = ssl_context
+    server = uvicorn.Server(config)
+    # The servers share one event loop; let the loop (not each server) handle Ctrl-C
+    server.install_signal_handlers = lambda: None
+    return server
+
+
+async def serve(servers):
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DFCI refresh test server (asyncio)')
+    parser.add_argument('--host', dest='host', default='0.0.0.0', help='Address to listen on')
+    parser.add_argument('--http-port', dest='http_port', type=int, default=80, help='HTTP port, 0 to disable')
+    parser.add_argument('--https-port', dest='https_port', type=int, default=443, help='HTTPS port, 0 to disable')
+    parser.add_argument('--keyfile', dest='keyfile', default='ssl/DFCI_HTTPS.key', help='HTTPS private key')
+    parser.add_argument('--certfile', dest='certfile', default='ssl/DFCI_HTTPS.pem', help='HTTPS certificate')
+    parser.add_argument('--workers', dest='workers', type=int, default=30, help='Threads that run the Flask routes')
+    parser.add_argument('--session-limit', dest='session_limit', type=int, default=None, help='Request sessions kept per route')
+    parser.add_argument('--session-ttl', dest='session_ttl', type=float, default=None, help='Seconds a request session is kept')
+    parser.add_argument('--admin-address', dest='admin_addresses', action='append', default=None,
+                        help='Remote address allowed to use the admin routes, * for any.  Default is localhost only')
+    args = parser.parse_args()
+
+    if args.session_limit is not None:
+        dfci_refresh_server.config['SESSION_LIMIT'] = args.session_limit
+    if args.session_ttl is not None:
+        dfci_refresh_server.config['SESSION_TTL'] = args.session_ttl
+    if args.admin_addresses:
+        dfci_refresh_server.config['ADMIN_ADDRESSES'] = args.admin_addresses
+
+    # One thread pool for both servers
+    app = WSGIMiddleware(dfci_refresh_server, workers=args.workers)
+
+    servers = []
+    if args.http_port:
+        servers.append(create_server(app, args.host, args.http_port))
+    if args.https_port:
+        servers.append(create_server(app, args.host, args.https_port, create_ssl_context(args.keyfile, args.certfile)))
+
+    if not servers:
+        raise Exception('No ports to serve')
+
+    try:
+        asyncio.run(serve(servers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
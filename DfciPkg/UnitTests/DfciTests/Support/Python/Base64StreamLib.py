@@ -0,0 +1,59 @@
+# @file
+#
+# Stream binary files into a JSON document as base64
+#
+# Copyright (c), Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+
+##
+## Used by BldDskPkt.py and GenResponses.py to write packet files as base64 JSON strings.
+##
+## The file is read and encoded in blocks that are a multiple of 3 bytes, so each block
+## encodes to base64 without padding and the concatenated output is identical to encoding
+## the whole file at once.  Memory use is bounded by the block size, not the file size.
+##
+
+import base64
+import hashlib
+
+# Multiple of 3 so no block but the last produces '=' padding
+BASE64_BLOCK_SIZE = 3 * 64 * 1024
+
+# Hash algorithms accepted for the optional per section integrity hash
+HASH_ALGORITHMS = ["sha256", "sha384", "sha512"]
+
+
+#
+# Write the contents of binfile to the text stream outfile as base64.
+# If hash_algorithm is given, returns the hex digest of the raw bytes, else None.
+#
+def write_base64_stream(outfile, binfile, hash_algorithm=None):
+    digest = hashlib.new(hash_algorithm) if hash_algorithm else None
+    pending = b''
+
+    while True:
+        block = binfile.read(BASE64_BLOCK_SIZE)
+        if not block:
+            break
+
+        if digest is not None:
+            digest.update(block)
+
+        if pending:
+            block = pending + block
+        aligned = len(block) - (len(block) % 3)
+        pending = block[aligned:]
+        if aligned:
+            outfile.write(base64.b64encode(block[:aligned]).decode("ascii"))
+
+    if pending:
+        outfile.write(base64.b64encode(pending).decode("ascii"))
+
+    return digest.hexdigest() if digest is not None else None
+
+
+#
+# Name of the JSON element that holds the integrity hash of section_name, ie SettingsPacketSha256
+#
+def hash_section_name(section_name, hash_algorithm):
+    return section_name + hash_algorithm.capitalize()
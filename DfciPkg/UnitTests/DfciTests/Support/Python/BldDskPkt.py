@@ -13,14 +13,26 @@
 import os, sys
 
 import argparse
-import base64
+
+#get script path
+sp = os.path.dirname(os.path.realpath(sys.argv[0]))
+
+#setup python path for build modules
+sys.path.append(sp)
+
+from Base64StreamLib import write_base64_stream, hash_section_name, HASH_ALGORITHMS
 
 delimiter = ''
+sectionHash = None
 
 def set_delimiter (new_delimiter):
     global delimiter
     delimiter = new_delimiter
 
+def set_section_hash (newSectionHash):
+    global sectionHash
+    sectionHash = newSectionHash
+
 def add_section(outFile, sectionName, sectionFileName):
 
 
@@ -29,28 +41,30 @@ def add_section(outFile, sectionName, sectionFileName):
         return
 
     try:
-        with open(sectionFileName, "rb") as binfile:
-            bindata = binfile.read()
+        binfile = open(sectionFileName, "rb")
 
     except FileNotFoundError:
         print ("File %s not found" % sectionFileName)
         return
 
-    if bindata == None:
-        raise Exception ("Invalid binary data from %s" %sectionName)
-
-    b64data = base64.b64encode(bindata)
-    if b64data == None:
-        raise Exception ("Unable to convert bindata to b64data data from %s" %sectionName)
-
-    outFile.write (delimiter)
-    outFile.write (' "')
-    outFile.write (sectionName)
-    outFile.write ('" : "')
-    outFile.write (b64data.decode("utf-8"))
-    outFile.write ('"')
+    # Stream the file as base64 so only one block of it is in memory at a time
+    with binfile:
+        outFile.write (delimiter)
+        outFile.write (' "')
+        outFile.write (sectionName)
+        outFile.write ('" : "')
+        digest = write_base64_stream (outFile, binfile, sectionHash)
+        outFile.write ('"')
     set_delimiter (',\r\n')
 
+    if digest != None:
+        outFile.write (delimiter)
+        outFile.write (' "')
+        outFile.write (hash_section_name (sectionName, sectionHash))
+        outFile.write ('" : "')
+        outFile.write (digest)
+        outFile.write ('"')
+
 #
 #main script function
 #
@@ -66,8 +80,10 @@ def main():
     parser.add_argument("-t",  "--Transition1", dest="Transition1FilePath", help="Path to Transition1 packet", default=None)
     parser.add_argument("-t2", "--Transition2", dest="Transition2FilePath", help="Path to Transition2 packet", default=None)
     parser.add_argument("-o",  "--OutputFilePath", dest="OutputFilePath", help="Path to output file", default=None)
+    parser.add_argument("--SectionHash", dest="SectionHash", choices=HASH_ALGORITHMS, help="Add a {Section}{Hash} element with the hash of each packet", default=None)
 
     options = parser.parse_args()
+    set_section_hash (options.SectionHash)
 
     outFile = open (options.OutputFilePath, "w")
 
@@ -40,6 +40,88 @@ DfciTest_Template = 'DfciTests.Template'
 DfciTest_Config = 'DfciTests.ini'
 DfciTest_Version = 1
 
+# Maximum number of parsed result files kept by DfciResultXml.load()
+DfciResultXml_CacheSize = 64
+
+
+#
+# DfciResultXml - A result file parsed once, and indexed by setting/permission Id.
+#
+# The result files written by the tests contain some text followed by the XML payload.  Each
+# of the check_xxx keywords used to re-read and re-parse the file for every Id.  Use load() to
+# get the parsed result, which is reused until the file's mtime or size changes.
+#
+class DfciResultXml(object):
+    _cache = {}
+
+    def __init__(self, xmlstring):
+        self.xml_string = xmlstring
+        self.root = ElementTree.fromstring(xmlstring)
+
+        # Id -> (element present, Result/Value text), or Id -> (PMask, DMask) for the current
+        # permissions.  The first entry for an Id wins, matching the previous linear searches.
+        self.setting_result = {}
+        self.setting_current = {}
+        self.permission_result = {}
+        self.permission_current = {}
+
+        # (Id, Result) in document order, for the keywords that check every entry
+        self.setting_result_list = self._index(self.root.findall("./Settings/SettingResult"), "Result",
+                                               self.setting_result)
+        self.permission_result_list = self._index(self.root.findall("./Permissions/PermissionResult"), "Result",
+                                                  self.permission_result)
+        self._index(self.root.findall("./Settings/SettingCurrent"), "Value", self.setting_current)
+
+        for e in self.root.findall("./Permissions/PermissionCurrent"):
+            i = e.find("Id")
+            if i is None or i.text in self.permission_current:
+                continue
+            pmask = e.find("PMask")
+            dmask = e.find("DMask")
+            self.permission_current[i.text] = (pmask.text if pmask is not None else None,
+                                               dmask.text if dmask is not None else None)
+
+    @staticmethod
+    def _index(elements, tag, index):
+        entries = []
+        for e in elements:
+            i = e.find("Id")
+            r = e.find(tag)
+            if i is None:
+                continue
+            text = r.text if r is not None else None
+            entries.append((i.text, r is not None, text))
+            if i.text not in index:
+                index[i.text] = (r is not None, text)
+        return entries
+
+    @classmethod
+    def load(cls, resultfile):
+        #
+        # Returns the parsed result, or None if the file does not contain XML.  ElementTree errors
+        # are raised to the caller, as before.
+        #
+        st = os.stat(resultfile)
+        key = os.path.realpath(resultfile)
+        cached = cls._cache.get(key)
+        if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+
+        xmlstring = None
+        with open(resultfile, "r") as a:
+            # find the start of the XML string and then take the rest of the file
+            for line in a:
+                if line.lstrip().startswith("<?xml"):
+                    xmlstring = line + a.read()
+                    break
+
+        parsed = cls(xmlstring) if xmlstring else None
+
+        if len(cls._cache) >= DfciResultXml_CacheSize:
+            cls._cache.pop(next(iter(cls._cache)))
+        cls._cache[key] = (st.st_mtime_ns, st.st_size, parsed)
+        return parsed
+
 
 class DFCI_SupportLib(object):
     _cert_mgr_path = None
@@ -154,193 +236,79 @@ class DFCI_SupportLib(object):
         return t == int(code, base=0)
 
     def check_setting_status(self, resultfile, id, statuscode):
-        xmlstring = ""
-        found = False
-        a = open(resultfile, "r")
-
-        # find the start of the XML string and then copy all lines to XML string variable
-        for line in a.readlines():
-            if (found):
-                xmlstring += line
-            else:
-                if line.lstrip().startswith("<?xml"):
-                    xmlstring = line
-                    found = True
-        a.close()
-
-        if (len(xmlstring) == 0) or (not found):
+        result_xml = DfciResultXml.load(resultfile)
+        if result_xml is None:
             print("Result XML not found")
             return False
 
-        # make an element tree from xml string
-        r = None
-        root = ElementTree.fromstring(xmlstring)
-        for e in root.findall("./Settings/SettingResult"):
-            i = e.find("Id")
-            if (i.text == str(id)):
-                r = e.find("Result")
-                break
-        if (r is None):
+        found, r = result_xml.setting_result.get(str(id), (False, None))
+        if not found:
             print("Failed to find ID (%s) in the Xml results" % str(id))
-            print(xmlstring)
+            print(result_xml.xml_string)
             return False
 
-        print("Result Status for Id (%s): %s" % (str(id), r.text))
-        return int(r.text.strip(), base=0) == int(statuscode, base=0)
+        print("Result Status for Id (%s): %s" % (str(id), r))
+        return int(r.strip(), base=0) == int(statuscode, base=0)
 
     def check_current_setting_value(self, resultfile, id, valuestring):
-        xmlstring = ""
-        found = False
-        a = open(resultfile, "r")
-
-        # find the start of the XML string and then copy all lines to xmlstring variable
-        for line in a.readlines():
-            if (found):
-                xmlstring += line
-            else:
-                if line.lstrip().startswith("<?xml"):
-                    xmlstring = line
-                    found = True
-        a.close()
-
-        if (len(xmlstring) == 0) or (not found):
+        result_xml = DfciResultXml.load(resultfile)
+        if result_xml is None:
             print("Result XML not found")
             return False
 
-        # make an element tree from XML string
-        r = None
-        root = ElementTree.fromstring(xmlstring)
-        for e in root.findall("./Settings/SettingCurrent"):
-            i = e.find("Id")
-            if (i.text == str(id)):
-                r = e.find("Value")
-                break
-        if (r is None):
+        found, r = result_xml.setting_current.get(str(id), (False, None))
+        if not found:
             print("Failed to find ID (%s) in the Xml results" % str(id))
-            print(xmlstring)
+            print(result_xml.xml_string)
             return False
 
-        print("Result Value for Id (%s): %s" % (str(id), r.text))
+        print("Result Value for Id (%s): %s" % (str(id), r))
 
-        if r.text is None:
+        if r is None:
             if valuestring == '':
                 return True
             else:
                 return False
-        return r.text.strip() == valuestring.strip()
+        return r.strip() == valuestring.strip()
 
     def get_current_permission_value(self, resultfile, id):
-        xmlstring = ""
-        found = False
-        a = open(resultfile, "r")
-
-        # find the start of the xml string and then copy all lines to xmlstring variable
-        for line in a.readlines():
-            if found:
-                xmlstring += line
-            else:
-                if line.lstrip().startswith("<?xml"):
-                    xmlstring = line
-                    found = True
-        a.close()
-
-        if (len(xmlstring) == 0) or (not found):
+        result_xml = DfciResultXml.load(resultfile)
+        if result_xml is None:
             print("Result XML not found")
             return False
 
-        # make an element tree from xml string
-        r1 = None
-        r2 = None
-        root = ElementTree.fromstring(xmlstring)
-
-        for e in root.findall("./Permissions/PermissionCurrent"):
-            i = e.find("Id")
-            if (i.text == str(id)):
-                j = e.find("PMask")
-                if (j is not None):
-                    r1 = j.text
-                j = e.find("DMask")
-                if (j is not None):
-                    r2 = j.text
-                break
+        r1, r2 = result_xml.permission_current.get(str(id), (None, None))
         print("Result Value for Id (%s): PMask=%s, DMask=%s" % (str(id), r1, r2))
         return r1, r2
 
     def get_current_permission_defaults(self, resultfile):
-        xmlstring = ""
-        found = False
-        a = open(resultfile, "r")
-
-        # find the start of the XML string and then copy all lines to XML string variable
-        for line in a.readlines():
-            if found:
-                xmlstring += line
-            else:
-                if line.lstrip().startswith("<?xml"):
-                    xmlstring = line
-                    found = True
-        a.close()
-
-        if (len(xmlstring) == 0) or (not found):
+        result_xml = DfciResultXml.load(resultfile)
+        if result_xml is None:
             print("Result XML not found")
             return False
 
-        # make an element tree from xml string
-        root = ElementTree.fromstring(xmlstring)
-
         # Collect the root attributes
-        try:
-            r1 = root.attrib["Default"]
-        except KeyError:
-            r1 = None
-
-        try:
-            r2 = root.attrib["Delegated"]
-        except KeyError:
-            r2 = None
+        r1 = result_xml.root.attrib.get("Default")
+        r2 = result_xml.root.attrib.get("Delegated")
 
         print(f"Result Default Values for : Default={r1}, Delegated={r2}")
         return r1, r2
 
     #
-    # Check all individual status codes for each setting and confirm it matches the input status code
+    # Check every (Id, Result) entry against the expected status code.
     #
-    def check_all_permission_status(self, resultfile, status):
-        found = False
-        xmlstring = ""
+    def _check_result_list(self, entries, status):
         statuscode = int(status, base=0)
-        a = open(resultfile, "r")
-
-        # find the start of the XML string and then copy all lines to XML string variable
-        for line in a.readlines():
-            if (found):
-                xmlstring += line
-            else:
-                if line.lstrip().startswith("<?xml"):
-                    xmlstring = line
-                    found = True
-        a.close()
-
-        if (len(xmlstring) == 0) or (not found):
-            print("Result XML not found")
-            return False
-
-        # make an element tree from XML string
-        r = None
-        root = ElementTree.fromstring(xmlstring)
         rc = True
-        for e in root.findall("./Permissions/PermissionResult"):
-            i = e.find("Id")
-            r = e.find("Result")
-
-            if (r is None):
-                print("Failed to find a result node for id (%s)" % i.text.strip())
+        for i, found, r in entries:
+            if not found:
+                print("Failed to find a result node for id (%s)" % i.strip())
                 return False
 
-            result = int(r.text.strip(), base=0)
-            print("Result Status for Id (%s): %s" % (str(i.text.strip()), r.text))
+            result = int(r.strip(), base=0)
+            print("Result Status for Id (%s): %s" % (str(i.strip()), r))
             if (result != statuscode):
-                print("Error.  Status Code for id (%s) didn't match expected" % i.text.strip())
+                print("Error.  Status Code for id (%s) didn't match expected" % i.strip())
                 rc = False
         # done with loop
         return rc
@@ -348,89 +316,49 @@ class DFCI_SupportLib(object):
     #
     # Check all individual status codes for each setting and confirm it matches the input status code
     #
-    def check_all_setting_status(self, resultfile, status):
-        found = False
-        xmlstring = ""
-        statuscode = int(status, base=0)
-        a = open(resultfile, "r")
-
-        # find the start of the XML string and then copy all lines to XML string variable
-        for line in a.readlines():
-            if (found):
-                xmlstring += line
-            else:
-                if line.lstrip().startswith("<?xml"):
-                    xmlstring = line
-                    found = True
-        a.close()
-
-        if (len(xmlstring) == 0) or (not found):
+    def check_all_permission_status(self, resultfile, status):
+        result_xml = DfciResultXml.load(resultfile)
+        if result_xml is None:
             print("Result XML not found")
             return False
 
-        # make an element tree from XML string
-        r = None
-        root = ElementTree.fromstring(xmlstring)
-        rc = True
-        for e in root.findall("./Settings/SettingResult"):
-            i = e.find("Id")
-            r = e.find("Result")
+        return self._check_result_list(result_xml.permission_result_list, status)
 
-            if (r is None):
-                print("Failed to find a result node for id (%s)" % i.text.strip())
-                return False
+    #
+    # Check all individual status codes for each setting and confirm it matches the input status code
+    #
+    def check_all_setting_status(self, resultfile, status):
+        result_xml = DfciResultXml.load(resultfile)
+        if result_xml is None:
+            print("Result XML not found")
+            return False
 
-            result = int(r.text.strip(), base=0)
-            print("Result Status for Id (%s): %s" % (str(i.text.strip()), r.text))
-            if (result != statuscode):
-                print("Error.  Status Code for id (%s) didn't match expected" % i.text.strip())
-                rc = False
-        # done with loop
-        return rc
+        return self._check_result_list(result_xml.setting_result_list, status)
 
     #
     # Check list list of settings results
     #
     def check_setting_status_by_dictionary(self, resultfile, settingdict):
-        found = False
-        xmlstring = ""
-        a = open(resultfile, "r")
-
-        # find the start of the XML string and then copy all lines to XML string variable
-        for line in a.readlines():
-            if (found):
-                xmlstring += line
-            else:
-                if line.lstrip().startswith("<?xml"):
-                    xmlstring = line
-                    found = True
-        a.close()
-
-        if (len(xmlstring) == 0) or (not found):
+        result_xml = DfciResultXml.load(resultfile)
+        if result_xml is None:
             print("Result XML not found")
             return False
 
-        # make an element tree from XML string
-        r = None
-        root = ElementTree.fromstring(xmlstring)
         rc = True
-        for e in root.findall("./Settings/SettingResult"):
-            i = e.find("Id")
-            r = e.find("Result")
-
-            if (r is None):
-                print("Failed to find a result node for id (%s)" % i.text.strip())
+        for i, found, r in result_xml.setting_result_list:
+            if not found:
+                print("Failed to find a result node for id (%s)" % i.strip())
                 return False
 
-            index = str(i.text.strip())
-            result = int(r.text.strip(), base=0)
-            print("Result Status for Id (%s): %s" % (str(i.text.strip()), r.text))
+            index = str(i.strip())
+            result = int(r.strip(), base=0)
+            print("Result Status for Id (%s): %s" % (str(i.strip()), r))
             if index in settingdict:
                 if result != int(settingdict[index], base=0):
-                    print("Error.  Status Code for id (%s) didn't match expected" % i.text.strip())
+                    print("Error.  Status Code for id (%s) didn't match expected" % i.strip())
                     rc = False
             else:
-                print("Error.  Index %s not in dictionary" % i.text.strip())
+                print("Error.  Index %s not in dictionary" % i.strip())
                 rc = False
         # done with loop
         return rc
@@ -488,20 +416,20 @@ class DFCI_SupportLib(object):
         f = open(resultfile, 'rb')
         rslt = PermissionResultVariable(f)
         f.close()
-        rslt.Print()
+        rslt.Print(ShowXml=False)
         return rslt.Status, rslt.SessionId
 
     def get_sessionid_from_permission_packet(self, identityfile):
         f = open(identityfile, 'rb')
         rslt = PermissionApplyVariable(f)
         f.close()
-        rslt.Print()
+        rslt.Print(ShowXml=False)
         return rslt.SessionId
 
     def get_status_and_sessionid_from_settings_results(self, resultfile, checktype):
         f = open(resultfile, 'rb')
         rslt = SecureSettingsResultVariable(f)
-        rslt.Print()
+        rslt.Print(ShowXml=False)
         f.close()
         if (checktype != "FULL") and (checktype != "BASIC"):
             print('checktype invalid')
@@ -509,7 +437,7 @@ class DFCI_SupportLib(object):
         rslt_rc = rslt.Status
         if rslt_rc == 0 and checktype == "FULL":
             try:
-                tree = ElementTree.fromstring(rslt.Payload)
+                tree = rslt.GetPayloadElementTree()
                 for elem in tree.findall('./Settings/SettingResult'):
                     rc = int(elem.find('Result').text, 0)
                     if rc != 0:
@@ -545,7 +473,7 @@ class DFCI_SupportLib(object):
         f = open(settingsfile, 'rb')
         rslt = SecureSettingsApplyVariable(f)
         f.close()
-        rslt.Print()
+        rslt.Print(ShowXml=False)
         return rslt.SessionId
 
     def get_status_from_dmtools_results(self, resultsfile):
@@ -10,11 +10,13 @@
 ##
 ##
 
+import io
 import sys
 import struct
+from Data import SemPacketCodec
 from edk2toollib.uefi.wincert import *
 from edk2toollib.uefi.status_codes import UefiStatusCode
-from edk2toollib.utility_functions import PrintByteList
+from UtilityFunctions import PrintByteList
 
 ##
 ## SEM Cert Provisioning Apply Variable Data
@@ -34,6 +36,8 @@ class CertProvisioningApplyVariable(object):
 
         self.TestSignature = None
         self.Signature = None
+        self.TestSignatureBuffer = None  # memoryview of the test signature when decoded from a buffer
+        self.SignatureBuffer = None      # memoryview of the signature when decoded from a buffer
         self.TrustedCertSize = 0
         self.TrustedCert = None
         self.HeaderSignature = self.HEADER_SIG_VALUE
@@ -64,99 +68,69 @@ class CertProvisioningApplyVariable(object):
         if(fs == None):
             raise Exception("Invalid File stream")
 
-        #only populate from file stream those parts that are complete in the file stream
-        offset = fs.tell()
-        fs.seek(0,2)
-        end = fs.tell()
-        fs.seek(offset)
+        self.PopulateFromBuffer(fs.read())
 
-        if((end - offset) < self.STATIC_STRUCT_SIZE_V1): #size of the static header data
+    #
+    # Method to un-serialize from a bytes like object (bytes, bytearray, memoryview or mmap).
+    # TrustedCert, TestSignatureBuffer and SignatureBuffer are views of Buffer, not copies.
+    #
+    def PopulateFromBuffer(self, Buffer):
+        view = SemPacketCodec.AsByteView(Buffer)
+
+        if(len(view) < self.STATIC_STRUCT_SIZE_V1): #size of the static header data
             raise Exception("Invalid file stream size")
 
-        self.HeaderSignature = fs.read(4).decode()
+        self.HeaderSignature = str(view[0:4], 'utf-8')
         if self.HeaderSignature != self.HEADER_SIG_VALUE:
             raise Exception("Incorrect Header Signature")
-        self.HeaderVersion = struct.unpack("=B", fs.read(1))[0]
 
+        self.HeaderVersion = view[4]
+        self.TrustedCert = None
         if (self.HeaderVersion == self.VERSION_V1):
-            self.Identity = struct.unpack("=B", fs.read(1))[0]
-            self.SNTarget = struct.unpack("=Q", fs.read(8))[0]
-            self.SessionId = struct.unpack("=I", fs.read(4))[0]
-            self.TrustedCertSize = struct.unpack("=H", fs.read(2))[0]
-            self.TrustedCert = None
+            (_, _, self.Identity, self.SNTarget, self.SessionId,
+             self.TrustedCertSize) = SemPacketCodec.UnpackHeader(SemPacketCodec.PROVISION_APPLY_HEADER_V1, view)
+            Position = SemPacketCodec.PROVISION_APPLY_HEADER_V1.size
+
         elif (self.HeaderVersion == self.VERSION_V2):
-            self.Identity = struct.unpack("=B", fs.read(1))[0]
-            Temp = struct.unpack("=B", fs.read(1))[0]
-            if Temp != 0:
+            (_, _, self.Identity, Rsvd1, Rsvd2, self.SessionId,
+             self.MfgOffset, self.ProductOffset, self.SerialOffset,
+             self.TrustedCertSize, self.TrustedCertOffset, Rsvd3,
+             self.Version, self.Lsv) = SemPacketCodec.UnpackHeader(SemPacketCodec.PROVISION_APPLY_HEADER_V2, view)
+
+            if Rsvd1 != 0:
                 raise Exception("Invalid Reserved Field 1")
-            Temp = struct.unpack("=B", fs.read(1))[0]
-            if Temp != 0:
+            if Rsvd2 != 0:
                 raise Exception("Invalid Reserved Field 2")
-            self.SessionId = struct.unpack("=I", fs.read(4))[0]
-            self.MfgOffset = struct.unpack("=H", fs.read(2))[0]
-            self.ProductOffset = struct.unpack("=H", fs.read(2))[0]
-            self.SerialOffset = struct.unpack("=H", fs.read(2))[0]
-            self.TrustedCertSize = struct.unpack("=H", fs.read(2))[0]
-            self.TrustedCertOffset = struct.unpack("=H", fs.read(2))[0]
-            self.TrustedCert = None
-
-            Temp = struct.unpack("=H", fs.read(2))[0]
-            if Temp != 0:
+            if Rsvd3 != 0:
                 raise Exception("Invalid Reserved Field 1")
-            self.Version = struct.unpack("=I", fs.read(4))[0]
-            self.Lsv = struct.unpack("=I", fs.read(4))[0]
 
             if self.Version < self.Lsv:
                 raise Exception("Invalid Lsv - must not be > Version")
 
-            if ((self.MfgOffset >= self.ProductOffset) or
-                (self.ProductOffset >= self.SerialOffset) or
-                (self.SerialOffset >= self.TrustedCertOffset)):
-                raise Exception("Invalid Offset Structure")
-
-            Temp =  fs.tell()
-            if Temp != self.MfgOffset:
-                raise Exception("Invalid Mfg Offset")
-            self.Manufacturer = fs.read(self.ProductOffset - self.MfgOffset - 1).decode()
-            Temp = struct.unpack("=B", fs.read(1))[0]
-            if Temp != 0:
-                raise Exception("Invalid NULL in Mfg")
-
-            Temp =  fs.tell()
-            if Temp != self.ProductOffset:
-                raise Exception("Invalid Product Offset")
-            self.ProductName = fs.read(self.SerialOffset - self.ProductOffset - 1).decode()
-            Temp = struct.unpack("=B", fs.read(1))[0]
-            if Temp != 0:
-                raise Exception("Invalid NULL in ProductName")
-
-            Temp =  fs.tell()
-            if Temp != self.SerialOffset:
-                raise Exception("Invalid SerialOffset Offset")
-            self.SerialNumber = fs.read(self.TrustedCertOffset - self.SerialOffset - 1).decode()
-            Temp = struct.unpack("=B", fs.read(1))[0]
-            if Temp != 0:
-                raise Exception("Invalid NULL in SerialNumber")
-
-            if self.TrustedCertSize != 0:
-                Temp =  fs.tell()
-                if Temp != self.TrustedCertOffset:
-                    raise Exception("Invalid TrustedCertOffset Offset")
+            (self.Manufacturer, self.ProductName, self.SerialNumber) = SemPacketCodec.DecodeSmBiosStrings(
+                view, SemPacketCodec.PROVISION_APPLY_HEADER_V2.size,
+                self.MfgOffset, self.ProductOffset, self.SerialOffset, self.TrustedCertOffset)
+            Position = self.TrustedCertOffset
         else:
             raise Exception("Invalid header version")
 
-        if((end - fs.tell()) < self.TrustedCertSize):
-            raise Exception("Invalid file stream size (Trusted Cert Size)")
+        TrustedCert = SemPacketCodec.Slice(view, Position, self.TrustedCertSize,
+                                           "Invalid file stream size (Trusted Cert Size)")
+        Position += self.TrustedCertSize
 
         if(self.TrustedCertSize > 0):
-            self.TrustedCert = memoryview(fs.read(self.TrustedCertSize))
+            self.TrustedCert = TrustedCert
 
-        if((end - fs.tell()) > 0):
+        if((len(view) - Position) > 0):
             if(self.TrustedCertSize > 0):
-                self.TestSignature = WinCert.Factory(fs)
+                Size = SemPacketCodec.WinCertSize(view, Position)
+                self.TestSignatureBuffer = view[Position:Position + Size]
+                self.TestSignature = WinCert.Factory(io.BytesIO(self.TestSignatureBuffer))
+                Position += Size
 
-        if((end - fs.tell()) > 0):
-            self.Signature = WinCert.Factory(fs)
+        if((len(view) - Position) > 0):
+            self.SignatureBuffer = view[Position:]
+            self.Signature = WinCert.Factory(io.BytesIO(self.SignatureBuffer))
 
     #
     # Method to Print CertProvisioningApplyVariable to stdout
@@ -181,8 +155,7 @@ class CertProvisioningApplyVariable(object):
         print ("  TrustedCertSize:  0x%X" % self.TrustedCertSize)
         print ("  TrustedCert:    ")
         if(self.TrustedCert != None):
-            ndbl = self.TrustedCert.tolist()
-            PrintByteList(ndbl)
+            PrintByteList(self.TrustedCert)
 
         if(self.TrustedCertSize > 0) and (self.TestSignature != None):
             print ("  TestSignature:   ")
@@ -274,24 +247,24 @@ class CertProvisioningResultVariable(object):
         if(fs == None):
             raise Exception("Invalid File stream")
 
-        #only populate from file stream those parts that are complete in the file stream
-        offset = fs.tell()
-        fs.seek(0,2)
-        end = fs.tell()
-        fs.seek(offset)
+        self.PopulateFromBuffer(fs.read())
+
+    #
+    # Method to un-serialize from a bytes like object (bytes, bytearray, memoryview or mmap)
+    #
+    def PopulateFromBuffer(self, Buffer):
+        view = SemPacketCodec.AsByteView(Buffer)
 
-        if((end - offset) < self.STATIC_STRUCT_SIZE): #size of the static header data
+        if(len(view) < self.STATIC_STRUCT_SIZE): #size of the static header data
             raise Exception("Invalid file stream size")
 
-        self.HeaderSignature = fs.read(4).decode()
+        (HeaderSignature, self.HeaderVersion, self.Identity,
+         self.SessionId, self.Status) = SemPacketCodec.UnpackHeader(SemPacketCodec.PROVISION_RESULT_HEADER, view)
+        self.HeaderSignature = str(HeaderSignature, 'utf-8')
         if self.HeaderSignature != self.HEADER_SIG_VALUE:
             raise Exception("Incorrect Header Signature")
-        self.HeaderVersion = struct.unpack("=B", fs.read(1))[0]
         if (self.HeaderVersion != self.VERSION):
             raise Exception("Incorrect Header Version")
-        self.Identity = struct.unpack("=B", fs.read(1))[0]
-        self.SessionId = struct.unpack("=I", fs.read(4))[0]
-        self.Status = struct.unpack("=Q", fs.read(8))[0]
 
     #
     # Method to Print SEM var to stdout
@@ -0,0 +1,69 @@
+# @file
+#
+# Script to support deferred parsing of the XML payload of the SEM variables
+#
+# Copyright (c), Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+
+##
+## Lazy XML payload support for the SEM Apply/Result variables.
+##
+## Decoding a packet only records the payload string.  The XML is parsed the first time a
+## view of it is requested, and only in the form that was asked for:
+##
+##   GetPayloadDom()         - xml.dom.minidom Document (used by Print for toprettyxml)
+##   GetPayloadElementTree() - xml.etree.ElementTree root Element
+##   IterPayload()           - xml.etree.ElementTree.iterparse over the payload, nothing is retained
+##
+## Callers that only need the header fields (Status, SessionId) never pay for an XML parse.
+##
+
+import io
+import xml.dom.minidom
+import xml.etree.ElementTree
+
+
+class LazyXmlPayload(object):
+
+    #
+    # Record the XML payload string.  Any previously built view is discarded.
+    #
+    def SetXmlPayload(self, Payload):
+        self._XmlPayload = Payload
+        self._XmlDom = None
+        self._XmlRoot = None
+
+    #
+    # Return True if there is an XML payload to view
+    #
+    def HasXmlPayload(self):
+        return getattr(self, '_XmlPayload', None) is not None
+
+    #
+    # Return the minidom Document of the payload, parsing it on first use.  None if there is no payload.
+    #
+    def GetPayloadDom(self):
+        if not self.HasXmlPayload():
+            return None
+        if self._XmlDom is None:
+            self._XmlDom = xml.dom.minidom.parseString(self._XmlPayload)
+        return self._XmlDom
+
+    #
+    # Return the ElementTree root Element of the payload, parsing it on first use.  None if there is no payload.
+    #
+    def GetPayloadElementTree(self):
+        if not self.HasXmlPayload():
+            return None
+        if self._XmlRoot is None:
+            self._XmlRoot = xml.etree.ElementTree.fromstring(self._XmlPayload)
+        return self._XmlRoot
+
+    #
+    # Return an iterparse iterator of (event, element) over the payload.  Nothing is cached, so
+    # callers may clear elements as they go to keep memory flat on large payloads.
+    #
+    def IterPayload(self, events=("end",)):
+        if not self.HasXmlPayload():
+            return iter(())
+        return xml.etree.ElementTree.iterparse(io.BytesIO(self._XmlPayload.encode('utf-8')), events)
@@ -10,17 +10,19 @@
 ##
 ##
 
+import io
 import struct
-import xml.dom.minidom
+from Data import SemPacketCodec
+from Data.LazyXmlPayload import LazyXmlPayload
 from edk2toollib.uefi.wincert import WinCert
 from edk2toollib.uefi.status_codes import UefiStatusCode
-from edk2toollib.utility_functions import PrintByteList
+from UtilityFunctions import PrintByteList
 
 
 ##
 ## SEM Permission Apply Variable Data
 ##
-class PermissionApplyVariable(object):
+class PermissionApplyVariable(LazyXmlPayload):
     STATIC_STRUCT_SIZE_V1=22
     STATIC_STRUCT_SIZE_V2=22
     HEADER_SIG_VALUE = "MPPA"
@@ -36,8 +38,10 @@ class PermissionApplyVariable(object):
         self.HeaderSignature = None
         self.HeaderVersion = 0
         self.Payload = None
-        self._XmlTree = None  #private XML structure
+        self.SetXmlPayload(None)  #private XML structure, parsed on first use
         self.Signature = None
+        self.PayloadBuffer = None    # memoryview of the payload when decoded from a buffer
+        self.SignatureBuffer = None  # memoryview of the signature when decoded from a buffer
         self.SessionId = 0
         self.PayloadSize = 0
         self.Rsvd1 = 0
@@ -68,88 +72,58 @@ class PermissionApplyVariable(object):
         if(fs == None):
             raise Exception("Invalid File stream")
 
-        #only populate from file stream those parts that are complete in the file stream
-        offset = fs.tell()
-        fs.seek(0,2)
-        end = fs.tell()
-        fs.seek(offset)
+        self.PopulateFromBuffer(fs.read())
 
-        if((end - offset) < self.STATIC_STRUCT_SIZE_V1): # minimum size of the static header data
+    #
+    # Method to un-serialize from a bytes like object (bytes, bytearray, memoryview or mmap).
+    # PayloadBuffer and SignatureBuffer are views of Buffer, not copies.
+    #
+    def PopulateFromBuffer(self, Buffer):
+        view = SemPacketCodec.AsByteView(Buffer)
+
+        if(len(view) < self.STATIC_STRUCT_SIZE_V1): # minimum size of the static header data
             raise Exception("Invalid file stream size")
 
-        self.HeaderSignature = fs.read(4).decode()
+        self.HeaderSignature = str(view[0:4], 'utf-8')
         if self.HeaderSignature != self.HEADER_SIG_VALUE:
             print ("  HeaderSignature:  %s" % self.HeaderSignature)
             raise Exception("Incorrect Header Signature")
-        self.HeaderVersion = struct.unpack("=B", fs.read(1))[0]
-        self.Rsvd1 = struct.unpack("=B", fs.read(1))[0]
-        self.Rsvd2 = struct.unpack("=B", fs.read(1))[0]
-        self.Rsvd3 = struct.unpack("=B", fs.read(1))[0]
-        if ((self.Rsvd1 != 0) or
-            (self.Rsvd2 != 0) or
-            (self.Rsvd3 != 0)):
-            raise Exception("Reserved bytes must be zero")
 
         self.Payload = None
 
+        self.HeaderVersion = view[4]
         if (self.HeaderVersion == self.VERSION_V1):
-            self.SNTarget = struct.unpack("=Q", fs.read(8))[0]
-            self.SessionId = struct.unpack("=I", fs.read(4))[0]
-            self.PayloadSize = struct.unpack("=H", fs.read(2))[0]
+            (_, _, self.Rsvd1, self.Rsvd2, self.Rsvd3,
+             self.SNTarget, self.SessionId, self.PayloadSize) = SemPacketCodec.UnpackHeader(SemPacketCodec.PACKET_APPLY_HEADER_V1, view)
+            Position = SemPacketCodec.PACKET_APPLY_HEADER_V1.size
 
         elif (self.HeaderVersion == self.VERSION_V2):
-            if((end - offset) < self.STATIC_STRUCT_SIZE_V2): # minimum size of the static header data
-                raise Exception("Invalid V2 file stream size")
-            self.SessionId = struct.unpack("=I", fs.read(4))[0]
-            self.MfgOffset = struct.unpack("=H", fs.read(2))[0]
-            self.ProductOffset = struct.unpack("=H", fs.read(2))[0]
-            self.SerialOffset = struct.unpack("=H", fs.read(2))[0]
-            self.PayloadSize = struct.unpack("=H", fs.read(2))[0]
-            self.PayloadOffset = struct.unpack("=H", fs.read(2))[0]
-
-            if ((self.MfgOffset >= self.ProductOffset) or
-                (self.ProductOffset >= self.SerialOffset) or
-                (self.SerialOffset >= self.PayloadOffset)):
-                raise Exception("Invalid Offset Structure")
-
-            if (end - fs.tell() < self.PayloadOffset):
-                raise Exception("Packet too small for SmBiosString")
-
-            Temp =  fs.tell()
-            if Temp != self.MfgOffset:
-                raise Exception("Invalid Mfg Offset")
-            self.Manufacturer = fs.read(self.ProductOffset - self.MfgOffset - 1).decode()
-            Temp = struct.unpack("=B", fs.read(1))[0]
-            if Temp != 0:
-                raise Exception("Invalid NULL in Mfg")
-
-            Temp =  fs.tell()
-            if Temp != self.ProductOffset:
-                raise Exception("Invalid Product Offset")
-            self.ProductName = fs.read(self.SerialOffset - self.ProductOffset - 1).decode()
-            Temp = struct.unpack("=B", fs.read(1))[0]
-            if Temp != 0:
-                raise Exception("Invalid NULL in ProductName")
-
-            Temp =  fs.tell()
-            if Temp != self.SerialOffset:
-                raise Exception("Invalid SerialOffset Offset")
-            self.SerialNumber = fs.read(self.PayloadOffset - self.SerialOffset - 1).decode()
-            Temp = struct.unpack("=B", fs.read(1))[0]
-            if Temp != 0:
-                raise Exception("Invalid NULL in ProductName")
+            (_, _, self.Rsvd1, self.Rsvd2, self.Rsvd3,
+             self.SessionId, self.MfgOffset, self.ProductOffset, self.SerialOffset,
+             self.PayloadSize, self.PayloadOffset) = SemPacketCodec.UnpackHeader(SemPacketCodec.PACKET_APPLY_HEADER_V2, view)
+            Position = self.PayloadOffset
         else:
             raise Exception("Invalid header version")
 
-        if((end - fs.tell()) < self.PayloadSize):
-            raise Exception("Invalid file stream size (PayloadSize)")
+        if ((self.Rsvd1 != 0) or
+            (self.Rsvd2 != 0) or
+            (self.Rsvd3 != 0)):
+            raise Exception("Reserved bytes must be zero")
 
-        self.Payload = fs.read(self.PayloadSize).decode()
-        self._XmlTree = xml.dom.minidom.parseString(self.Payload)
+        if (self.HeaderVersion == self.VERSION_V2):
+            (self.Manufacturer, self.ProductName, self.SerialNumber) = SemPacketCodec.DecodeSmBiosStrings(
+                view, SemPacketCodec.PACKET_APPLY_HEADER_V2.size,
+                self.MfgOffset, self.ProductOffset, self.SerialOffset, self.PayloadOffset)
 
+        self.PayloadBuffer = SemPacketCodec.Slice(view, Position, self.PayloadSize,
+                                                  "Invalid file stream size (PayloadSize)")
+        self.Payload = str(self.PayloadBuffer, 'utf-8')
+        self.SetXmlPayload(self.Payload)
 
-        if((end - fs.tell()) > 0):
-            self.Signature = WinCert.Factory(fs)
+        Position += self.PayloadSize
+        if((len(view) - Position) > 0):
+            self.SignatureBuffer = view[Position:]
+            self.Signature = WinCert.Factory(io.BytesIO(self.SignatureBuffer))
 
 
     def AddXmlPayload(self, xmlstring):
@@ -157,12 +131,13 @@ class PermissionApplyVariable(object):
             raise Exception("Can't Add an XML payload to an object already containing payload")
 
         self.Payload = xmlstring
-        self._XmlTree = xml.dom.minidom.parseString(self.Payload)
+        self.SetXmlPayload(self.Payload)
+        self.GetPayloadDom()  # fail early if the caller's xml is not well formed
         self.PayloadSize = len(xmlstring)
     #
-    # Method to Print PermissionApplyVariable to stdout
+    # Method to Print PermissionApplyVariable to stdout.  ShowXml=False skips parsing the payload.
     #
-    def Print(self, ShowRawXmlAsBytes=False):
+    def Print(self, ShowRawXmlAsBytes=False, ShowXml=True):
         print ("PermissionApplyVariable")
         print ("  HeaderSignature:  %s" % self.HeaderSignature)
         print ("  HeaderVersion:    0x%X" % self.HeaderVersion)
@@ -177,16 +152,15 @@ class PermissionApplyVariable(object):
         else:
             raise Exception("Invalid header version")
 
-        if(self._XmlTree is not None):
-            print ("%s" % self._XmlTree.toprettyxml())
-        else:
-            print ("XML TREE DOESN'T EXIST")
+        if(ShowXml):
+            if(self.HasXmlPayload()):
+                print ("%s" % self.GetPayloadDom().toprettyxml())
+            else:
+                print ("XML TREE DOESN'T EXIST")
 
         if(ShowRawXmlAsBytes and (self.Payload != None)):
             print ("  Payload Bytes:    ")
-            ndbl = list(bytearray(self.Payload.encode()))
-            print(type(ndbl ) )
-            PrintByteList(ndbl)
+            PrintByteList(self.Payload.encode())
 
         if(self.Signature != None):
             self.Signature.Print()
@@ -230,7 +204,7 @@ class PermissionApplyVariable(object):
 ##
 ##  SEM Permission Result Variable Data
 ##
-class PermissionResultVariable(object):
+class PermissionResultVariable(LazyXmlPayload):
     STATIC_STRUCT_SIZE=20
     STATIC_STRUCT_SIZE_V2=22
     HEADER_SIG_VALUE = "MPPR"
@@ -244,7 +218,7 @@ class PermissionResultVariable(object):
 
         self.Payload = None
         self.PayloadSize = 0
-        self._XmlTree = None  #private xml structure
+        self.SetXmlPayload(None)  #private xml structure, parsed on first use
 
         if(filestream == None):
             self.HeaderSignature = PermissionResultVariable.HEADER_SIG_VALUE
@@ -260,47 +234,49 @@ class PermissionResultVariable(object):
         if(fs == None):
             raise Exception("Invalid File stream")
 
-        #only populate from file stream those parts that are complete in the file stream
-        offset = fs.tell()
-        fs.seek(0,2)
-        end = fs.tell()
-        fs.seek(offset)
+        self.PopulateFromBuffer(fs.read())
+
+    #
+    # Method to un-serialize from a bytes like object (bytes, bytearray, memoryview or mmap)
+    #
+    def PopulateFromBuffer(self, Buffer):
+        view = SemPacketCodec.AsByteView(Buffer)
 
-        if((end - offset) < PermissionResultVariable.STATIC_STRUCT_SIZE): #size of the static header data
+        if(len(view) < PermissionResultVariable.STATIC_STRUCT_SIZE): #size of the static header data
             raise Exception("Invalid file stream size")
 
-        self.HeaderSignature = fs.read(4).decode()
+        self.HeaderSignature = str(view[0:4], 'utf-8')
         if self.HeaderSignature != PermissionResultVariable.HEADER_SIG_VALUE:
             print ("  HeaderSignature:  %s" % self.HeaderSignature)
             raise Exception("Incorrect Header Signature")
-        self.HeaderVersion = struct.unpack("=B", fs.read(1))[0]
+        self.HeaderVersion = view[4]
         if (self.HeaderVersion != PermissionResultVariable.VERSION_V1 and
             self.HeaderVersion != PermissionResultVariable.VERSION_V2):
             raise Exception("Incorrect Header Version")
-        fs.seek(3,1)  #skip three bytes ahead to avoid the rsvd bytes
-        self.Status = struct.unpack("=Q", fs.read(8))[0]
-        self.SessionId = struct.unpack("=I", fs.read(4))[0]
-        if self.HeaderVersion == PermissionResultVariable.VERSION_V2:
-            if((end - offset) < PermissionResultVariable.STATIC_STRUCT_SIZE_V2): #size of the static header data
+
+        if self.HeaderVersion == PermissionResultVariable.VERSION_V1:
+            (_, _, self.Status, self.SessionId) = SemPacketCodec.UnpackHeader(SemPacketCodec.PERMISSION_RESULT_HEADER_V1, view)
+        else:
+            if(len(view) < PermissionResultVariable.STATIC_STRUCT_SIZE_V2): #size of the static header data
                 raise Exception("Invalid file stream size")
-            self.PayloadSize = struct.unpack("=H", fs.read(2))[0]
+            (_, _, self.Status, self.SessionId,
+             self.PayloadSize) = SemPacketCodec.UnpackHeader(SemPacketCodec.PERMISSION_RESULT_HEADER_V2, view)
             self.Payload = None
-            self._XmlTree = None
+            self.SetXmlPayload(None)
 
-            if((end - fs.tell()) < self.PayloadSize):
-                raise Exception("Invalid file stream size (Payload).  %d" % self.PayloadSize)
+            PayloadBuffer = SemPacketCodec.Slice(view, SemPacketCodec.PERMISSION_RESULT_HEADER_V2.size, self.PayloadSize,
+                                                 "Invalid file stream size (Payload).  %d" % self.PayloadSize)
 
             #is it possible to have 0 sized
             if(self.PayloadSize > 0):
-                self.Payload = fs.read(self.PayloadSize)
-                self.Payload = self.Payload.decode("utf-8")
+                self.Payload = str(PayloadBuffer, "utf-8")
                 self.Payload = self.Payload.rstrip('\x00') #remove ending NULL if there.  this only happens in some cases
-                self._XmlTree = xml.dom.minidom.parseString(self.Payload)
+                self.SetXmlPayload(self.Payload)
 
     #
-    # Method to Print SEM var to stdout
+    # Method to Print SEM var to stdout.  ShowXml=False skips parsing the payload.
     #
-    def Print(self, ShowRawXmlAsBytes=False):
+    def Print(self, ShowRawXmlAsBytes=False, ShowXml=True):
         print ("PermissionResultVariable")
         print ("  HeaderSignature:  %s" % self.HeaderSignature)
         print ("  HeaderVersion:    0x%X" % self.HeaderVersion)
@@ -309,15 +285,15 @@ class PermissionResultVariable(object):
 
         if self.HeaderVersion == PermissionResultVariable.VERSION_V2:
             print ("  Payload Size:     0x%X" % self.PayloadSize)
-            if(self._XmlTree is not None):
-                print ("%s" % self._XmlTree.toprettyxml() )
-            else:
-                print ("XML TREE DOESN'T EXIST" )
+            if(ShowXml):
+                if(self.HasXmlPayload()):
+                    print ("%s" % self.GetPayloadDom().toprettyxml() )
+                else:
+                    print ("XML TREE DOESN'T EXIST" )
 
             if(ShowRawXmlAsBytes and (self.Payload != None)):
                 print ("  Payload Bytes:    " )
-                ndbl = memoryview(self.Payload).tolist()
-                PrintByteList(ndbl)
+                PrintByteList(self.Payload.encode())
 
 
     def Write(self, fs):
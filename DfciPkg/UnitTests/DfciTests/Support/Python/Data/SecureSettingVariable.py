@@ -10,18 +10,21 @@
 ##
 ##
 
+import io
 import struct
 import xml.dom.minidom
+from Data import SemPacketCodec
+from Data.LazyXmlPayload import LazyXmlPayload
 from edk2toollib.uefi.wincert import WinCert
 from edk2toollib.uefi.status_codes import UefiStatusCode
 from edk2toollib.utility_functions import DetachedSignWithSignTool
-from edk2toollib.utility_functions import PrintByteList
+from UtilityFunctions import PrintByteList
 
 
 ##
 ## SEM Secure Settings Apply Variable Data
 ##
-class SecureSettingsApplyVariable(object):
+class SecureSettingsApplyVariable(LazyXmlPayload):
     STATIC_STRUCT_SIZE_V1=22
     STATIC_STRUCT_SIZE_V2=22
     HEADER_SIG_VALUE = "MSSA"
@@ -43,8 +46,10 @@ class SecureSettingsApplyVariable(object):
         self.SessionId = 0
         self.PayloadSize = 0
         self.Payload = None
-        self._XmlTree = None  #private XML structure
+        self.SetXmlPayload(None)  #private XML structure, parsed on first use
         self.Signature = None
+        self.PayloadBuffer = None    # memoryview of the payload when decoded from a buffer
+        self.SignatureBuffer = None  # memoryview of the signature when decoded from a buffer
 
         # V1 unique members
         self.SNTarget = 0
@@ -70,86 +75,52 @@ class SecureSettingsApplyVariable(object):
         if(fs == None):
             raise Exception("Invalid File stream")
 
-        #only populate from file stream those parts that are complete in the file stream
-        offset = fs.tell()
-        fs.seek(0,2)
-        end = fs.tell()
-        fs.seek(offset)
+        self.PopulateFromBuffer(fs.read())
 
-        if((end - offset) < self.STATIC_STRUCT_SIZE_V1): # minimum size of the static header data
+    #
+    # Method to un-serialize from a bytes like object (bytes, bytearray, memoryview or mmap).
+    # PayloadBuffer and SignatureBuffer are views of Buffer, not copies.
+    #
+    def PopulateFromBuffer(self, Buffer):
+        view = SemPacketCodec.AsByteView(Buffer)
+
+        if(len(view) < self.STATIC_STRUCT_SIZE_V1): # minimum size of the static header data
             raise Exception("Invalid file stream size")
 
-        self.HeaderSignature = fs.read(4).decode()
+        self.HeaderSignature = str(view[0:4], 'utf-8')
         if self.HeaderSignature != self.HEADER_SIG_VALUE:
             raise Exception("Incorrect Header Signature")
-        self.HeaderVersion = struct.unpack("=B", fs.read(1))[0]
-        self.rsvd1 = struct.unpack("=B", fs.read(1))[0]
-        self.rsvd2 = struct.unpack("=B", fs.read(1))[0]
-        self.rsvd3 = struct.unpack("=B", fs.read(1))[0]
 
+        self.HeaderVersion = view[4]
         if (self.HeaderVersion == self.VERSION_V1):
-            self.SNTarget = struct.unpack("=Q", fs.read(8))[0]
-            self.SessionId = struct.unpack("=I", fs.read(4))[0]
-            self.PayloadSize = struct.unpack("=H", fs.read(2))[0]
+            (_, _, self.Rsvd1, self.Rsvd2, self.Rsvd3,
+             self.SNTarget, self.SessionId, self.PayloadSize) = SemPacketCodec.UnpackHeader(SemPacketCodec.PACKET_APPLY_HEADER_V1, view)
+            Position = SemPacketCodec.PACKET_APPLY_HEADER_V1.size
 
         elif (self.HeaderVersion == self.VERSION_V2):
-            if((end - offset) < self.STATIC_STRUCT_SIZE_V2): # minimum size for v2 data
-                raise Exception("Invalid V2 file stream size")
-            self.SessionId = struct.unpack("=I", fs.read(4))[0]
-            self.MfgOffset = struct.unpack("=H", fs.read(2))[0]
-            self.ProductOffset = struct.unpack("=H", fs.read(2))[0]
-            self.SerialOffset = struct.unpack("=H", fs.read(2))[0]
-            self.PayloadSize = struct.unpack("=H", fs.read(2))[0]
-            self.PayloadOffset = struct.unpack("=H", fs.read(2))[0]
-
-            if (end - fs.tell() < self.PayloadOffset):
-                raise Exception("Packet too small for SmBiosString")
-
-            if ((self.MfgOffset >= self.ProductOffset) or
-                (self.ProductOffset >= self.SerialOffset) or
-                (self.SerialOffset >= self.PayloadOffset)):
-                raise Exception("Invalid Offset Structure")
-
-            Temp =  fs.tell()
-            if Temp != self.MfgOffset:
-                raise Exception("Invalid Mfg Offset")
-            self.Manufacturer = fs.read(self.ProductOffset - self.MfgOffset - 1).decode()
-            Temp = struct.unpack("=B", fs.read(1))[0]
-            if Temp != 0:
-                raise Exception("Invalid NULL in Mfg")
-
-            Temp =  fs.tell()
-            if Temp != self.ProductOffset:
-                raise Exception("Invalid Product Offset")
-            self.ProductName = fs.read(self.SerialOffset - self.ProductOffset - 1).decode()
-            Temp = struct.unpack("=B", fs.read(1))[0]
-            if Temp != 0:
-                raise Exception("Invalid NULL in ProductName")
-
-            Temp =  fs.tell()
-            if Temp != self.SerialOffset:
-                raise Exception("Invalid SerialOffset Offset")
-            self.SerialNumber = fs.read(self.PayloadOffset - self.SerialOffset - 1).decode()
-            Temp = struct.unpack("=B", fs.read(1))[0]
-            if Temp != 0:
-                raise Exception("Invalid NULL in SerialNumber")
+            (_, _, self.Rsvd1, self.Rsvd2, self.Rsvd3,
+             self.SessionId, self.MfgOffset, self.ProductOffset, self.SerialOffset,
+             self.PayloadSize, self.PayloadOffset) = SemPacketCodec.UnpackHeader(SemPacketCodec.PACKET_APPLY_HEADER_V2, view)
+
+            (self.Manufacturer, self.ProductName, self.SerialNumber) = SemPacketCodec.DecodeSmBiosStrings(
+                view, SemPacketCodec.PACKET_APPLY_HEADER_V2.size,
+                self.MfgOffset, self.ProductOffset, self.SerialOffset, self.PayloadOffset)
+            Position = self.PayloadOffset
         else:
             raise Exception("Invalid header version")
 
-        self.Payload = None
-        self._PayloadXml = None
         self.Signature = None
+        self.SignatureBuffer = None
 
-        if((end - fs.tell()) < self.PayloadSize):
-            raise Exception("Invalid file stream size (payload size incorrect)")
+        self.PayloadBuffer = SemPacketCodec.Slice(view, Position, self.PayloadSize,
+                                                  "Invalid file stream size (payload size incorrect)")
+        self.Payload = str(self.PayloadBuffer, 'utf-8')
+        self.SetXmlPayload(self.Payload.rstrip('\x00'))
 
-        self.Payload = fs.read(self.PayloadSize).decode('utf-8')
-        prep = self.Payload
-        prep = prep.rstrip('\x00')
-        self._PayloadXml = xml.dom.minidom.parseString(prep)
-
-        if((end - fs.tell()) > 0):
-            self.Signature = WinCert.Factory(fs)
+        Position += self.PayloadSize
+        if((len(view) - Position) > 0):
+            self.SignatureBuffer = view[Position:]
+            self.Signature = WinCert.Factory(io.BytesIO(self.SignatureBuffer))
 
 
     def AddXmlPayload(self, xmlstring):
@@ -157,13 +128,14 @@ class SecureSettingsApplyVariable(object):
             raise Exception("Can't Add an XML payload to an object already containing payload")
         xmlclean = ' '.join(xmlstring.split())  #get rid of extra whitespace and new line chars.  This changes newline to blank which i don't like but better than before.  If replace with '' then xml attributes are messed up
         self.Payload = xmlclean;
-        self._PayloadXml = xml.dom.minidom.parseString(xmlclean)
+        self.SetXmlPayload(xmlclean)
+        self.GetPayloadDom()  # fail early if the caller's xml is not well formed
         self.PayloadSize = len(xmlclean)
 
     #
-    # Method to Print SecureSettingsApplyVariable to stdout
+    # Method to Print SecureSettingsApplyVariable to stdout.  ShowXml=False skips parsing the payload.
     #
-    def Print(self, ShowRawXmlAsBytes=False):
+    def Print(self, ShowRawXmlAsBytes=False, ShowXml=True):
         print ("SecureSettingsApplyVariable")
         print ("  HeaderSignature:  %s" % self.HeaderSignature)
         print ("  HeaderVersion:    0x%X" % self.HeaderVersion)
@@ -178,16 +150,15 @@ class SecureSettingsApplyVariable(object):
         else:
             raise Exception("Invalid header version")
 
-        if(self._PayloadXml is not None):
-            print ("%s" % self._PayloadXml.toprettyxml())
-        else:
-            print ("XML TREE DOESN'T EXIST")
+        if(ShowXml):
+            if(self.HasXmlPayload()):
+                print ("%s" % self.GetPayloadDom().toprettyxml())
+            else:
+                print ("XML TREE DOESN'T EXIST")
 
         if(ShowRawXmlAsBytes and (self.Payload is not None)):
             print ("  Payload Bytes:    ")
-            ndbl = list(bytearray(self.Payload.encode()))
-            print(type(ndbl))
-            PrintByteList(ndbl)
+            PrintByteList(self.Payload.encode())
 
         if(self.Signature != None):
             self.Signature.Print()
@@ -230,7 +201,7 @@ class SecureSettingsApplyVariable(object):
 ##
 ##  SEM Secure Settings Result Variable Data
 ##
-class SecureSettingsResultVariable(object):
+class SecureSettingsResultVariable(LazyXmlPayload):
     STATIC_STRUCT_SIZE=22
     HEADER_SIG_VALUE = "MSSR"
     VERSION = 1
@@ -243,9 +214,9 @@ class SecureSettingsResultVariable(object):
             self.SessionId = 0
             self.PayloadSize = 0
             self.Payload = None
-            self._XmlTree = None  #private xml structure
+            self.SetXmlPayload(None)  #private xml structure, parsed on first use
         else:
-            self._XmlTree = None
+            self.SetXmlPayload(None)
             self.PopulateFromFileStream(filestream)
     #
     # Method to un-serialize from a filestream
@@ -254,54 +225,51 @@ class SecureSettingsResultVariable(object):
         if(fs == None):
             raise Exception("Invalid File stream")
 
-        #only populate from file stream those parts that are complete in the file stream
-        offset = fs.tell()
-        fs.seek(0,2)
-        end = fs.tell()
-        fs.seek(offset)
+        self.PopulateFromBuffer(fs.read())
 
-        if((end - offset) < SecureSettingsResultVariable.STATIC_STRUCT_SIZE): #size of the static header data
+    #
+    # Method to un-serialize from a bytes like object (bytes, bytearray, memoryview or mmap)
+    #
+    def PopulateFromBuffer(self, Buffer):
+        view = SemPacketCodec.AsByteView(Buffer)
+
+        if(len(view) < SecureSettingsResultVariable.STATIC_STRUCT_SIZE): #size of the static header data
             raise Exception("Invalid file stream size")
 
-        self.HeaderSignature = str(fs.read(4))
-        self.HeaderVersion = struct.unpack("=B", fs.read(1))[0]
-        fs.seek(3,1)  #skip three bytes ahead to avoid the rsvd bytes
-        self.Status = struct.unpack("=Q", fs.read(8))[0]
-        self.SessionId = struct.unpack("=I", fs.read(4))[0]
-        self.PayloadSize = struct.unpack("=H", fs.read(2))[0]
+        (HeaderSignature, self.HeaderVersion, self.Status,
+         self.SessionId, self.PayloadSize) = SemPacketCodec.UnpackHeader(SemPacketCodec.SETTINGS_RESULT_HEADER, view)
+        self.HeaderSignature = str(HeaderSignature)
         self.Payload = None
-        self._XmlTree = None
+        self.SetXmlPayload(None)
 
-        if((end - fs.tell()) < self.PayloadSize):
-            raise Exception("Invalid file stream size (Payload).  %d" % self.PayloadSize)
+        PayloadBuffer = SemPacketCodec.Slice(view, SemPacketCodec.SETTINGS_RESULT_HEADER.size, self.PayloadSize,
+                                             "Invalid file stream size (Payload).  %d" % self.PayloadSize)
 
         #is it possible to have 0 sized
         if(self.PayloadSize > 0):
-            self.Payload = fs.read(self.PayloadSize)
-            self.Payload = self.Payload.decode("utf-8")
+            self.Payload = str(PayloadBuffer, "utf-8")
             self.Payload = self.Payload.rstrip('\x00') #remove ending NULL if there.  this only happens in some cases
-            self._XmlTree = xml.dom.minidom.parseString(self.Payload)
+            self.SetXmlPayload(self.Payload)
 
     #
-    # Method to Print SEM var results to stdout
+    # Method to Print SEM var results to stdout.  ShowXml=False skips parsing the payload.
     #
-    def Print(self, ShowRawXmlAsBytes=False):
+    def Print(self, ShowRawXmlAsBytes=False, ShowXml=True):
         print ("SecureSettingResultVariable")
         print ("  HeaderSignature:  %s" % self.HeaderSignature)
         print ("  HeaderVersion:    0x%X" % self.HeaderVersion)
         print ("  SessionId:        0x%X" % (self.SessionId))
         print ("  Status:           %s (0x%X)" % (UefiStatusCode().Convert64BitToString(self.Status), self.Status))
         print ("  Payload Size:     0x%X" % self.PayloadSize)
-        if(self._XmlTree is not None):
-            print ("%s" % self._XmlTree.toprettyxml() )
-        else:
-            print ("XML TREE DOESN'T EXIST" )
+        if(ShowXml):
+            if(self.HasXmlPayload()):
+                print ("%s" % self.GetPayloadDom().toprettyxml() )
+            else:
+                print ("XML TREE DOESN'T EXIST" )
 
         if(ShowRawXmlAsBytes and (self.Payload is not None)):
             print ("  Payload Bytes:    " )
-            ndbl = list(bytearray(self.Payload.encode()))
-            print(type(ndbl))
-            PrintByteList(ndbl)
+            PrintByteList(self.Payload.encode())
 
 
     def Write(self, fs):
@@ -320,12 +288,12 @@ class SecureSettingsResultVariable(object):
 ##
 ##  SEM Secure Settings Current Variable Data
 ##
-class SecureSettingsCurrentVariable(object):
+class SecureSettingsCurrentVariable(LazyXmlPayload):
     STATIC_STRUCT_SIZE=0
 
     def __init__(self, filestream=None):
         self._Payload = None
-        self._XmlTree = None  #private xml structure
+        self.SetXmlPayload(None)  #private xml structure, parsed on first use
         if(filestream != None):
             self.PopulateFromFileStream(filestream)
     #
@@ -344,16 +312,20 @@ class SecureSettingsCurrentVariable(object):
         if((end - offset) < 1): # no data
             raise Exception("Invalid file stream size.  No data")
         self._Payload = fs.read()
-        self._Payload = self._Payload.rstrip('\x00')
-        self._XmlTree = xml.dom.minidom.parseString(self._Payload)
+        if isinstance(self._Payload, (bytes, bytearray)):
+            self._Payload = self._Payload.rstrip(b'\x00')
+            self.SetXmlPayload(str(self._Payload, 'utf-8'))
+        else:
+            self._Payload = self._Payload.rstrip('\x00')
+            self.SetXmlPayload(self._Payload)
 
     #
     # Method to Print SEM var to stdout
     #
     def Print(self):
         print ("Current Settings XML")
-        if(self._XmlTree is not None):
-            print ("%s" % self._XmlTree.toprettyxml())
+        if(self.HasXmlPayload()):
+            print ("%s" % self.GetPayloadDom().toprettyxml())
         else:
             print ("XML TREE DOESN'T EXIST")
 
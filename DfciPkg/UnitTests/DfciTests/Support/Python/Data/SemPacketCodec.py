@@ -0,0 +1,122 @@
+# @file
+#
+# Script to support decoding the binary SEM variables from an in memory buffer
+#
+# Copyright (c), Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+
+##
+## Zero copy decode support for the SEM Apply/Result variables.
+##
+## Each fixed header is decoded with one precompiled struct.Struct.unpack_from call, and the
+## variable length parts (payload, trusted cert, signatures) are returned as memoryview slices
+## of the caller's buffer.  Any bytes like object can be decoded: bytes, bytearray, memoryview
+## or mmap.
+##
+
+import struct
+
+#
+# Apply variable headers
+#
+# Settings and Permission apply:
+#   V1 - Signature, Version, Rsvd1, Rsvd2, Rsvd3, SNTarget, SessionId, PayloadSize
+#   V2 - Signature, Version, Rsvd1, Rsvd2, Rsvd3, SessionId, MfgOffset, ProductOffset,
+#        SerialOffset, PayloadSize, PayloadOffset
+#
+PACKET_APPLY_HEADER_V1 = struct.Struct("=4sBBBBQIH")
+PACKET_APPLY_HEADER_V2 = struct.Struct("=4sBBBBIHHHHH")
+
+# Cert provisioning apply:
+#   V1 - Signature, Version, Identity, SNTarget, SessionId, TrustedCertSize
+#   V2 - Signature, Version, Identity, Rsvd1, Rsvd2, SessionId, MfgOffset, ProductOffset,
+#        SerialOffset, TrustedCertSize, TrustedCertOffset, Rsvd3, Version, Lsv
+#
+PROVISION_APPLY_HEADER_V1 = struct.Struct("=4sBBQIH")
+PROVISION_APPLY_HEADER_V2 = struct.Struct("=4sBBBBIHHHHHHII")
+
+#
+# Result variable headers
+#
+# Settings result - Signature, Version, (3 reserved), Status, SessionId, PayloadSize
+# Permission result V1 - Signature, Version, (3 reserved), Status, SessionId
+# Permission result V2 - Signature, Version, (3 reserved), Status, SessionId, PayloadSize
+# Cert provisioning result - Signature, Version, Identity, SessionId, Status
+#
+SETTINGS_RESULT_HEADER = struct.Struct("=4sB3xQIH")
+PERMISSION_RESULT_HEADER_V1 = struct.Struct("=4sB3xQI")
+PERMISSION_RESULT_HEADER_V2 = struct.Struct("=4sB3xQIH")
+PROVISION_RESULT_HEADER = struct.Struct("=4sBBIQ")
+
+# WIN_CERTIFICATE.dwLength is the first field of every WinCert
+WIN_CERT_LENGTH = struct.Struct("=I")
+
+
+#
+# Return a flat, read only, byte memoryview of Buffer without copying it
+#
+def AsByteView(Buffer):
+    if(Buffer is None):
+        raise Exception("Invalid buffer")
+
+    view = memoryview(Buffer)
+    if (view.ndim != 1) or (view.format != 'B'):
+        view = view.cast('B')
+    return view.toreadonly()
+
+
+#
+# Decode a fixed header at Offset.  Returns the tuple of header fields.
+#
+def UnpackHeader(Layout, View, Offset=0):
+    if((len(View) - Offset) < Layout.size):
+        raise Exception("Invalid buffer size")
+    return Layout.unpack_from(View, Offset)
+
+
+#
+# Return the memoryview slice View[Offset:Offset+Size], raising ErrorMessage if the buffer is too small
+#
+def Slice(View, Offset, Size, ErrorMessage):
+    if((len(View) - Offset) < Size):
+        raise Exception(ErrorMessage)
+    return View[Offset:Offset + Size]
+
+
+#
+# Return the size of the WinCert that starts at Offset, from its dwLength field
+#
+def WinCertSize(View, Offset):
+    (length,) = UnpackHeader(WIN_CERT_LENGTH, View, Offset)
+    if((len(View) - Offset) < length):
+        raise Exception("Invalid buffer size (WinCert)")
+    return length
+
+
+#
+# Decode the three NULL terminated SMBIOS strings of a V2 header.
+#
+# HeaderSize is where the strings must start.  EndOffset is the offset of the data that follows
+# the strings (PayloadOffset or TrustedCertOffset).  Returns (Manufacturer, ProductName, SerialNumber).
+#
+def DecodeSmBiosStrings(View, HeaderSize, MfgOffset, ProductOffset, SerialOffset, EndOffset):
+    if ((MfgOffset >= ProductOffset) or
+        (ProductOffset >= SerialOffset) or
+        (SerialOffset >= EndOffset)):
+        raise Exception("Invalid Offset Structure")
+
+    if (len(View) < EndOffset):
+        raise Exception("Packet too small for SmBiosString")
+
+    if HeaderSize != MfgOffset:
+        raise Exception("Invalid Mfg Offset")
+
+    strings = []
+    for (start, end, name) in ((MfgOffset, ProductOffset, "Mfg"),
+                               (ProductOffset, SerialOffset, "ProductName"),
+                               (SerialOffset, EndOffset, "SerialNumber")):
+        if View[end - 1] != 0:
+            raise Exception("Invalid NULL in %s" % name)
+        strings.append(str(View[start:end - 1], 'utf-8'))
+
+    return tuple(strings)
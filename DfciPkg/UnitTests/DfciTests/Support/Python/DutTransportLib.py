@@ -0,0 +1,400 @@
+# @file
+#
+# DutTransportLib - Framed, pipelined transport between the test host and PyRobotRemote
+#
+# Copyright (c), Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+##
+## The Robot Framework remote interface (port 8270) makes one XML-RPC HTTP request per
+## keyword, with binary data base64 encoded in the XML.  This transport keeps one TCP
+## connection open to the DUT and carries length prefixed binary frames:
+##
+##   Frame = Length (4) | RequestId (4) | Type (1) | HeaderLength (4) | Header | Data
+##
+## All integers are big endian.  Length is the size of everything after the Length field.
+## Header is UTF-8 JSON: {"op": name, "args": {...}} for a request, {"result": ...} for a
+## response and {"error": message} for an error.  Data is raw bytes (variable contents,
+## staged files) and is never encoded.
+##
+## Requests may be pipelined: a client can send any number of requests before reading the
+## responses.  The server handles the requests of a connection in order and answers in the
+## same order, each response carrying the RequestId of its request.
+##
+## PyRobotRemote runs a FramedServer on ROBOT_PORT3.  On the host, DutTransportLib is a Robot
+## Framework library (Library  Support${/}Python${/}DutTransportLib.py) with keywords for
+## variable get/set, staged file transfer and status, or FramedClient can be used directly.
+##
+## The host can also run an OnlineListener (ONLINE_PORT).  After every boot PyRobotRemote
+## connects to the registered listener and sends one line of JSON:
+##
+##   {"event": "online", "boot_id": id, "version": RobotRemoteVersion}
+##
+## so the host can block until the DUT is back, instead of polling it through a reboot.
+##
+
+import json
+import logging
+import socket
+import socketserver
+import struct
+import threading
+
+FRAME_PORT = 8272
+ONLINE_PORT = 8273
+
+MSG_REQUEST = 1
+MSG_RESPONSE = 2
+MSG_ERROR = 3
+
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+_FrameHeader = struct.Struct('>IIBI')  # Length, RequestId, Type, HeaderLength
+_FRAME_FIXED_SIZE = _FrameHeader.size - 4  # Bytes counted by Length before the Header
+
+
+def encode_frame(request_id, msg_type, header, data=b''):
+    header_bytes = json.dumps(header).encode('utf-8')
+    length = _FRAME_FIXED_SIZE + len(header_bytes) + len(data)
+    if length > MAX_FRAME_SIZE:
+        raise Exception(f'Frame of {length} bytes is larger than {MAX_FRAME_SIZE}')
+    return b''.join((_FrameHeader.pack(length, request_id, msg_type, len(header_bytes)), header_bytes, data))
+
+
+def _read_exact(rfile, size):
+    data = rfile.read(size)
+    if len(data) != size:
+        raise ConnectionError('Connection closed in the middle of a frame')
+    return data
+
+
+#
+# Read one frame from the buffered reader rfile.  Returns (request_id, type, header, data),
+# or None if the connection was closed between frames.
+#
+def read_frame(rfile):
+    prefix = rfile.read(_FrameHeader.size)
+    if not prefix:
+        return None
+    if len(prefix) != _FrameHeader.size:
+        raise ConnectionError('Connection closed in the middle of a frame')
+
+    (length, request_id, msg_type, header_length) = _FrameHeader.unpack(prefix)
+    if (length > MAX_FRAME_SIZE) or (header_length > length - _FRAME_FIXED_SIZE):
+        raise ConnectionError(f'Invalid frame length {length} header length {header_length}')
+
+    body = _read_exact(rfile, length - _FRAME_FIXED_SIZE)
+    header = json.loads(body[:header_length].decode('utf-8'))
+    return (request_id, msg_type, header, body[header_length:])
+
+
+class FramedRequestHandler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        addr = self.client_address
+        logging.info(f'Framed transport connection from {addr[0]}:{addr[1]}')
+        while True:
+            try:
+                frame = read_frame(self.rfile)
+                if frame is None:
+                    break
+
+                (request_id, msg_type, header, data) = frame
+                if msg_type != MSG_REQUEST:
+                    raise ConnectionError(f'Unexpected frame type {msg_type}')
+
+                (msg_type, header, data) = self.server.dispatch(header, data)
+                self.wfile.write(encode_frame(request_id, msg_type, header, data))
+            except (ConnectionError, OSError) as e:
+                logging.info(f'Framed transport connection from {addr[0]}:{addr[1]} closed: {e}')
+                break
+
+
+#
+# Serves the operations in handlers, a dictionary of op name to function(args, data) that
+# returns (result, data).  result must be JSON serializable.
+#
+class FramedServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, handlers):
+        self.handlers = handlers
+        super().__init__(address, FramedRequestHandler)
+
+    def dispatch(self, header, data):
+        op = header.get('op')
+        handler = self.handlers.get(op)
+        if handler is None:
+            return (MSG_ERROR, {'error': f'Unknown operation {op}'}, b'')
+        try:
+            (result, data) = handler(header.get('args') or {}, data)
+            return (MSG_RESPONSE, {'result': result}, data if data is not None else b'')
+        except Exception as e:
+            logging.exception(f'Framed transport operation {op} failed')
+            return (MSG_ERROR, {'error': f'{type(e).__name__}: {e}'}, b'')
+
+    #
+    # Serve on a background thread
+    #
+    def start(self):
+        t = threading.Thread(target=self.serve_forever, daemon=True)
+        t.start()
+        return t
+
+
+#
+# Persistent connection to a FramedServer.  Not thread safe; use one client per thread.
+#
+class FramedClient(object):
+
+    def __init__(self, host, port=FRAME_PORT, timeout=30.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._sock = None
+        self._rfile = None
+        self._request_id = 0
+
+    def connect(self):
+        if self._sock is None:
+            self._sock = socket.create_connection((self.host, self.port), self.timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._rfile = self._sock.makefile('rb')
+
+    def close(self):
+        if self._sock is not None:
+            self._rfile.close()
+            self._sock.close()
+            self._sock = None
+            self._rfile = None
+
+    def _send_frames(self, frames, errors):
+        try:
+            for frame in frames:
+                self._sock.sendall(frame)
+        except OSError as e:
+            errors.append(e)
+
+    #
+    # Send one request and return (result, data)
+    #
+    def call(self, op, args=None, data=b''):
+        return self.call_many([(op, args, data)])[0]
+
+    #
+    # Pipeline a list of (op, args, data) requests.  All the requests are sent before the
+    # responses are read.  Returns the list of (result, data) in request order.  If any
+    # request failed on the DUT, raises after all the responses are read.
+    #
+    def call_many(self, requests):
+        self.connect()
+
+        frames = []
+        ids = []
+        for (op, args, data) in requests:
+            self._request_id = (self._request_id + 1) & 0xFFFFFFFF
+            ids.append(self._request_id)
+            frames.append(encode_frame(self._request_id, MSG_REQUEST, {'op': op, 'args': args or {}}, data or b''))
+
+        #
+        # Send from another thread while reading, so a long pipeline can not fill both
+        # socket buffers and deadlock
+        #
+        send_errors = []
+        sender = None
+        if len(frames) == 1:
+            self._send_frames(frames, send_errors)
+        else:
+            sender = threading.Thread(target=self._send_frames, args=(frames, send_errors), daemon=True)
+            sender.start()
+
+        responses = []
+        errors = []
+        try:
+            for (index, request_id) in enumerate(ids):
+                if send_errors:
+                    raise send_errors[0]
+                frame = read_frame(self._rfile)
+                if frame is None:
+                    raise ConnectionError('Connection closed by the DUT')
+                (response_id, msg_type, header, data) = frame
+                if response_id != request_id:
+                    raise ConnectionError(f'Response {response_id} does not match request {request_id}')
+                if msg_type == MSG_ERROR:
+                    errors.append(f'{requests[index][0]}: {header.get("error")}')
+                    responses.append((None, b''))
+                else:
+                    responses.append((header.get('result'), data))
+        except Exception:
+            self.close()
+            raise
+        finally:
+            if sender is not None:
+                sender.join()
+
+        if errors:
+            raise Exception('DUT operation failed - ' + '; '.join(errors))
+        return responses
+
+
+class OnlineRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            notification = json.loads(self.rfile.readline(64 * 1024).decode('utf-8'))
+        except (OSError, ValueError) as e:
+            logging.info(f'Invalid online notification from {self.client_address[0]}: {e}')
+            return
+        self.server.notify(self.client_address[0], notification)
+        self.wfile.write(b'ok\n')
+
+
+#
+# Host side listener for the DUT online notifications.  The last notification of each DUT
+# address is kept, and wait_for blocks until one with a new boot id arrives.
+#
+class OnlineListener(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address):
+        self._condition = threading.Condition()
+        self.online = {}  # DUT address -> last notification
+        super().__init__(address, OnlineRequestHandler)
+
+    def notify(self, address, notification):
+        logging.info(f'DUT {address} online: {notification}')
+        with self._condition:
+            self.online[address] = notification
+            self._condition.notify_all()
+
+    #
+    # Wait for a notification from address with a boot id other than previous_boot_id.
+    # Returns the notification, or None after timeout seconds.
+    #
+    def wait_for(self, address, previous_boot_id, timeout):
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._is_new(address, previous_boot_id), timeout):
+                return None
+            return self.online[address]
+
+    def _is_new(self, address, previous_boot_id):
+        notification = self.online.get(address)
+        return (notification is not None) and (notification.get('boot_id') != previous_boot_id)
+
+    def start(self):
+        t = threading.Thread(target=self.serve_forever, daemon=True)
+        t.start()
+        return t
+
+
+##
+## Robot Framework keywords for the framed transport.  The keywords return the same values as
+## the matching PyRobotRemote keywords (GetUefiVariable, SetUefiVariable, ReadStagedFile, ...).
+##
+class DutTransportLib(object):
+    ROBOT_LIBRARY_SCOPE = 'GLOBAL'
+
+    def __init__(self):
+        self._client = None
+        self._listener = None
+
+    def open_dut_transport(self, host, port=FRAME_PORT, timeout=30):
+        self.close_dut_transport()
+        self._client = FramedClient(host, int(port), float(timeout))
+        self._client.connect()
+
+    def close_dut_transport(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            raise Exception('Open Dut Transport must be called first')
+        return self._client
+
+    def dut_get_uefi_variable(self, name, guid, trim=None):
+        (result, data) = self._get_client().call('GetVariable', {'name': name, 'guid': guid, 'trim': trim})
+        return (result['rc'], data if result['rc'] == 0 else None, result['error'])
+
+    def dut_set_uefi_variable(self, name, guid, attrs=None, contents=None):
+        (result, _) = self._get_client().call('SetVariable', {'name': name, 'guid': guid, 'attrs': attrs}, contents)
+        return result
+
+    #
+    # Same operations and results as the PyRobotRemote UefiVariableBatch keyword, in one frame
+    #
+    def dut_uefi_variable_batch(self, operations):
+        wire_operations = []
+        contents = []
+        for operation in operations:
+            if operation[0] == 'Set':
+                (name, guid, attrs, data) = (list(operation[1:]) + [None, None])[:4]
+                data = data if data is not None else b''
+                wire_operations.append(['Set', name, guid, attrs, len(data)])
+                contents.append(data)
+            else:
+                wire_operations.append(list(operation))
+
+        (results, data) = self._get_client().call('VariableBatch', {'operations': wire_operations}, b''.join(contents))
+
+        data = memoryview(data)
+        offset = 0
+        for (index, operation) in enumerate(wire_operations):
+            if operation[0] == 'Get':
+                (rc, length, errorstring) = results[index]
+                var = data[offset:offset + length].tobytes() if rc == 0 else None
+                offset += length
+                results[index] = (rc, var, errorstring)
+        return results
+
+    def dut_read_staged_file(self, staged_file_name):
+        (result, data) = self._get_client().call('ReadStagedFile', {'name': staged_file_name})
+        return (result['status'], data if result['status'] == '1' else result['error'])
+
+    def dut_write_staged_file(self, staged_file_name, data):
+        (result, _) = self._get_client().call('WriteStagedFile', {'name': staged_file_name}, data)
+        return (result['status'], result['error'])
+
+    def dut_write_staged_action(self, cmd, arg1=None, arg2=None, arg3=None, arg4=None):
+        self._get_client().call('WriteStagedAction', {'cmd': cmd, 'arg1': arg1, 'arg2': arg2, 'arg3': arg3, 'arg4': arg4})
+
+    def dut_get_status(self):
+        (result, _) = self._get_client().call('GetStatus')
+        return result['status']
+
+    #
+    # Start the online listener (once).  Returns the port it listens on.
+    #
+    def start_online_listener(self, port=ONLINE_PORT):
+        if self._listener is None:
+            self._listener = OnlineListener(('0.0.0.0', int(port)))
+            self._listener.start()
+        return self._listener.server_address[1]
+
+    #
+    # The address of this host on the route to the DUT, for the DUT to send notifications to
+    #
+    def get_host_address_for_dut(self, dut_address):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect((dut_address, FRAME_PORT))
+            return s.getsockname()[0]
+
+    #
+    # Block until the DUT sends an online notification with a boot id other than
+    # previous_boot_id.  Returns the new boot id.
+    #
+    def wait_for_dut_online(self, dut_address, previous_boot_id=None, timeout=600):
+        if self._listener is None:
+            raise Exception('Start Online Listener must be called first')
+        notification = self._listener.wait_for(socket.gethostbyname(dut_address), previous_boot_id, float(timeout))
+        if notification is None:
+            raise Exception(f'DUT {dut_address} did not come online within {timeout} seconds')
+        return notification.get('boot_id')
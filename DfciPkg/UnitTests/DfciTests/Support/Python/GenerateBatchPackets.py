@@ -0,0 +1,283 @@
+# @file
+#
+# Script to Generate many Device Firmware Configuration Interface packets in one process
+#
+# Copyright (c), Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+##
+## Script to Generate many Device Firmware Configuration Interface packets in one process
+##
+## Each packet in the manifest is built by calling main() of the matching generator
+## (GenerateSettingsPacketData, GeneratePermissionPacketData or GenerateCertProvisionData)
+## with the same arguments that would be passed on its command line.  Python start up,
+## edk2toollib import and the signtool lookup are paid once for the whole batch.
+##
+## Manifest format (JSON, or YAML when PyYAML is installed):
+##
+##  {
+##    "Packets": [
+##      { "Type": "Settings",
+##        "Args": ["--HdrVersion", "2", "--Step1Enable", "--Step2Enable", "--SigningPfxFile", "Leaf.pfx",
+##                 "--Step3Enable", "--FinalizeResultFile", "Settings_apply.bin", "--XmlFilePath", "Settings.xml"] },
+##      { "Type": "Identity",
+##        "Args": { "--Step1Enable": true, "--Identity": 1, "--CertFilePath": "Leaf.cer", ... } }
+##    ]
+##  }
+##
+## Type is one of Settings, Permission or Identity.  Args is either the command line list, or a
+## dictionary of option to value where true adds a flag and false/null leaves the option out.
+##
+## An entry may also have a Targets list of device targets (serial numbers).  It is expanded
+## into one packet per target with every {Target} in its Args replaced by the target, ie:
+##
+##      { "Type": "Settings", "Targets": ["1001", "1002"],
+##        "Args": ["--HdrVersion", "2", "--SMBIOSSerial", "{Target}", ...,
+##                 "--FinalizeResultFile", "Settings_{Target}.bin"] }
+##
+## With --Jobs the packets are built by a pool of worker processes.  Every packet writes only
+## its own output files and the ResultFile is in manifest order, so the results do not depend
+## on the number of workers.  Without --KeepGoing a failure cancels the packets no worker has
+## started yet; packets already started still finish and are reported.
+##
+## THIS IS FOR UNIT TEST
+##
+
+import os, sys
+import argparse
+import logging
+import datetime
+import json
+import traceback
+import concurrent.futures
+
+#get script path
+sp = os.path.dirname(os.path.realpath(sys.argv[0]))
+
+#setup python path for build modules
+sys.path.append(sp)
+
+import GenerateSettingsPacketData
+import GeneratePermissionPacketData
+import GenerateCertProvisionData
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+gGenerators = {
+    "Settings":   GenerateSettingsPacketData,
+    "Permission": GeneratePermissionPacketData,
+    "Identity":   GenerateCertProvisionData,
+}
+
+
+#
+# Read the manifest and return the list of packet entries
+#
+def LoadManifest(filepath):
+    f = open(filepath, "r")
+    try:
+        if os.path.splitext(filepath)[1].lower() in (".yaml", ".yml"):
+            if yaml is None:
+                raise Exception("PyYAML is required to read a YAML manifest")
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+    finally:
+        f.close()
+
+    if isinstance(manifest, dict):
+        manifest = manifest.get("Packets")
+    if not isinstance(manifest, list):
+        raise Exception("Manifest must contain a list of Packets")
+    return manifest
+
+
+#
+# Convert the Args of a manifest entry to a command line list
+#
+def ArgsFromEntry(entry):
+    args = entry.get("Args", [])
+    if isinstance(args, list):
+        return [str(a) for a in args]
+
+    argv = []
+    for (option, value) in args.items():
+        if value is True:
+            argv.append(option)
+        elif (value is False) or (value is None):
+            continue
+        elif isinstance(value, list):
+            argv.append(option)
+            argv.extend(str(v) for v in value)
+        else:
+            argv.extend((option, str(value)))
+    return argv
+
+
+#
+# Expand the entries that have a Targets list into one entry per target
+#
+def ExpandTargets(packets):
+    expanded = []
+    for entry in packets:
+        targets = entry.get("Targets")
+        if not targets:
+            expanded.append(entry)
+            continue
+
+        targets = [str(t) for t in targets]
+        if len(set(targets)) != len(targets):
+            raise Exception("Duplicate device target in %s" % targets)
+
+        argv = ArgsFromEntry(entry)
+        if not any("{Target}" in a for a in argv):
+            raise Exception("A packet with Targets must use {Target} in its Args to name its outputs")
+
+        for target in targets:
+            expanded.append({"Type": entry.get("Type"),
+                             "Target": target,
+                             "Args": [a.replace("{Target}", target) for a in argv]})
+    return expanded
+
+
+#
+# Setup console logging in a pool worker process
+#
+def InitWorker():
+    logger = logging.getLogger('')
+    if not logger.handlers:
+        logger.setLevel(logging.DEBUG)
+        console = logging.StreamHandler()
+        console.setLevel(logging.CRITICAL)
+        console.setFormatter(logging.Formatter("%(levelname)s - %(message)s"))
+        logger.addHandler(console)
+
+
+#
+# Build one packet.  Returns the generator's return code.
+#
+def BuildPacket(index, entry):
+    ptype = entry.get("Type")
+    if ptype not in gGenerators:
+        logging.critical("Packet %d: invalid Type %s" % (index, ptype))
+        return -2
+
+    argv = ArgsFromEntry(entry)
+    logging.critical("Packet %d: %s %s" % (index, ptype, " ".join(argv)))
+    try:
+        return gGenerators[ptype].main(argv)
+    except SystemExit as e:
+        # argparse exits on a bad command line
+        return e.code if isinstance(e.code, int) else -3
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+
+#
+#main script function
+#
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create a batch of SEM packet variables')
+
+    #Output debug log
+    parser.add_argument("-l", dest="OutputLog", help="Create an output log file: ie -l out.txt", default=None)
+    parser.add_argument("--Manifest", dest="Manifest", help="JSON (or YAML) manifest of the packets to build", required=True)
+    parser.add_argument("--ResultFile", dest="ResultFile", help="Optional JSON file of the return code of each packet", default=None)
+    parser.add_argument("--KeepGoing", action="store_true", dest="KeepGoing", help="Build the remaining packets after a failure", default=False)
+    parser.add_argument("--Jobs", dest="Jobs", type=int, help="Number of worker processes.  0 means one per cpu", default=1)
+
+    #Turn on debug level logging
+    parser.add_argument("--debug", action="store_true", dest="debug", help="turn on debug logging level for file log",  default=False)
+    options = parser.parse_args(argv)
+
+    #setup file based logging if outputReport specified
+    if(options.OutputLog):
+        if(len(options.OutputLog) < 2):
+            logging.critical("the output log file parameter is invalid")
+            return -1
+        else:
+            #setup file based logging
+            filelogger = logging.FileHandler(filename=options.OutputLog, mode='w')
+            if(options.debug):
+                filelogger.setLevel(logging.DEBUG)
+            else:
+                filelogger.setLevel(logging.INFO)
+
+            filelogger.setFormatter(logging.Formatter("%(levelname)s - %(message)s"))
+            logging.getLogger('').addHandler(filelogger)
+
+    logging.info("Log Started: " + datetime.datetime.strftime(datetime.datetime.now(), "%A, %B %d, %Y %I:%M%p" ))
+
+    if(not os.path.isfile(options.Manifest)):
+        logging.critical("Manifest file not found: " + options.Manifest)
+        return -4
+
+    packets = ExpandTargets(LoadManifest(options.Manifest))
+
+    jobs = options.Jobs if options.Jobs > 0 else os.cpu_count()
+    futures = None
+    if (jobs > 1) and (len(packets) > 1):
+        logging.critical("Building %d packets with %d workers" % (len(packets), jobs))
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=InitWorker)
+        futures = [pool.submit(BuildPacket, index, entry) for (index, entry) in enumerate(packets)]
+
+    retcode = 0
+    results = []
+    try:
+        for (index, entry) in enumerate(packets):
+            if futures is None:
+                rc = BuildPacket(index, entry)
+            elif futures[index].cancelled():
+                continue
+            else:
+                rc = futures[index].result()
+            result = {"Type": entry.get("Type"), "Args": ArgsFromEntry(entry), "ReturnCode": rc}
+            if "Target" in entry:
+                result["Target"] = entry["Target"]
+            results.append(result)
+            if rc != 0:
+                logging.critical("Packet %d Failed.  Return Code: %s" % (index, rc))
+                if retcode == 0:
+                    retcode = rc
+                if not options.KeepGoing:
+                    if futures is None:
+                        break
+                    #packets already handed to a worker can't be cancelled and are still reported
+                    for future in futures[index + 1:]:
+                        future.cancel()
+    finally:
+        if futures is not None:
+            pool.shutdown()
+
+    if(options.ResultFile):
+        f = open(options.ResultFile, "w")
+        json.dump({"Packets": results}, f, indent=2)
+        f.close()
+
+    logging.critical("Built %d of %d packets" % (sum(1 for r in results if r["ReturnCode"] == 0), len(packets)))
+    return retcode
+
+
+if __name__ == '__main__':
+    #setup main console as logger
+    logger = logging.getLogger('')
+    logger.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(levelname)s - %(message)s")
+    console = logging.StreamHandler()
+    console.setLevel(logging.CRITICAL)
+    console.setFormatter(formatter)
+    logger.addHandler(console)
+
+    #call main worker function
+    retcode = main()
+
+    if retcode != 0:
+        logging.critical("Failed.  Return Code: %i" % retcode)
+    #end logging
+    logging.shutdown()
+    sys.exit(retcode)
@@ -31,6 +31,7 @@ import datetime
 import struct
 import shutil
 import time
+import tempfile
 import random
 import hashlib
 
@@ -45,12 +46,7 @@ from DFCI_SupportLib import DFCI_SupportLib
 from Data.CertProvisioningVariable import CertProvisioningApplyVariable
 from Data.CertProvisioningVariable import CertProvisioningResultVariable
 from edk2toollib.uefi.wincert import *
-from edk2toollib.windows.locate_tools import FindToolInWinSdk
-from edk2toollib.utility_functions import DetachedSignWithSignTool
-
-#PKCS7 Signed Data OID
-gOid = "1.2.840.113549.1.7.2"
-gPath2SignTool = None
+import PacketSigner
 
 def PrintSEM(filepath):
     if(filepath and os.path.isfile(filepath)):
@@ -97,31 +93,25 @@ def PrintSEMResults(filepath):
         SEM.Print()
 
 def SignSEMProvisionData(options):
-    global gPath2SignTool
-    if gPath2SignTool == None:
-        a = DFCI_SupportLib ()
-        gPath2SignTool = a.get_signtool_path ()
+    Signer = PacketSigner.GetSigner(options.Signer)
 
     logging.critical("Signing Started")
     logging.critical(options.SigningInputFile)
     logging.critical(options.SigningOutputFile)
     logging.critical(options.SigningPfxFile)
 
-    return DetachedSignWithSignTool (gPath2SignTool, options.SigningInputFile, options.SigningOutputFile,  options.SigningPfxFile, options.SigningPfxPw, gOid)
+    return Signer.Sign(options.SigningInputFile, options.SigningOutputFile, options.SigningPfxFile, options.SigningPfxPw)
 
 def TestSignSemTrustedCert(options):
-    global gPath2SignTool
-    if gPath2SignTool == None:
-        a = DFCI_SupportLib ()
-        gPath2SignTool = a.get_signtool_path ()
+    Signer = PacketSigner.GetSigner(options.Signer)
 
     logging.critical("Signing Started")
-    logging.critical(gPath2SignTool)
+    logging.critical(type(Signer).__name__)
     logging.critical(options.CertFilePath)
     logging.critical(options.Signing2AOutputFile)
     logging.critical(options.Signing2APfxFile)
 
-    return DetachedSignWithSignTool (gPath2SignTool, options.CertFilePath, options.Signing2AOutputFile,  options.Signing2APfxFile, options.Signing2APfxPw, gOid)
+    return Signer.Sign(options.CertFilePath, options.Signing2AOutputFile, options.Signing2APfxFile, options.Signing2APfxPw)
 
 def is_32bit_number(s):
     try:
@@ -137,7 +127,7 @@ def is_32bit_number(s):
 #
 #main script function
 #
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Create SEM Provisioning Cert')
 
     #Output debug log
@@ -147,6 +137,7 @@ def main():
     parser.add_argument("-pc", dest="PrintCurrentFile", help="Print Current File as {basename}_Current.xml", default= None)
     parser.add_argument("-xc", dest="ExtractCertFile", help="Extract the certificate to {basename}_{certtype}.cer", default=None)
     parser.add_argument("--dirty", action="store_true", dest="dirty", help="Leave around the temp files after finished", default=False)
+    parser.add_argument("--Signer", dest="Signer", help="Detached signer: signtool, pkcs7 (in process) or auto (signtool on Windows, else pkcs7)", choices=PacketSigner.SIGNER_NAMES, default="auto")
 
     Step1Group = parser.add_argument_group(title="Step1", description="Signed Data Prep.  Build data structure.")
     Step1Group.add_argument("--Step1Enable", dest="Step1Enable", help="Do Step 1 - Signed Data Prep", default=False, action="store_true")
@@ -192,9 +183,10 @@ def main():
 
     #Turn on debug level logging
     parser.add_argument("--debug", action="store_true", dest="debug", help="turn on debug logging level for file log",  default=False)
-    options = parser.parse_args()
+    options = parser.parse_args(argv)
 
     #setup file based logging if outputReport specified
+    filelogger = None
     if(options.OutputLog):
         if(len(options.OutputLog) < 2):
             logging.critical("the output log file parameter is invalid")
@@ -207,9 +199,22 @@ def main():
             else:
                 filelogger.setLevel(logging.INFO)
 
-            filelogger.setFormatter(formatter)
+            filelogger.setFormatter(logging.Formatter("%(levelname)s - %(message)s"))
             logging.getLogger('').addHandler(filelogger)
 
+    #remove the file logger when done so main() can be called again in the same process
+    try:
+        return RunSteps(options)
+    finally:
+        if(filelogger is not None):
+            logging.getLogger('').removeHandler(filelogger)
+            filelogger.close()
+
+
+#
+#run the steps requested by the parsed command line options
+#
+def RunSteps(options):
     logging.info("Log Started: " + datetime.datetime.strftime(datetime.datetime.now(), "%A, %B %d, %Y %I:%M%p" ))
 
     #Step 1 Prep
@@ -325,9 +330,9 @@ def main():
         else:
             logging.debug("Step3 Result will be written to: " + options.FinalizeResultFile)
 
-    tempdir = "_temp_" + str(time.time())
-    logging.critical("Temp directory is: " + os.path.join(os.getcwd(), tempdir))
-    os.makedirs(tempdir)
+    # unique even when several packets are built in the same second (see GenerateBatchPackets.py)
+    tempdir = tempfile.mkdtemp(prefix="_temp_" + str(int(time.time())) + "_", dir=os.getcwd())
+    logging.critical("Temp directory is: " + tempdir)
 
     #STEP 1 - Prep Var
     if(options.Step1Enable):
@@ -31,6 +31,7 @@ import datetime
 import struct
 import shutil
 import time
+import tempfile
 import random
 
 #get script path
@@ -42,16 +43,11 @@ sys.path.append(sp)
 from DFCI_SupportLib import DFCI_SupportLib
 
 from edk2toollib.uefi.wincert import *
-from edk2toollib.utility_functions import DetachedSignWithSignTool
-from edk2toollib.windows.locate_tools import FindToolInWinSdk
+import PacketSigner
 from Data.PermissionPacketVariable import PermissionApplyVariable
 from Data.PermissionPacketVariable import PermissionResultVariable
 
 
-#PKCS7 Signed Data OID
-gOid = "1.2.840.113549.1.7.2"
-gPath2SignTool = None
-
 
 def PrintSEM(filepath):
     if(filepath and os.path.isfile(filepath)):
@@ -78,17 +74,13 @@ def PrintSEMCurrent(filepath):
         a.extract_payload_from_current(filepath, outfilename)
 
 def SignSEMData(options):
-    global gPath2SignTool
-    if gPath2SignTool == None:
-        a = DFCI_SupportLib ()
-        gPath2SignTool = a.get_signtool_path ()
-
-    return DetachedSignWithSignTool (gPath2SignTool, options.SigningInputFile, options.SigningOutputFile,  options.SigningPfxFile, options.SigningPfxPw, gOid)
+    Signer = PacketSigner.GetSigner(options.Signer)
+    return Signer.Sign(options.SigningInputFile, options.SigningOutputFile, options.SigningPfxFile, options.SigningPfxPw)
 
 #
 #main script function
 #
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Create SEM Permission Packet Variable')
 
     #Output debug log
@@ -97,6 +89,7 @@ def main():
     parser.add_argument("-pr", dest="PrintResultsFile", help="Print Result File as Permission Blob", default= None)
     parser.add_argument("-pc", dest="PrintCurrentFile", help="Print Current File to {basename}_Current.xml", default= None)
     parser.add_argument("--dirty", action="store_true", dest="dirty", help="Leave around the temp files after finished", default=False)
+    parser.add_argument("--Signer", dest="Signer", help="Detached signer: signtool, pkcs7 (in process) or auto (signtool on Windows, else pkcs7)", choices=PacketSigner.SIGNER_NAMES, default="auto")
 
     Step1Group = parser.add_argument_group(title="Step1", description="Signed Data Prep.  Build data structure.")
     Step1Group.add_argument("--Step1Enable", dest="Step1Enable", help="Do Step 1 - Signed Data Prep", default=False, action="store_true")
@@ -124,9 +117,10 @@ def main():
 
     #Turn on debug level logging
     parser.add_argument("--debug", action="store_true", dest="debug", help="turn on debug logging level for file log",  default=False)
-    options = parser.parse_args()
+    options = parser.parse_args(argv)
 
     #setup file based logging if outputReport specified
+    filelogger = None
     if(options.OutputLog):
         if(len(options.OutputLog) < 2):
             logging.critical("the output log file parameter is invalid")
@@ -139,9 +133,22 @@ def main():
             else:
                 filelogger.setLevel(logging.INFO)
 
-            filelogger.setFormatter(formatter)
+            filelogger.setFormatter(logging.Formatter("%(levelname)s - %(message)s"))
             logging.getLogger('').addHandler(filelogger)
 
+    #remove the file logger when done so main() can be called again in the same process
+    try:
+        return RunSteps(options)
+    finally:
+        if(filelogger is not None):
+            logging.getLogger('').removeHandler(filelogger)
+            filelogger.close()
+
+
+#
+#run the steps requested by the parsed command line options
+#
+def RunSteps(options):
     logging.info("Log Started: " + datetime.datetime.strftime(datetime.datetime.now(), "%A, %B %d, %Y %I:%M%p" ))
 
     #Step 1 Prep
@@ -211,9 +218,9 @@ def main():
             logging.debug("Step3 Result will be written to: " + options.FinalizeResultFile)
 
 
-    tempdir = "_temp_" + str(time.time())
-    logging.critical("Temp directory is: " + os.path.join(os.getcwd(), tempdir))
-    os.makedirs(tempdir)
+    # unique even when several packets are built in the same second (see GenerateBatchPackets.py)
+    tempdir = tempfile.mkdtemp(prefix="_temp_" + str(int(time.time())) + "_", dir=os.getcwd())
+    logging.critical("Temp directory is: " + tempdir)
 
     #STEP 1 - Prep Var
     if(options.Step1Enable):
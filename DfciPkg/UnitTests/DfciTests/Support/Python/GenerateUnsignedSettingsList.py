@@ -5,13 +5,147 @@
 #
 #
 import argparse
+import bz2
+import collections
 import datetime
+import gzip
+import io
 import logging
+import lzma
+import mmap
+import os
 import sys
 import xml.etree.cElementTree as ET
 import xml.dom.minidom
 import re
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+START_MARKER = b"START PRINTING ALL REGISTERED SETTING PROVIDERS"
+END_MARKER = b"END PRINTING ALL REGISTERED SETTING PROVIDERS"
+
+# "Id:" as a whitespace separated word, and the word after it
+ID_PATTERN = re.compile(rb"(?<!\S)Id:\s+(\S+)")
+
+# Size of each read from a log that is not memory mapped
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+#
+# Open a UEFI log for reading lines as bytes.  .gz, .zst, .xz and .bz2 logs are decompressed
+# as they are read.  A plain log is memory mapped if UseMmap, so markers are found with
+# mmap.find instead of reading every line.
+#
+def OpenUefiLog(FileName, UseMmap=False):
+    ext = os.path.splitext(FileName)[1].lower()
+    if ext == ".gz":
+        return gzip.open(FileName, "rb")
+    if ext == ".zst":
+        if zstandard is None:
+            raise Exception("The zstandard package is required to read a .zst log")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(FileName, "rb"),
+                                                                            read_across_frames=True,
+                                                                            closefd=True))
+    if ext == ".xz":
+        return lzma.open(FileName, "rb")
+    if ext == ".bz2":
+        return bz2.open(FileName, "rb")
+
+    UefiLog = open(FileName, "rb")
+    if UseMmap and os.fstat(UefiLog.fileno()).st_size > 0:
+        try:
+            return mmap.mmap(UefiLog.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            UefiLog.close()
+    return UefiLog
+
+
+#
+# Generate (Ids, Complete) for every setting provider list in the log, one per boot cycle.
+# Complete is False for a list without an end marker, ie the log ends or the system reset
+# while it was printed.
+#
+# The log is searched for the start marker a block at a time (a memory mapped log is one
+# block), and only the lines of the lists are split.  At most one block and one line are
+# held in memory.
+#
+def IterSettingProviderLists(UefiLog):
+    if isinstance(UefiLog, mmap.mmap):
+        (Buf, Eof) = (UefiLog, True)
+    else:
+        (Buf, Eof) = (b"", False)
+    Pos = 0
+    Ids = None
+
+    while True:
+        if Ids is None:
+            Found = Buf.find(START_MARKER, Pos)
+            End = Buf.find(b"\n", Found) if Found != -1 else -1
+            if (End != -1) or ((Found != -1) and Eof):
+                Ids = []
+                Pos = End + 1 if End != -1 else len(Buf)
+                continue
+            if Eof:
+                return
+            if Found == -1:
+                # Keep enough to match a marker split between blocks
+                Pos = max(Pos, len(Buf) - len(START_MARKER))
+        else:
+            End = Buf.find(b"\n", Pos)
+            if (End != -1) or Eof:
+                line = Buf[Pos:] if End == -1 else Buf[Pos:End + 1]
+                Pos = len(Buf) if End == -1 else End + 1
+                if END_MARKER in line:
+                    yield (Ids, True)
+                    Ids = None
+                elif START_MARKER in line:
+                    yield (Ids, False)
+                    Ids = []
+                elif b"Id:" in line:
+                    Ids.extend(Id.decode("utf-8", errors="replace") for Id in ID_PATTERN.findall(line))
+                if (End == -1) and (Ids is not None):
+                    yield (Ids, False)
+                    return
+                continue
+
+        Block = UefiLog.read(READ_BLOCK_SIZE)
+        Buf = Buf[Pos:] + Block
+        Pos = 0
+        Eof = not Block
+
+
+#
+# Select the provider list of boot cycle Boot: 1 is the first, -1 the last.  0 merges every
+# complete list.  Reads the log only up to the end of the selected list when Boot > 0.
+# Returns (Ids, Complete), or None when the log does not have that list.
+#
+def SelectSettingProviderList(Lists, Boot):
+    if Boot > 0:
+        for (Number, List) in enumerate(Lists, 1):
+            if Number == Boot:
+                return List
+        return None
+
+    if Boot < 0:
+        Last = collections.deque(Lists, maxlen=-Boot)
+        return Last[0] if len(Last) == -Boot else None
+
+    Merged = []
+    Seen = set()
+    Found = False
+    for (Ids, Complete) in Lists:
+        if not Complete:
+            continue
+        Found = True
+        for Id in Ids:
+            if Id not in Seen:
+                Seen.add(Id)
+                Merged.append(Id)
+    return (Merged, True) if Found else None
+
 
 def main():
 
@@ -44,6 +178,19 @@ def main():
                         default="UnsignedPermissions.xml",
                         help="Generated unsigned permissions file")
 
+    parser.add_argument("--Boot",
+                        dest="Boot",
+                        type=int,
+                        default=1,
+                        help="Settings provider list to use when the log has several boot cycles: " +
+                             "1 is the first, -1 the last, 0 merges all of them")
+
+    parser.add_argument("--Mmap",
+                        dest="UseMmap",
+                        action="store_true",
+                        default=False,
+                        help="Memory map an uncompressed log instead of reading it")
+
     options = parser.parse_args()
 
     # setup file based logging if OutputLog specified
@@ -101,44 +248,34 @@ def main():
         return 0
 
     try:
-        with open(options.InputFileName, "r") as UefiLog:
-            Lines = UefiLog.readlines()
+        UefiLog = OpenUefiLog(options.InputFileName, options.UseMmap)
     except FileNotFoundError:
         print(f"File {options.InputFileName} not found.")
         return 0
 
+    with UefiLog:
+        Lists = IterSettingProviderLists(UefiLog)
+        Selected = SelectSettingProviderList(Lists, options.Boot)
+        Lists.close()
+
+    if Selected is None:
+        print("Cannot find start of the settings providers list")
+        return 1
+
+    (Ids, Complete) = Selected
+    if not Complete:
+        print("Cannot find end of the settings providers list")
+        return 1
+
+    for Id in Ids:
+        Permission = ET.SubElement(Permissions, 'Permission')
+        ET.SubElement(Permission, 'Id').text = Id
+        ET.SubElement(Permission, 'PMask').text = '3'  # It it were to be used, 3 == Local User + Unsigned user
+        ET.SubElement(Permission, 'DMask').text = '0'
+
     xmlFile = None
     try:
         xmlFile = open(options.OutputFileName, "w")
-        lineIterator = iter([i for i in Lines])
-        Search = "START PRINTING ALL REGISTERED SETTING PROVIDERS"
-        while True:
-            try:
-                line = next(lineIterator)  # Load the next element
-                if line.__contains__(Search):
-                    break
-
-            except StopIteration:
-                print("Cannot find start of the settings providers list")
-
-        Search = "END PRINTING ALL REGISTERED SETTING PROVIDERS"
-        while True:
-            try:
-                line = next(lineIterator)  # Load the next element
-                if line.__contains__(Search):
-                    break
-
-                x = re.sub(' +', ' ', line).split()
-                for Idx in range(len(x)):
-                    if x[Idx] == "Id:":
-                        Permission = ET.SubElement(Permissions, 'Permission')
-                        ET.SubElement(Permission, 'Id').text = x[Idx+1]
-                        ET.SubElement(Permission, 'PMask').text = '3'  # It it were to be used, 3 == Local User + Unsigned user
-                        ET.SubElement(Permission, 'DMask').text = '0'
-
-            except StopIteration:
-                print("Cannot find end of the settings providers list")
-                raise
 
         dom = xml.dom.minidom.parseString(ET.tostring(UnsignedPermissionsPacket))
         part1, part2 = dom.toprettyxml().split("?>")
@@ -0,0 +1,228 @@
+# @file
+#
+# Script to support detached PKCS7 signing of the SEM packets
+#
+# Copyright (c), Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+
+##
+## Detached signers for the packet generators.
+##
+## Step2 of every generator makes a detached PKCS7 signature of the Step1 data with a PFX
+## file.  The signer that does this is selected by name:
+##
+##   signtool - signtool.exe through edk2toollib DetachedSignWithSignTool (Windows only)
+##   pkcs7    - in process signing with the cryptography package.  PFX files are loaded
+##              once and the keys are cached for the life of the process.
+##   auto     - signtool on Windows, pkcs7 everywhere else
+##
+## Both produce a DER PKCS7 SignedData ContentInfo with a SHA256 digest and no embedded
+## content, which is what WinCertUefiGuid.AddCertData() expects.  signtool is run with
+## /p7co 1.2.840.113549.1.7.2, which sets the eContentType and the signed content-type
+## attribute to the signedData OID.  The cryptography PKCS7 builder always uses id-data
+## for both, so the pkcs7 signer encodes the SignedData itself with the same OID and signs
+## the attributes with the cached key.
+##
+
+import os
+import logging
+
+from edk2toollib.utility_functions import DetachedSignWithSignTool
+
+try:
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives.asymmetric import padding
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.serialization import Encoding
+    from cryptography.hazmat.primitives.serialization import pkcs12
+except ImportError:
+    pkcs12 = None
+
+#PKCS7 Signed Data OID
+gOid = "1.2.840.113549.1.7.2"
+
+OID_SHA256 = "2.16.840.1.101.3.4.2.1"
+OID_RSA_ENCRYPTION = "1.2.840.113549.1.1.1"
+OID_ECDSA_WITH_SHA256 = "1.2.840.10045.4.3.2"
+OID_CONTENT_TYPE = "1.2.840.113549.1.9.3"
+OID_MESSAGE_DIGEST = "1.2.840.113549.1.9.4"
+
+SIGNER_NAMES = ["auto", "signtool", "pkcs7"]
+
+
+##
+## Detached signer interface
+##
+class DetachedSigner(object):
+
+    #
+    # Sign InputFile with the key in PfxFile and write the detached signature to OutputFile.
+    # Returns 0 on success, like DetachedSignWithSignTool.
+    #
+    def Sign(self, InputFile, OutputFile, PfxFile, PfxPw=None):
+        raise NotImplementedError()
+
+
+##
+## signtool.exe signer
+##
+class SignToolSigner(DetachedSigner):
+
+    def __init__(self, Oid=gOid):
+        self.Oid = Oid
+        self._SignToolPath = None
+
+    def Sign(self, InputFile, OutputFile, PfxFile, PfxPw=None):
+        if self._SignToolPath is None:
+            from DFCI_SupportLib import DFCI_SupportLib
+            self._SignToolPath = DFCI_SupportLib().get_signtool_path()
+
+        return DetachedSignWithSignTool(self._SignToolPath, InputFile, OutputFile, PfxFile, PfxPw, self.Oid)
+
+
+#
+# Minimal DER encoding for the PKCS7 SignedData built by Pkcs7Signer
+#
+def DerEncode(Tag, Content):
+    length = len(Content)
+    if length < 0x80:
+        return bytes([Tag, length]) + Content
+    size = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes([Tag, 0x80 | len(size)]) + size + Content
+
+def DerSequence(*Items):
+    return DerEncode(0x30, b''.join(Items))
+
+def DerSet(*Items):
+    # DER SET OF is sorted by encoding
+    return DerEncode(0x31, b''.join(sorted(Items)))
+
+def DerInteger(Value):
+    return DerEncode(0x02, Value.to_bytes(Value.bit_length() // 8 + 1, 'big', signed=True))
+
+def DerOctetString(Value):
+    return DerEncode(0x04, bytes(Value))
+
+def DerOid(Oid):
+    arcs = [int(a) for a in Oid.split('.')]
+    body = bytearray()
+    for arc in [arcs[0] * 40 + arcs[1]] + arcs[2:]:
+        chunk = [arc & 0x7F]
+        arc >>= 7
+        while arc:
+            chunk.insert(0, 0x80 | (arc & 0x7F))
+            arc >>= 7
+        body.extend(chunk)
+    return DerEncode(0x06, bytes(body))
+
+def DerAlgorithm(Oid, NullParameters=True):
+    if NullParameters:
+        return DerSequence(DerOid(Oid), b'\x05\x00')
+    return DerSequence(DerOid(Oid))
+
+
+##
+## In process signer using the cryptography package
+##
+class Pkcs7Signer(DetachedSigner):
+
+    def __init__(self, Oid=gOid):
+        if pkcs12 is None:
+            raise Exception("The pkcs7 signer requires the cryptography package.  pip install cryptography")
+        self.Oid = Oid
+        self._Keys = {}  # (realpath, mtime, password) -> (key, cert, additional certs)
+
+    #
+    # Return (key, cert, additional certs) from PfxFile, loading it only the first time
+    #
+    def LoadPfx(self, PfxFile, PfxPw=None):
+        path = os.path.realpath(PfxFile)
+        cachekey = (path, os.stat(path).st_mtime_ns, PfxPw)
+        entry = self._Keys.get(cachekey)
+        if entry is None:
+            f = open(path, "rb")
+            data = f.read()
+            f.close()
+            password = PfxPw.encode('utf-8') if PfxPw else None
+            (key, cert, extra) = pkcs12.load_key_and_certificates(data, password)
+            if (key is None) or (cert is None):
+                raise Exception("PFX file %s does not contain a key and certificate" % PfxFile)
+            entry = (key, cert, extra or [])
+            self._Keys[cachekey] = entry
+            logging.debug("Loaded signing key from " + PfxFile)
+        return entry
+
+    #
+    # Return the DER detached PKCS7 signature of the bytes in Data.  The content type and
+    # message digest are signed attributes, as signtool writes them.
+    #
+    def SignBuffer(self, Data, PfxFile, PfxPw=None):
+        (key, cert, extra) = self.LoadPfx(PfxFile, PfxPw)
+
+        digest = hashes.Hash(hashes.SHA256())
+        digest.update(bytes(Data))
+        attributes = [DerSequence(DerOid(OID_CONTENT_TYPE), DerSet(DerOid(self.Oid))),
+                      DerSequence(DerOid(OID_MESSAGE_DIGEST), DerSet(DerOctetString(digest.finalize())))]
+        # The signature covers the attributes encoded as a SET, sent as [0] IMPLICIT
+        signedattributes = DerSet(*attributes)
+
+        if isinstance(key, rsa.RSAPrivateKey):
+            signature = key.sign(signedattributes, padding.PKCS1v15(), hashes.SHA256())
+            signaturealgorithm = DerAlgorithm(OID_RSA_ENCRYPTION)
+        elif isinstance(key, ec.EllipticCurvePrivateKey):
+            signature = key.sign(signedattributes, ec.ECDSA(hashes.SHA256()))
+            signaturealgorithm = DerAlgorithm(OID_ECDSA_WITH_SHA256, False)
+        else:
+            raise Exception("Unsupported signing key type %s in %s" % (type(key).__name__, PfxFile))
+
+        signerinfo = DerSequence(DerInteger(1),
+                                 DerSequence(cert.issuer.public_bytes(), DerInteger(cert.serial_number)),
+                                 DerAlgorithm(OID_SHA256),
+                                 b'\xa0' + signedattributes[1:],
+                                 signaturealgorithm,
+                                 DerOctetString(signature))
+
+        certificates = b''.join(c.public_bytes(Encoding.DER) for c in [cert] + list(extra))
+        signeddata = DerSequence(DerInteger(1),
+                                 DerSet(DerAlgorithm(OID_SHA256)),
+                                 DerSequence(DerOid(self.Oid)),
+                                 DerEncode(0xA0, certificates),
+                                 DerSet(signerinfo))
+
+        return DerSequence(DerOid(gOid), DerEncode(0xA0, signeddata))
+
+    def Sign(self, InputFile, OutputFile, PfxFile, PfxPw=None):
+        try:
+            f = open(InputFile, "rb")
+            data = f.read()
+            f.close()
+            signature = self.SignBuffer(data, PfxFile, PfxPw)
+        except Exception as e:
+            logging.critical("Pkcs7Signer failed to sign %s: %s" % (InputFile, e))
+            return -1
+
+        f = open(OutputFile, "wb")
+        f.write(signature)
+        f.close()
+        return 0
+
+
+_Signers = {}
+
+#
+# Return the signer for Name (one of SIGNER_NAMES).  Signers are shared for the life of the
+# process so keys and tool paths are only looked up once.
+#
+def GetSigner(Name="auto"):
+    if (Name is None) or (Name == "auto"):
+        Name = "signtool" if os.name == 'nt' else "pkcs7"
+
+    if Name not in _Signers:
+        if Name == "signtool":
+            _Signers[Name] = SignToolSigner()
+        elif Name == "pkcs7":
+            _Signers[Name] = Pkcs7Signer()
+        else:
+            raise Exception("Unknown signer %s" % Name)
+    return _Signers[Name]
@@ -12,29 +12,183 @@ import glob
 import json
 import subprocess
 import logging
+import socket
 import socketserver
 import sys
 import threading
 import time
 import traceback
-import win32api
-import win32con
-import win32security
-import winnt
+import uuid
+
+if os.name == 'nt':
+    import win32api
+    import win32con
+    import win32security
+    import winnt
 
 from Lib.UefiVariablesSupportLib import UefiVariable
+from Lib.DutTransportLib import FramedServer
 
 # update this whenever you make a change
-RobotRemoteChangeDate = "2023-04-15 09:00"
-RobotRemoteVersion = 1.08
+RobotRemoteChangeDate = "2026-10-18 16:00"
+RobotRemoteVersion = 1.11
 
 HOST = '0.0.0.0'
 ROBOT_PORT1 = 8270
 ROBOT_PORT2 = 8271
-STAGED_ACTIONS_FILE = 'staged_actions.json'
-
-_ExitFlag = False
+ROBOT_PORT3 = 8272   # Framed transport (DutTransportLib)
+STATUS_WAIT_TIMEOUT = 10   # Seconds to wait for the host to read a status on ROBOT_PORT2
+
+# Host listener to notify when PyRobotRemote is online after a boot (remote_register_online_listener)
+ONLINE_LISTENER_FILE = 'online_listener.json'
+ONLINE_NOTIFY_TIMEOUT = 120   # Seconds to keep trying to reach the host listener
+
+# Reboot commands.  On Linux DUTs the variables are accessed through efivarfs.
+if os.name == 'nt':
+    REBOOT_COMMAND = "shutdown -r -t 1"
+    REBOOT_TO_FIRMWARE_COMMAND = "shutdown -r -fw -t 0"
+else:
+    REBOOT_COMMAND = "systemctl reboot"
+    REBOOT_TO_FIRMWARE_COMMAND = "systemctl reboot --firmware-setup"
+STAGED_ACTIONS_FILE = 'staged_actions.json'          # Before 1.10, migrated to the journal
+STAGED_ACTIONS_JOURNAL = 'staged_actions.jsonl'
+STAGED_ACTIONS_SYNC_COUNT = 32   # Queued actions written between fsyncs of the journal
+
+_StatusSent = threading.Event()
 _PyRobotResponse = 'No Status'
+_BootId = None
+_UefiVar = None
+_StagedActions = None
+
+
+#
+# Creating a UefiVariable adjusts the process token privileges and binds the kernel32
+# functions, so one instance is shared by every keyword.
+#
+def _get_uefi_var():
+    global _UefiVar
+
+    if _UefiVar is None:
+        _UefiVar = UefiVariable()
+    return _UefiVar
+
+
+#
+# Append only journal of the staged actions, one JSON object per line:
+#
+#   {"action": [cmd, arg1, arg2, arg3, arg4]}   - an action queued by write_staged_action
+#   {"done": n}                                 - the first n actions have been processed
+#
+# Queueing an action appends one line; the journal is fsynced every STAGED_ACTIONS_SYNC_COUNT
+# actions, on ResetSystem and before a reboot.  Each processed action appends a done record
+# and is fsynced before the next action runs, so after a crash or reboot processing resumes
+# after the last completed action.  A torn last line (power lost in the middle of a write)
+# is ignored.
+#
+class StagedActionsJournal(object):
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._unsynced = 0
+
+    def _write(self, record, sync):
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        self._file.write(json.dumps(record).encode('utf-8') + b'\n')
+        self._unsynced += 1
+        if sync or self._unsynced >= STAGED_ACTIONS_SYNC_COUNT:
+            self._sync()
+
+    def _sync(self):
+        if self._file is not None and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def _close(self):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+            self._file = None
+
+    def append(self, actions, sync=False):
+        with self._lock:
+            for action in actions:
+                self._write({'action': list(action)}, sync=False)
+            if sync:
+                self._sync()
+
+    def mark_done(self, count):
+        with self._lock:
+            self._write({'done': count}, sync=True)
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def clear(self):
+        with self._lock:
+            self._close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    #
+    # Return (actions, done): the list of queued actions and how many were processed
+    #
+    def load(self):
+        with self._lock:
+            self._close()
+            actions = []
+            done = 0
+            with open(self.path, 'rb') as fp:
+                lines = fp.read().split(b'\n')
+
+            offset = 0
+            for (index, line) in enumerate(lines):
+                if not line.strip():
+                    offset += len(line) + 1
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    if index == len(lines) - 1:
+                        # Drop it so the next record is not appended to it
+                        print(f"Ignoring incomplete last record in {self.path}")
+                        os.truncate(self.path, offset)
+                        break
+                    raise Exception(f"Invalid record {index + 1} in {self.path}")
+                offset += len(line) + 1
+
+                if 'action' in record:
+                    actions.append(record['action'])
+                elif 'done' in record:
+                    done = max(done, int(record['done']))
+            return (actions, done)
+
+
+def _get_staged_actions():
+    global _StagedActions
+
+    if _StagedActions is None:
+        _StagedActions = StagedActionsJournal(os.path.join(os.getcwd(), STAGED_ACTIONS_JOURNAL))
+
+        # Carry over the actions of a staged_actions.json left by an older version
+        staged_actions_file = os.path.join(os.getcwd(), STAGED_ACTIONS_FILE)
+        if os.path.exists(staged_actions_file):
+            try:
+                with open(staged_actions_file, 'r') as fp:
+                    staged_actions = json.load(fp)
+                if isinstance(staged_actions, list):
+                    _StagedActions.append(staged_actions, sync=True)
+            except ValueError:
+                print(f"Ignoring invalid {staged_actions_file}")
+            os.remove(staged_actions_file)
+    return _StagedActions
 
 
 class UefiRemoteTesting(object):
@@ -61,7 +215,7 @@ class UefiRemoteTesting(object):
     # confuse Python, so get rid of the NULL when it is expected
     #
     def GetUefiVariable(self, name, guid, trim):
-        uefi_var = UefiVariable()
+        uefi_var = _get_uefi_var()
         logging.info("Calling GetUefiVar(name='%s', GUID='%s')" % (name, "{%s}" % guid))
         (rc, var, errorstring) = uefi_var.GetUefiVar(name, guid)
         var2 = var
@@ -72,10 +226,39 @@ class UefiRemoteTesting(object):
         return (rc, var2, errorstring)
 
     def SetUefiVariable(self, name, guid, attrs=None, contents=None):
-        uefi_var = UefiVariable()
+        uefi_var = _get_uefi_var()
         (rc, err, errorstring) = uefi_var.SetUefiVar(name, guid, contents, attrs)
         return rc
 
+    #
+    # Run a list of variable operations in one call, in order:
+    #
+    #   ['Set', name, guid, attrs, contents]  - result is the SetUefiVariable return code
+    #   ['Get', name, guid, trim]             - result is (rc, contents, errorstring), as GetUefiVariable
+    #
+    # Returns the list of results.  A whole SEM exchange (ie set DfciSettingsRequest, or get
+    # DfciSettingsResult and DfciSettingsCurrent) is then one remote call.
+    #
+    def UefiVariableBatch(self, operations):
+        results = []
+        for operation in operations:
+            if operation[0] == 'Set':
+                (name, guid, attrs, contents) = (list(operation[1:]) + [None, None])[:4]
+                results.append(self.SetUefiVariable(name, guid, attrs, contents))
+            elif operation[0] == 'Get':
+                (name, guid, trim) = (list(operation[1:]) + [None])[:3]
+                (rc, var, errorstring) = self.GetUefiVariable(name, guid, trim)
+                results.append((rc, var, str(errorstring) if errorstring is not None else None))
+            else:
+                raise Exception(f'Invalid variable operation {operation[0]}')
+        return results
+
+    def SetUefiVariables(self, variables):
+        return self.UefiVariableBatch([['Set'] + list(v) for v in variables])
+
+    def GetUefiVariables(self, variables):
+        return self.UefiVariableBatch([['Get'] + list(v) for v in variables])
+
     def ReadStagedFile(self, staged_file_name):
         try:
             staged_file_name = os.path.join(os.getcwd(), staged_file_name)
@@ -95,45 +278,52 @@ class UefiRemoteTesting(object):
             return ('0', str(e))
 
     def write_staged_action(self, cmd, arg1=None, arg2=None, arg3=None, arg4=None):
-        staged_actions = []
-        staged_actions_file = os.path.join(os.getcwd(), STAGED_ACTIONS_FILE)
-
-        if cmd == "ClearStagedFiles":
-            if os.path.exists(staged_actions_file):
-                try:
-                    os.remove(staged_actions_file)
-                    print(f"Deleted {staged_actions_file}")
-                except OSError:
-                    print(f"Unable to remove {staged_actions_file}")
-
-            bin_files = os.path.join(os.getcwd(), "*.bin")
-            for file in glob.glob(bin_files):
-                try:
-                    os.remove(file)
-                    print(f"Deleted {file}")
-                except OSError:
-                    print(f"Unable to remove {file}")
-
-            xml_files = os.path.join(os.getcwd(), "*.xml")
-            for file in glob.glob(xml_files):
-                try:
-                    os.remove(file)
-                    print(f"Deleted {file}")
-                except OSError:
-                    print(f"Unable to remove {file}")
-            return
-
-        if os.path.exists(staged_actions_file):
-            with open(staged_actions_file, 'r') as fp:
-                staged_actions = json.load(fp)
+        self.write_staged_actions([[cmd, arg1, arg2, arg3, arg4]])
 
-            if type(staged_actions) is not list:
-                os.remove(staged_actions_file)
-
-        staged_actions.append([cmd, arg1, arg2, arg3, arg4])
-        with open(staged_actions_file, 'w') as fp:
-            json.dump(staged_actions, fp)
-            fp.truncate()
+    #
+    # Queue a list of [cmd, arg1, arg2, arg3, arg4] actions with one journal write
+    #
+    def write_staged_actions(self, actions):
+        staged_actions = _get_staged_actions()
+
+        queued = []
+        for action in actions:
+            action = (list(action) + [None] * 5)[:5]
+            if action[0] == "ClearStagedFiles":
+                if queued:
+                    staged_actions.append(queued)
+                    queued = []
+                self._clear_staged_files(staged_actions)
+            else:
+                queued.append(action)
+
+        if queued:
+            # Sync now if the DUT is about to be reset
+            staged_actions.append(queued, sync=any(a[0] == 'ResetSystem' for a in queued))
+
+    def _clear_staged_files(self, staged_actions):
+        if staged_actions.exists():
+            try:
+                staged_actions.clear()
+                print(f"Deleted {staged_actions.path}")
+            except OSError:
+                print(f"Unable to remove {staged_actions.path}")
+
+        bin_files = os.path.join(os.getcwd(), "*.bin")
+        for file in glob.glob(bin_files):
+            try:
+                os.remove(file)
+                print(f"Deleted {file}")
+            except OSError:
+                print(f"Unable to remove {file}")
+
+        xml_files = os.path.join(os.getcwd(), "*.xml")
+        for file in glob.glob(xml_files):
+            try:
+                os.remove(file)
+                print(f"Deleted {file}")
+            except OSError:
+                print(f"Unable to remove {file}")
 
     def remote_ack(self):
         return True
@@ -144,22 +334,39 @@ class UefiRemoteTesting(object):
     def remote_get_version(self):
         return RobotRemoteVersion
 
+    def remote_get_boot_id(self):
+        return _get_boot_id()
+
+    #
+    # After every boot, once the remote servers are listening, PyRobotRemote sends an online
+    # notification with the boot id to host:port (see DutTransportLib OnlineListener).
+    #
+    def remote_register_online_listener(self, host, port):
+        online_listener_file = os.path.join(os.getcwd(), ONLINE_LISTENER_FILE)
+        with open(online_listener_file, 'w') as fp:
+            json.dump({'host': host, 'port': int(port)}, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        return True
+
     def remote_warm_reboot(self):
         self.reboot_complete = False
-        os.system("shutdown -r -t 1")
+        _get_staged_actions().sync()
+        os.system(REBOOT_COMMAND)
 
     def remote_reboot_to_firmware(self):
-        token_handle = win32security.OpenProcessToken(win32api.GetCurrentProcess(),
-                                                      win32con.TOKEN_ADJUST_PRIVILEGES | win32con.TOKEN_QUERY)
-        new_privilege = [(win32security.LookupPrivilegeValue(None, winnt.SE_SHUTDOWN_NAME),
-                          winnt.SE_PRIVILEGE_ENABLED)]
-        win32security.AdjustTokenPrivileges(token_handle, False, new_privilege)
-        os.system("shutdown -r -fw -t 0")
+        if os.name == 'nt':
+            token_handle = win32security.OpenProcessToken(win32api.GetCurrentProcess(),
+                                                          win32con.TOKEN_ADJUST_PRIVILEGES | win32con.TOKEN_QUERY)
+            new_privilege = [(win32security.LookupPrivilegeValue(None, winnt.SE_SHUTDOWN_NAME),
+                              winnt.SE_PRIVILEGE_ENABLED)]
+            win32security.AdjustTokenPrivileges(token_handle, False, new_privilege)
+        _get_staged_actions().sync()
+        os.system(REBOOT_TO_FIRMWARE_COMMAND)
 
 
 class RobotHandleTcpServer(socketserver.BaseRequestHandler):
     def handle(self):
-        global _ExitFlag
         global _PyRobotResponse
 
         #
@@ -171,39 +378,89 @@ class RobotHandleTcpServer(socketserver.BaseRequestHandler):
         print(f'Message from: {addr[0]}:{addr[1]} : {data}, response = {_PyRobotResponse}')
 
         self.request.sendall(_PyRobotResponse.encode())
-        _ExitFlag = True
+        _StatusSent.set()
+
+
+class StatusTcpServer(socketserver.TCPServer):
+    allow_reuse_address = True
 
 
 class RobotRemoteServer2():
     _Tcp_Server = None
 
-    def _tcp_server_thread(self):
-        self._Tcp_Server = socketserver.TCPServer((HOST, ROBOT_PORT2), RobotHandleTcpServer)
-        self._Tcp_Server.serve_forever()
-
     def send_response_status(self, status):
-        global _ExitFlag
         global _PyRobotResponse
 
         _PyRobotResponse = status
+        _StatusSent.clear()
 
-        t = threading.Thread(target=self._tcp_server_thread)
+        try:
+            self._Tcp_Server = StatusTcpServer((HOST, ROBOT_PORT2), RobotHandleTcpServer)
+        except OSError:
+            traceback.print_exc()
+            return
+
+        # A short poll interval so the shutdown below does not wait out the default 0.5 seconds
+        t = threading.Thread(target=self._Tcp_Server.serve_forever, kwargs={'poll_interval': 0.05})
         t.start()
 
         try:
             print(f"Waiting for connection to robot client testcases on {HOST}:{ROBOT_PORT2}")
-            count = 20  # wait for 10 seconds to client to respond
-            while t.is_alive():
-                t.join(0.5)
-                count = count - 1
-                if _ExitFlag or count == 0:
-                    self._Tcp_Server.shutdown()
-                    _ExitFlag = False
-                    count = 0
+            # Returns as soon as the status is read, or after the timeout
+            _StatusSent.wait(STATUS_WAIT_TIMEOUT)
         except KeyboardInterrupt:
             pass
         except Exception:
             traceback.print_exc()
+        finally:
+            self._Tcp_Server.shutdown()
+            self._Tcp_Server.server_close()
+            t.join()
+
+
+#
+# The kernel boot id on Linux, else an id made when PyRobotRemote starts (once per boot)
+#
+def _get_boot_id():
+    global _BootId
+
+    if _BootId is None:
+        try:
+            with open('/proc/sys/kernel/random/boot_id', 'r') as fp:
+                _BootId = fp.read().strip()
+        except OSError:
+            _BootId = uuid.uuid4().hex
+    return _BootId
+
+
+#
+# Tell the registered host listener that the remote servers are listening
+#
+def notify_online():
+    online_listener_file = os.path.join(os.getcwd(), ONLINE_LISTENER_FILE)
+    try:
+        with open(online_listener_file, 'r') as fp:
+            listener = json.load(fp)
+    except (OSError, ValueError):
+        return False
+
+    message = json.dumps({'event': 'online', 'boot_id': _get_boot_id(), 'version': RobotRemoteVersion}) + '\n'
+    deadline = time.monotonic() + ONLINE_NOTIFY_TIMEOUT
+    delay = 0.25
+    while True:
+        try:
+            with socket.create_connection((listener['host'], listener['port']), timeout=5) as s:
+                s.sendall(message.encode('utf-8'))
+                s.recv(16)
+            print(f"Sent online notification to {listener['host']}:{listener['port']}")
+            return True
+        except OSError as e:
+            # The network may not be up yet
+            if time.monotonic() >= deadline:
+                print(f"Unable to send online notification to {listener['host']}:{listener['port']}: {e}")
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 5)
 
 
 def _print_error(msg):
@@ -250,37 +507,35 @@ def process_staged_actions():
     # This function will process a list of things to do.
     #
 
-    staged_actions_file = os.path.join(os.getcwd(), STAGED_ACTIONS_FILE)
-
-    staged_actions = []
+    staged_actions = _get_staged_actions()
 
-    try:
-        with open(staged_actions_file, "r") as fp:
-            staged_actions = json.load(fp)
-        os.remove(staged_actions_file)
-    except FileNotFoundError:
+    if not staged_actions.exists():
         print("No staged actions to process")
         return
 
-    if not isinstance(staged_actions, list):
-        _print_error("Staged actions is not a list.")
+    try:
+        (actions, done) = staged_actions.load()
+    except Exception as e:
+        staged_actions.clear()
+        _print_error(f"Unable to read the staged actions. {e}")
         send_response('Continue')
         return
 
-    staged_actions_copy = staged_actions.copy()
-    if len(staged_actions_copy) == 0:
+    if done >= len(actions):
         print("No staged actions left")
+        staged_actions.clear()
         send_response('Continue')
         return
 
-    for element in staged_actions_copy:
-        if len(element) != 5:
-            _print_error(f"Invalid number of elements({len(element)}) in a staged action")
+    for index in range(done, len(actions)):
+        element = actions[index]
+        if (not isinstance(element, list)) or (len(element) != 5):
+            staged_actions.clear()
+            _print_error(f"Invalid staged action {element}")
             send_response('Continue')
             return
 
         print(f"Processing staged action {element[0]} {element[1]} {element[2]} {element[3]} {element[4]}")
-        staged_actions.remove(element)
 
         if element[0] == 'GetVariable':
             _read_uefi_variable_to_file(element[1], element[2], element[3])
@@ -289,30 +544,101 @@ def process_staged_actions():
             _set_uefi_variable_from_file(element[1], element[2], element[3], element[4])
 
         elif element[0] == 'ResetSystem':
+            # Record the reset as done first, so it is not repeated after the reboot
+            staged_actions.mark_done(index + 1)
             send_response(element[0])
-            with open(staged_actions_file, "w") as fp:
-                json.dump(staged_actions, fp)
-                fp.truncate()
 
             time.sleep(2)
-            os.system("shutdown -r -t 1")
+            os.system(REBOOT_COMMAND)
             while True:
                 time.sleep(10)
                 print('Waiting for restart')
 
         else:
+            staged_actions.clear()
             _print_error(f"Error processing staged actions. Invalid action {element[0]}")
             send_response('Continue')
             return
 
-    if len(staged_actions) != 0:
-        _print_error(f"Staged actions not empty\nStaged actions = {staged_actions}")
+        staged_actions.mark_done(index + 1)
+
+    staged_actions.clear()
 
     send_response('Continue')
 
     return
 
 
+#
+# Operations served on the framed transport.  Each returns (result, data) where data is the
+# raw binary part of the response.
+#
+def create_framed_handlers(remote):
+
+    def get_variable(args, data):
+        (rc, var, errorstring) = remote.GetUefiVariable(args['name'], args['guid'], args.get('trim'))
+        return ({'rc': rc, 'error': str(errorstring) if errorstring is not None else None}, var)
+
+    def set_variable(args, data):
+        return (remote.SetUefiVariable(args['name'], args['guid'], attrs=args.get('attrs'), contents=data), None)
+
+    def read_staged_file(args, data):
+        (status, contents) = remote.ReadStagedFile(args['name'])
+        if status == '1':
+            return ({'status': status, 'error': None}, contents)
+        return ({'status': status, 'error': contents}, None)
+
+    def write_staged_file(args, data):
+        (status, error) = remote.WriteStagedFile(args['name'], data)
+        return ({'status': status, 'error': error}, None)
+
+    def write_staged_action(args, data):
+        remote.write_staged_action(args['cmd'], args.get('arg1'), args.get('arg2'), args.get('arg3'), args.get('arg4'))
+        return (None, None)
+
+    #
+    # args['operations'] is the UefiVariableBatch list without the contents.  Set operations
+    # carry a length instead, and their contents are concatenated in data in order.  The
+    # contents of the Get results are concatenated in the response data the same way.
+    #
+    def variable_batch(args, data):
+        data = memoryview(data)
+        operations = []
+        offset = 0
+        for operation in args['operations']:
+            if operation[0] == 'Set':
+                length = operation[4]
+                operations.append(operation[:4] + [data[offset:offset + length].tobytes()])
+                offset += length
+            else:
+                operations.append(operation)
+
+        results = []
+        contents = []
+        for result in remote.UefiVariableBatch(operations):
+            if isinstance(result, tuple):
+                (rc, var, errorstring) = result
+                var = var if var is not None else b''
+                contents.append(var)
+                results.append([rc, len(var), errorstring])
+            else:
+                results.append(result)
+        return (results, b''.join(contents))
+
+    def get_status(args, data):
+        return ({'status': _PyRobotResponse,
+                 'version': RobotRemoteVersion,
+                 'reboot_complete': remote.is_reboot_complete()}, None)
+
+    return {'GetVariable': get_variable,
+            'SetVariable': set_variable,
+            'ReadStagedFile': read_staged_file,
+            'WriteStagedFile': write_staged_file,
+            'WriteStagedAction': write_staged_action,
+            'VariableBatch': variable_batch,
+            'GetStatus': get_status}
+
+
 def pre_robot_framework_notifications():
     try:
         process_staged_actions()
@@ -337,11 +663,27 @@ if __name__ == '__main__':
     logger.addHandler(console)
 
     # Display IP address for convenience of tester
-    os.system('ipconfig | findstr IPv4')
+    if os.name == 'nt':
+        os.system('ipconfig | findstr IPv4')
+    else:
+        os.system('hostname -I')
+
+    remote = UefiRemoteTesting()
+
+    #
+    # The framed transport is available while the staged actions run, so the host can
+    # read the status on the same connection it uses for everything else.
+    #
+    framed_server = FramedServer((HOST, ROBOT_PORT3), create_framed_handlers(remote))
+    framed_server.start()
 
     pre_robot_framework_notifications()
 
-    RobotRemoteServer(UefiRemoteTesting(), host=HOST, port=ROBOT_PORT1)
+    # The server is listening once created; notify the host, then serve
+    robot_server = RobotRemoteServer(remote, host=HOST, port=ROBOT_PORT1, serve=False)
+    threading.Thread(target=notify_online, daemon=True).start()
+    robot_server.serve()
 
+    framed_server.shutdown()
     logging.shutdown()
     sys.exit(0)
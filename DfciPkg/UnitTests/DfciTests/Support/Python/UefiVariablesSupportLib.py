@@ -1,22 +1,206 @@
 # @file
 #
-# Python lib to support Reading and writing UEFI variables from windows
+# Python lib to support Reading and writing UEFI variables from windows or linux (efivarfs)
 #
 # Copyright (c), Microsoft Corporation
 # SPDX-License-Identifier: BSD-2-Clause-Patent
 
 import os, sys
+import errno
+import struct
+import threading
 from ctypes import *
 import logging
-import pywintypes
-import win32api, win32process, win32security, win32file
-import winerror
 
-kernel32 = windll.kernel32
+if os.name == 'nt':
+    import pywintypes
+    import win32api, win32process, win32security, win32file
+    import winerror
+
+    kernel32 = windll.kernel32
+
 EFI_VAR_MAX_BUFFER_SIZE = 1024*1024
+# Initial size of the per instance read buffer.  It grows as needed up to EFI_VAR_MAX_BUFFER_SIZE.
+EFI_VAR_INITIAL_BUFFER_SIZE = 4*1024
+
+ERROR_INSUFFICIENT_BUFFER = 122
+
+EFI_VARIABLE_NON_VOLATILE = 0x00000001
+EFI_VARIABLE_BOOTSERVICE_ACCESS = 0x00000002
+EFI_VARIABLE_RUNTIME_ACCESS = 0x00000004
+EFI_VARIABLE_APPEND_WRITE = 0x00000040
+
+# Attributes used by SetFirmwareEnvironmentVariable when none are given
+EFI_VARIABLE_DEFAULT_ATTRIBUTES = EFI_VARIABLE_NON_VOLATILE | EFI_VARIABLE_BOOTSERVICE_ACCESS | EFI_VARIABLE_RUNTIME_ACCESS
+
+# Where the linux kernel mounts efivarfs
+EFIVARFS_ROOT = '/sys/firmware/efi/efivars'
 
+# Linux inode flag ioctls, used to clear the immutable flag efivarfs sets on most variables
+FS_IOC_GETFLAGS = 0x80086601
+FS_IOC_SETFLAGS = 0x40086602
+FS_IMMUTABLE_FL = 0x00000010
+
+
+##
+## UEFI variable access.  The backend is selected by name:
+##
+##   win32    - GetFirmwareEnvironmentVariableW/SetFirmwareEnvironmentVariableExW (Windows)
+##   efivarfs - the files of an efivarfs mount (Linux)
+##
+## The default is win32 on Windows and efivarfs everywhere else.  UEFI_VARIABLE_BACKEND and
+## UEFI_EFIVARFS_ROOT in the environment override the backend and the efivarfs root.  With
+## the root pointed at an ordinary directory, the efivarfs backend keeps the variables there
+## as files, so the tools can be run without UEFI hardware.
+##
 class UefiVariable(object):
 
+    def __init__(self, backend=None, efivarfs_root=None):
+        if backend is None:
+            backend = os.environ.get('UEFI_VARIABLE_BACKEND', 'win32' if os.name == 'nt' else 'efivarfs')
+
+        if backend == 'win32':
+            self.backend = Win32UefiVariable()
+        elif backend == 'efivarfs':
+            self.backend = EfiVarFsUefiVariable(efivarfs_root)
+        else:
+            raise Exception("Unknown UEFI variable backend %s" % backend)
+
+    #
+    #Function to get variable
+    # return a tuple of error code and variable data as bytes.  The backends read into a
+    # reused buffer under a lock and return a copy, so GetUefiVar may be called from any thread.
+    #
+    def GetUefiVar(self, name, guid):
+        return self.backend.GetUefiVar(name, guid)
+
+    #
+    #Function to set variable
+    # return a tuple of boolean status, errorcode, errorstring (None if not error)
+    #
+    def SetUefiVar(self, name, guid, var=None, attrs=None):
+        return self.backend.SetUefiVar(name, guid, var, attrs)
+
+
+##
+## efivarfs backend.  Each variable is the file Name-guid under the root, holding the 4 byte
+## little endian attributes followed by the data.
+##
+class EfiVarFsUefiVariable(object):
+
+    def __init__(self, root=None):
+        if root is None:
+            root = os.environ.get('UEFI_EFIVARFS_ROOT', EFIVARFS_ROOT)
+        self.root = root
+        # A plain directory stands in for efivarfs; emulate what the kernel does on writes
+        self.emulated = os.path.realpath(root) != EFIVARFS_ROOT
+        if self.emulated:
+            os.makedirs(root, exist_ok=True)
+        self._buffer = bytearray(EFI_VAR_INITIAL_BUFFER_SIZE)
+        self._lock = threading.Lock()
+
+    def VariablePath(self, name, guid):
+        return os.path.join(self.root, "%s-%s" % (name, guid.strip("{}").lower()))
+
+    def GetUefiVar(self, name, guid):
+        path = self.VariablePath(name, guid)
+        logging.info("Reading efivarfs variable %s" % path)
+        with self._lock:
+            return self._ReadVariable(path)
+
+    def _ReadVariable(self, path):
+        try:
+            with open(path, 'rb', buffering=0) as f:
+                # Size the buffer from the file, then read until the end in case it changed
+                size = os.fstat(f.fileno()).st_size
+                if len(self._buffer) <= size:
+                    self._buffer = bytearray(size + 1)
+                length = 0
+                while True:
+                    count = f.readinto(memoryview(self._buffer)[length:])
+                    if not count:
+                        break
+                    length += count
+                    if length == len(self._buffer):
+                        # The view passed to readinto may still be held, so extend into a new buffer
+                        self._buffer = self._buffer + bytearray(len(self._buffer))
+        except OSError as e:
+            logging.error('Unable to read %s: %s' % (path, e))
+            return (e.errno, None, e)
+
+        if length < 4:
+            e = OSError(errno.EIO, "Variable file is too short", path)
+            logging.error(str(e))
+            return (e.errno, None, e)
+        return (0, bytes(memoryview(self._buffer)[4:length]), None)
+
+    #
+    # efivarfs marks most variables immutable; clear the flag so the variable can be written
+    #
+    def _ClearImmutable(self, path):
+        import fcntl
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            flags = bytearray(struct.pack('i', 0))
+            fcntl.ioctl(fd, FS_IOC_GETFLAGS, flags)
+            value = struct.unpack('i', flags)[0]
+            if value & FS_IMMUTABLE_FL:
+                fcntl.ioctl(fd, FS_IOC_SETFLAGS, struct.pack('i', value & ~FS_IMMUTABLE_FL))
+        finally:
+            os.close(fd)
+
+    def _Delete(self, path):
+        if not self.emulated and os.path.exists(path):
+            self._ClearImmutable(path)
+        os.remove(path)
+
+    def _Write(self, path, attrs, var):
+        if self.emulated:
+            if (attrs & EFI_VARIABLE_APPEND_WRITE) and os.path.exists(path):
+                with open(path, 'rb') as f:
+                    data = f.read() + bytes(var)
+            else:
+                data = struct.pack('<I', attrs & ~EFI_VARIABLE_APPEND_WRITE) + bytes(var)
+            temp = path + '.tmp'
+            with open(temp, 'wb') as f:
+                f.write(data)
+            os.replace(temp, path)
+            return
+
+        if os.path.exists(path):
+            self._ClearImmutable(path)
+        # efivarfs requires the attributes and data in a single write
+        data = struct.pack('<I', attrs) + bytes(var)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            written = os.write(fd, data)
+        finally:
+            os.close(fd)
+        if written != len(data):
+            raise OSError(errno.EIO, "Short write of variable", path)
+
+    def SetUefiVar(self, name, guid, var=None, attrs=None):
+        path = self.VariablePath(name, guid)
+        attrs = EFI_VARIABLE_DEFAULT_ATTRIBUTES if attrs is None else int(attrs)
+        var = var if var is not None else bytes(0)
+        logging.info("Writing efivarfs variable %s length=0x%X attributes=0x%X" % (path, len(var), attrs))
+        try:
+            if len(var) == 0 and not (attrs & EFI_VARIABLE_APPEND_WRITE):
+                # A zero length set deletes the variable
+                self._Delete(path)
+            else:
+                self._Write(path, attrs, var)
+        except OSError as e:
+            logging.error('Unable to write %s: %s' % (path, e))
+            return (0, e.errno, e)
+        return (1, 0, None)
+
+
+##
+## Windows backend
+##
+class Win32UefiVariable(object):
+
     def __init__(self):
         # enable required SeSystemEnvironmentPrivilege privilege
         privilege = win32security.LookupPrivilegeValue( None, 'SeSystemEnvironmentPrivilege' )
@@ -24,6 +208,10 @@ class UefiVariable(object):
         win32security.AdjustTokenPrivileges( token, False, [(privilege, win32security.SE_PRIVILEGE_ENABLED)] )
         win32api.CloseHandle( token )
 
+        # Read buffer reused by every GetUefiVar, under _lock
+        self._buffer = create_string_buffer( EFI_VAR_INITIAL_BUFFER_SIZE )
+        self._lock = threading.Lock()
+
         # import firmware variable API
         try:
             self._GetFirmwareEnvironmentVariable = kernel32.GetFirmwareEnvironmentVariableW
@@ -62,20 +250,31 @@ class UefiVariable(object):
 
     #
     #Function to get variable
-    # return a tuple of error code and variable data as string
+    # return a tuple of error code and variable data as bytes copied from the read buffer.
+    # The buffer starts small and is grown when the variable does not fit.
     #
     def GetUefiVar(self, name, guid ):
+        with self._lock:
+            return self._ReadVariable(name, guid)
+
+    def _ReadVariable(self, name, guid ):
         err = 0 #success
-        efi_var = create_string_buffer( EFI_VAR_MAX_BUFFER_SIZE )
+        length = 0
         if self._GetFirmwareEnvironmentVariable is not None:
             logging.info("calling GetFirmwareEnvironmentVariable( name='%s', GUID='%s' ).." % (name, "{%s}" % guid) )
-            length = self._GetFirmwareEnvironmentVariable( name, "{%s}" % guid, efi_var, EFI_VAR_MAX_BUFFER_SIZE )
-        if (0 == length) or (efi_var is None):
-            err = kernel32.GetLastError()
+            while True:
+                length = self._GetFirmwareEnvironmentVariable( name, "{%s}" % guid, self._buffer, len(self._buffer) )
+                if length != 0:
+                    break
+                err = kernel32.GetLastError()
+                if (err != ERROR_INSUFFICIENT_BUFFER) or (len(self._buffer) >= EFI_VAR_MAX_BUFFER_SIZE):
+                    break
+                self._buffer = create_string_buffer( min(len(self._buffer) * 4, EFI_VAR_MAX_BUFFER_SIZE) )
+        if 0 == length:
             logging.error( 'GetFirmwareEnvironmentVariable[Ex] failed (GetLastError = 0x%x)' %  err)
-            logging.error(WinError())
+            logging.error(WinError(err))
             return (err, None, WinError(err))
-        return (err, efi_var[:length], None)
+        return (0, bytes(memoryview(self._buffer).cast('B')[:length]), None)
     #
     #Function to set variable
     # return a tuple of boolean status, errorcode, errorstring (None if not error)
@@ -23,12 +23,12 @@ import subprocess
 #set signtool path --
 #  Requires the windows 8.1 kit.
 #  only works on 64bit systems but all dev machines should be 64bit by now.
-gSignToolPath = os.path.join(os.getenv("ProgramFiles(x86)"), "Windows Kits", "10", "bin", "10.0.18362.0", "x64", "signtool.exe")
+gSignToolPath = os.path.join(os.getenv("ProgramFiles(x86)", ""), "Windows Kits", "10", "bin", "10.0.18362.0", "x64", "signtool.exe")
 
 #
 # Cert Manager is used for deleting the cert when add/removing certs
 #
-gCertMgrPath = os.path.join(os.getenv("ProgramFiles(x86)"), "Windows Kits", "10", "bin", "10.0.18363.0", "x64", "certmgr.exe")
+gCertMgrPath = os.path.join(os.getenv("ProgramFiles(x86)", ""), "Windows Kits", "10", "bin", "10.0.18363.0", "x64", "certmgr.exe")
 
 #
 # Cert Util is used to import PFX into cert store
@@ -123,53 +123,59 @@ def SignWithSignTool(ToSignFilePath, DetachedSignatureOutputFilePath, PfxFile, P
     shutil.move(signedfile, DetachedSignatureOutputFilePath)
     return ret
 
+#
+# Translate table for the ascii column of a hex dump.  Printable ascii is kept, everything
+# else is shown as '.'
+#
+gHexDumpAsciiTable = bytes(c if (0x20 <= c <= 0x7E) else ord(".") for c in range(256))
+
+# Lines of a hex dump joined into each write
+gHexDumpLinesPerWrite = 4096
+
+###
+# Generate the lines of a hex dump of a buffer, 16 bytes per line, each ending in a newline.
+# Same format as PrintByteList.  ByteList is any bytes like object (or a list of ints), and
+# is not copied.
+###
+def HexDumpLines(ByteList, IncludeAscii=True, IncludeOffset=True, IncludeHexSep=True, OffsetStart=0):
+    try:
+        view = memoryview(ByteList).cast('B')
+    except TypeError:
+        view = memoryview(bytes(ByteList))
+    HexSep = " -" if IncludeHexSep else ""
+    length = len(view)
+
+    for index in range(0, length, 16):
+        line = view[index:index + 16]
+        #Hex bytes as " 0xAB", with the separator before the 9th byte
+        text = " 0x" + line[:8].hex(" ").upper().replace(" ", " 0x")
+        if len(line) > 8:
+            text += HexSep + " 0x" + line[8:].hex(" ").upper().replace(" ", " 0x")
+        if IncludeOffset:
+            text = ("0x%04X -" % (index + OffsetStart)) + text
+
+        if IncludeAscii:
+            if len(line) < 16:
+                #Pad a partial line so the ascii column lines up
+                text += "     " * (16 - len(line))
+                if (len(line) <= 8) and IncludeOffset:
+                    text += "  "
+            text += " " + line.tobytes().translate(gHexDumpAsciiTable).decode("ascii")
+        yield text + "\n"
+
 ###
 # Function to print a byte list as hex and optionally output ascii as well as
-# offset within the buffer
+# offset within the buffer.  Written to OutFile, sys.stdout if None.
 ###
-def PrintByteList(ByteList, IncludeAscii=True, IncludeOffset=True, IncludeHexSep=True, OffsetStart=0):
-    Ascii = ""
-    for index in range(len(ByteList)):
-        #Start of New Line
-        if(index % 16 == 0):
-            if(IncludeOffset):
-                print("0x%04X -" % (index + OffsetStart), end='')
-
-        #Midpoint of a Line
-        if(index % 16 == 8):
-            if(IncludeHexSep):
-                print(" -", end='')
-
-        #Print As Hex Byte
-        print(" 0x%02X" % ByteList[index], end='')
-
-        #Prepare to Print As Ascii
-        if(ByteList[index] < 0x20) or (ByteList[index] > 0x7E):
-            Ascii += "."
-        else:
-            Ascii += ("%c" % ByteList[index])
-
-        #End of Line
-        if(index % 16 == 15):
-            if(IncludeAscii):
-                print(" %s" % Ascii, end='')
-            Ascii = ""
-            print("")
-
-    #Done - Lets check if we have partial
-    if(index % 16 != 15):
-        #Lets print any partial line of ascii
-        if(IncludeAscii) and (Ascii != ""):
-            #Pad out to the correct spot
-
-            while(index % 16 != 15):
-                print("     ", end='')
-                if(index % 16 == 7):  #acount for the - symbol in the hex dump
-                    if(IncludeOffset):
-                        print("  ", end='')
-                index += 1
-            #print the ascii partial line
-            print(" %s" % Ascii, end='')
-            #print a single newline so that next print will be on new line
-        print("")
+def PrintByteList(ByteList, IncludeAscii=True, IncludeOffset=True, IncludeHexSep=True, OffsetStart=0, OutFile=None):
+    if OutFile is None:
+        OutFile = sys.stdout
+    lines = []
+    for line in HexDumpLines(ByteList, IncludeAscii, IncludeOffset, IncludeHexSep, OffsetStart):
+        lines.append(line)
+        if len(lines) == gHexDumpLinesPerWrite:
+            OutFile.write("".join(lines))
+            lines = []
+    if lines:
+        OutFile.write("".join(lines))
 